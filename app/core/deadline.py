@@ -0,0 +1,73 @@
+"""
+Дедлайны для сквозной отмены долгих операций (дайджесты, LLM, Tracker)
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Бюджет времени операции исчерпан"""
+
+
+class Deadline:
+    """Абсолютный дедлайн, который передается вниз по цепочке вызовов"""
+
+    def __init__(self, timeout: float):
+        """
+        Args:
+            timeout: Бюджет времени в секундах от текущего момента
+        """
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        """Оставшееся время в секундах (не меньше нуля)"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        """Истек ли дедлайн"""
+        return self.remaining() <= 0
+
+    def check(self, stage: str = ""):
+        """Бросить DeadlineExceeded, если время вышло"""
+        if self.expired:
+            raise DeadlineExceeded(f"Истек дедлайн{f' на этапе {stage}' if stage else ''}")
+
+    def extend(self, timeout: float):
+        """Продлить дедлайн, чтобы от текущего момента осталось не меньше timeout секунд"""
+        self.expires_at = max(self.expires_at, time.monotonic() + timeout)
+
+    def clamp(self, timeout: Optional[float]) -> float:
+        """Ограничить таймаут нижележащего вызова оставшимся бюджетом"""
+        remaining = self.remaining()
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
+
+    async def run(self, awaitable: Awaitable[T], stage: str = "") -> T:
+        """
+        Выполнить корутину в пределах оставшегося бюджета.
+
+        При истечении дедлайна корутина отменяется (вместе с HTTP-запросом
+        внутри нее) и бросается DeadlineExceeded.
+        """
+        if self.expired:
+            # Корутина так и не будет запущена - закрываем, чтобы не было предупреждений
+            close = getattr(awaitable, "close", None)
+            if close:
+                close()
+            self.check(stage)
+        try:
+            return await asyncio.wait_for(awaitable, timeout=self.remaining())
+        except asyncio.TimeoutError as e:
+            if isinstance(e, DeadlineExceeded):
+                raise
+            raise DeadlineExceeded(f"Истек дедлайн{f' на этапе {stage}' if stage else ''}") from e
+
+    def __repr__(self) -> str:
+        return f"Deadline(remaining={self.remaining():.1f}s)"
@@ -0,0 +1,161 @@
+"""
+Инкрементальный дайджест: снимки состояния задач и их разность
+"""
+
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def issue_sort_key(key: str) -> Tuple[str, int, str]:
+    """Ключ сортировки задач: QUEUE-9 раньше QUEUE-10"""
+    prefix, _, number = key.rpartition('-')
+    return (prefix, int(number), '') if number.isdigit() else (key, -1, key)
+
+
+@dataclass
+class IssueState:
+    """Состояние задачи, сохраняемое в снимке"""
+    key: str
+    status: str
+    assignee: str
+    summary: str
+    updated: Optional[str] = None
+
+    @classmethod
+    def from_issue(cls, issue: Dict[str, Any]) -> 'IssueState':
+        return cls(
+            key=str(issue.get('key', '')),
+            status=str(issue.get('status') or ''),
+            assignee=str(issue.get('assignee') or ''),
+            summary=str(issue.get('summary') or ''),
+            updated=str(issue['updated']) if issue.get('updated') else None
+        )
+
+    def to_row(self) -> List[Optional[str]]:
+        return [self.key, self.status, self.assignee, self.summary, self.updated]
+
+
+@dataclass
+class StatusTransition:
+    """Смена статуса задачи"""
+    issue: Dict[str, Any]
+    from_status: str
+    to_status: str
+
+
+@dataclass
+class Reassignment:
+    """Смена исполнителя задачи"""
+    issue: Dict[str, Any]
+    from_assignee: str
+    to_assignee: str
+
+
+@dataclass
+class DigestDiff:
+    """Изменения в очереди между двумя снимками"""
+    new: List[Dict[str, Any]] = field(default_factory=list)
+    transitions: List[StatusTransition] = field(default_factory=list)
+    reassigned: List[Reassignment] = field(default_factory=list)
+    closed: List[StatusTransition] = field(default_factory=list)
+    removed: List[IssueState] = field(default_factory=list)
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.new or self.transitions or self.reassigned or self.closed or self.removed)
+
+    def changed_issues(self) -> List[Dict[str, Any]]:
+        """Задачи текущего состояния, затронутые изменениями (без повторов)"""
+        issues: Dict[str, Dict[str, Any]] = {}
+        for issue in self.new:
+            issues[issue['key']] = issue
+        for change in self.transitions + self.closed + self.reassigned:
+            issues[change.issue['key']] = change.issue
+        return [issues[key] for key in sorted(issues, key=issue_sort_key)]
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            "new": len(self.new),
+            "transitions": len(self.transitions),
+            "reassigned": len(self.reassigned),
+            "closed": len(self.closed),
+            "removed": len(self.removed)
+        }
+
+
+def encode_snapshot(states: List[IssueState]) -> str:
+    """Сериализовать снимок (задачи отсортированы по ключу)"""
+    return json.dumps([state.to_row() for state in states], ensure_ascii=False, separators=(',', ':'))
+
+
+def decode_snapshot(payload: str) -> List[IssueState]:
+    """Прочитать снимок"""
+    return [IssueState(*row) for row in json.loads(payload)]
+
+
+def build_snapshot(issues: List[Dict[str, Any]]) -> List[IssueState]:
+    """Снимок текущего состояния задач, отсортированный по ключу"""
+    return sorted((IssueState.from_issue(issue) for issue in issues if issue.get('key')),
+                  key=lambda state: issue_sort_key(state.key))
+
+
+def merge_snapshots(previous: List[IssueState], current: List[IssueState]) -> List[IssueState]:
+    """Дополнить неполный текущий снимок задачами из предыдущего"""
+    states = {state.key: state for state in previous}
+    states.update((state.key, state) for state in current)
+    return [states[key] for key in sorted(states, key=issue_sort_key)]
+
+
+def diff_snapshots(previous: List[IssueState], issues: List[Dict[str, Any]], complete: bool = True,
+                   is_closed=None) -> Tuple[DigestDiff, List[IssueState]]:
+    """
+    Сравнить снимок с текущими задачами слиянием двух отсортированных списков
+
+    Args:
+        previous: Предыдущий снимок, отсортированный по ключу
+        issues: Текущие задачи очереди
+        complete: Получены ли все задачи очереди (иначе пропавшие не считаются удаленными)
+        is_closed: Функция status -> bool для отделения закрытий от прочих смен статуса
+
+    Returns:
+        Разность и новый снимок
+    """
+    current = sorted((issue for issue in issues if issue.get('key')), key=lambda issue: issue_sort_key(str(issue['key'])))
+    snapshot = [IssueState.from_issue(issue) for issue in current]
+    diff = DigestDiff()
+
+    old_index = new_index = 0
+    while old_index < len(previous) or new_index < len(current):
+        old_state = previous[old_index] if old_index < len(previous) else None
+        issue = current[new_index] if new_index < len(current) else None
+        new_state = snapshot[new_index] if issue is not None else None
+
+        if new_state is None or (old_state is not None and issue_sort_key(old_state.key) < issue_sort_key(new_state.key)):
+            if complete:
+                diff.removed.append(old_state)
+            old_index += 1
+            continue
+        if old_state is None or issue_sort_key(new_state.key) < issue_sort_key(old_state.key):
+            diff.new.append(issue)
+            new_index += 1
+            continue
+
+        if old_state.status != new_state.status:
+            transition = StatusTransition(issue, old_state.status, new_state.status)
+            if is_closed and is_closed(new_state.status) and not is_closed(old_state.status):
+                diff.closed.append(transition)
+            else:
+                diff.transitions.append(transition)
+        if old_state.assignee != new_state.assignee:
+            diff.reassigned.append(Reassignment(issue, old_state.assignee, new_state.assignee))
+        old_index += 1
+        new_index += 1
+
+    if not complete:
+        snapshot = merge_snapshots(previous, snapshot)
+    logger.info(f"Разность снимков: {diff.counts()}")
+    return diff, snapshot
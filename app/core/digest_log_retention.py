@@ -0,0 +1,78 @@
+"""
+Хранение журнала дайджестов: удаление текстов, прореживание и очистка старых записей
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.core.digest_payload import decode_payload, encode_payload, merge_payloads
+from app.models.database import db_session
+from app.models.digest_log import DigestLog
+
+logger = logging.getLogger(__name__)
+
+# Сколько дней до границы прореживания просматривать за один запуск
+# (с запасом на пропущенные запуски)
+COMPACTION_LOOKBACK_DAYS = 7
+
+
+def compact_digest_logs(now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Уменьшить журнал дайджестов
+
+    1. У записей старше DIGEST_LOG_TEXT_RETENTION_DAYS удаляется HTML-текст
+       (структура в payload остается).
+    2. Записи старше DIGEST_LOG_COMPACT_AFTER_DAYS прореживаются до одной
+       на пользователя, очередь и день: структуры дня объединяются в
+       последнюю запись, остальные удаляются.
+    3. Записи старше DIGEST_LOG_RETENTION_DAYS удаляются.
+
+    Args:
+        now: Текущее время (для тестов)
+
+    Returns:
+        Количество обработанных записей по этапам
+    """
+    now = now or datetime.now()
+    text_cutoff = now - timedelta(days=settings.DIGEST_LOG_TEXT_RETENTION_DAYS)
+    compact_cutoff = now - timedelta(days=settings.DIGEST_LOG_COMPACT_AFTER_DAYS)
+    retention_cutoff = now - timedelta(days=settings.DIGEST_LOG_RETENTION_DAYS)
+    stats = {"texts_dropped": 0, "compacted": 0, "deleted": 0}
+
+    with db_session() as db:
+        stats["texts_dropped"] = db.query(DigestLog).filter(
+            DigestLog.created_at < text_cutoff,
+            DigestLog.digest_text.isnot(None)
+        ).update({DigestLog.digest_text: None}, synchronize_session=False)
+
+        stats["deleted"] = db.query(DigestLog).filter(
+            DigestLog.created_at < retention_cutoff
+        ).delete(synchronize_session=False)
+
+        rows = db.query(DigestLog).filter(
+            DigestLog.created_at < compact_cutoff,
+            DigestLog.created_at >= compact_cutoff - timedelta(days=COMPACTION_LOOKBACK_DAYS)
+        ).order_by(DigestLog.user_id, DigestLog.queue_key, DigestLog.created_at).all()
+
+        days: Dict[Tuple[int, str, object], List[DigestLog]] = {}
+        for row in rows:
+            days.setdefault((row.user_id, row.queue_key, row.created_at.date()), []).append(row)
+
+        for day_rows in days.values():
+            if len(day_rows) < 2:
+                continue
+            keep = day_rows[-1]
+            payloads = [payload for payload in (decode_payload(row.payload) for row in day_rows) if payload]
+            if payloads:
+                keep.payload = encode_payload(merge_payloads(payloads))
+            keep.issues_count = sum(row.issues_count or 0 for row in day_rows)
+            for row in day_rows[:-1]:
+                db.delete(row)
+                stats["compacted"] += 1
+
+        db.commit()
+
+    logger.info(f"Компактизация журнала дайджестов: {stats}")
+    return stats
@@ -0,0 +1,141 @@
+"""
+Параллельная генерация дайджестов по нескольким очередям и пользователям
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from app.core.deadline import Deadline
+from app.core.digest_service import DigestService
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DigestJob:
+    """Дайджест одной очереди для одного пользователя"""
+    user_id: int
+    chat_id: str
+    queue_key: str
+    deadline: Optional[Deadline] = None
+    since_hours: int = 24
+    two_phase: bool = False
+    refresh: bool = False  # Дозапрос изменений после подготовленного дайджеста
+    fast: bool = False  # Без LLM: статусы по словарю, резюме по статистике
+    # Общий дайджест по нескольким очередям (queue_key - подпись для логов)
+    queue_keys: List[str] = field(default_factory=list)
+    # Подготовка заранее: журнал, отметка и снимок пишутся только после доставки
+    defer_writes: bool = False
+
+
+@dataclass
+class DigestResult:
+    """Готовый дайджест (или ошибка) по заданию"""
+    job: DigestJob
+    text: Optional[str] = None
+    error: Optional[Exception] = None
+    elapsed: float = 0.0
+    # Двухфазный режим: text - дайджест без резюме, finalize() вернет текст с резюме
+    finalize: Optional[Callable[[], Awaitable[str]]] = None
+    # Отложенные записи в базу (defer_writes): выполняются через DigestService.commit_deferred
+    pending_writes: List[Callable[[], Any]] = field(default_factory=list)
+
+
+class DigestOrchestrator:
+    """
+    Запускает дайджесты очередей параллельно и отдает их по мере готовности
+
+    Число одновременных заданий ограничено max_parallel, а обращения к Tracker
+    и LLM внутри заданий - семафорами DigestService, поэтому медленная очередь
+    не задерживает доставку остальных.
+    """
+
+    def __init__(self, digest_service: DigestService, max_parallel: int = 16):
+        """
+        Args:
+            digest_service: Сервис дайджестов
+            max_parallel: Максимальное число одновременно выполняемых заданий
+        """
+        self.digest_service = digest_service
+        self._jobs_limit = asyncio.Semaphore(max_parallel)
+
+    async def run(self, jobs: List[DigestJob]) -> AsyncIterator[DigestResult]:
+        """
+        Выполнить задания и отдавать результаты в порядке готовности
+
+        Args:
+            jobs: Задания на генерацию дайджестов
+
+        Yields:
+            DigestResult по каждому заданию
+        """
+        if not jobs:
+            return
+        started_at = time.perf_counter()
+        # Время последних дайджестов - одним запросом на пользователя, а не на каждую очередь
+        queues_by_user: Dict[int, List[str]] = {}
+        for job in jobs:
+            queues_by_user.setdefault(job.user_id, []).extend(job.queue_keys or [job.queue_key])
+        for user_id, queue_keys in queues_by_user.items():
+            self.digest_service.preload_last_digest_times(user_id, queue_keys)
+        
+        tasks = [asyncio.ensure_future(self._run_job(job)) for job in jobs]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Получатель прервал обход - не оставляем задания висеть
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            # Отметки очередей, до которых задания не дошли (ошибка, отмена), не копятся
+            for user_id, queue_keys in queues_by_user.items():
+                self.digest_service.forget_preloaded_times(user_id, queue_keys)
+        logger.info(f"Сформировано дайджестов: {len(jobs)} за {time.perf_counter() - started_at:.1f} с")
+
+    async def _run_job(self, job: DigestJob) -> DigestResult:
+        """Сгенерировать дайджест одного задания, не пробрасывая ошибки"""
+        async with self._jobs_limit:
+            started_at = time.perf_counter()
+            pending_writes: List[Callable[[], Any]] = []
+            deferred = pending_writes if job.defer_writes else None
+            try:
+                if job.queue_keys:
+                    text = await self.digest_service.generate_combined_digest(
+                        user_id=job.user_id,
+                        queue_keys=job.queue_keys,
+                        since_hours=job.since_hours,
+                        deadline=job.deadline,
+                        refresh=job.refresh,
+                        fast=job.fast,
+                        deferred=deferred
+                    )
+                    return DigestResult(job, text=text, elapsed=time.perf_counter() - started_at,
+                                        pending_writes=pending_writes)
+                # В быстром режиме резюме готово сразу - вторая фаза не нужна
+                if job.two_phase and not job.fast:
+                    draft = await self.digest_service.generate_digest_draft(
+                        user_id=job.user_id,
+                        queue_key=job.queue_key,
+                        since_hours=job.since_hours,
+                        deadline=job.deadline
+                    )
+                    return DigestResult(job, text=draft.text, finalize=draft.finalize,
+                                        elapsed=time.perf_counter() - started_at)
+                text = await self.digest_service.generate_digest(
+                    user_id=job.user_id,
+                    queue_key=job.queue_key,
+                    since_hours=job.since_hours,
+                    deadline=job.deadline,
+                    refresh=job.refresh,
+                    fast=job.fast,
+                    deferred=deferred
+                )
+                return DigestResult(job, text=text, elapsed=time.perf_counter() - started_at,
+                                    pending_writes=pending_writes)
+            except Exception as e:
+                logger.error(f"Ошибка при генерации дайджеста для очереди {job.queue_key}: {e}")
+                return DigestResult(job, error=e, elapsed=time.perf_counter() - started_at)
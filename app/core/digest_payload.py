@@ -0,0 +1,84 @@
+"""
+Сжатое структурированное содержимое записи журнала дайджестов
+"""
+
+import json
+import zlib
+from typing import Any, Dict, List, Optional
+
+from app.core.queue_digest import QueueDigest
+
+PAYLOAD_VERSION = 1
+
+
+def build_payload(queue_digest: QueueDigest, summary: Optional[str], partial: bool = False) -> Dict[str, Any]:
+    """
+    Структура дайджеста: задачи со статусами, закрытые и новые задачи, резюме
+
+    Args:
+        queue_digest: Обработанная очередь
+        summary: Резюме изменений (None, если еще не готово)
+        partial: Дайджест частичный, хотя обработка очереди полная (например, резюме без LLM)
+
+    Returns:
+        Словарь для encode_payload
+    """
+    issues = [
+        [issue.get('key'), group, issue.get('status') or '', issue.get('assignee') or '']
+        for group, group_issues in queue_digest.status_groups.items()
+        for issue in group_issues
+    ]
+    diff = queue_digest.diff
+    return {
+        "v": PAYLOAD_VERSION,
+        "window": queue_digest.time_description,
+        "issues": issues,
+        "closed": [change.issue.get('key') for change in diff.closed] if diff else [],
+        "new": [issue.get('key') for issue in diff.new] if diff else [],
+        "summaries": [summary] if summary else [],
+        "partial": queue_digest.partial or partial,
+        "omitted": queue_digest.omitted_count,
+        "digests": 1
+    }
+
+
+def encode_payload(payload: Dict[str, Any]) -> bytes:
+    """Сериализовать и сжать структуру (JSON + zlib)"""
+    return zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 6)
+
+
+def decode_payload(data: Optional[bytes]) -> Optional[Dict[str, Any]]:
+    """Распаковать структуру (None для записей без нее)"""
+    if not data:
+        return None
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+def merge_payloads(payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Объединить структуры нескольких дайджестов (в хронологическом порядке) в одну
+
+    По каждой задаче остается последнее состояние, списки закрытых и новых
+    задач объединяются, резюме сохраняются все по порядку.
+    """
+    issues: Dict[str, List[str]] = {}
+    closed: Dict[str, None] = {}
+    new: Dict[str, None] = {}
+    summaries: List[str] = []
+    for payload in payloads:
+        for row in payload.get("issues", []):
+            issues[row[0]] = row
+        closed.update(dict.fromkeys(payload.get("closed", [])))
+        new.update(dict.fromkeys(payload.get("new", [])))
+        summaries.extend(payload.get("summaries", []))
+    return {
+        "v": PAYLOAD_VERSION,
+        "window": payloads[-1].get("window") if payloads else "",
+        "issues": list(issues.values()),
+        "closed": list(closed),
+        "new": list(new),
+        "summaries": summaries,
+        "partial": any(payload.get("partial") for payload in payloads),
+        "omitted": sum(payload.get("omitted", 0) for payload in payloads),
+        "digests": sum(payload.get("digests", 1) for payload in payloads)
+    }
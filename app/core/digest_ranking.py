@@ -0,0 +1,128 @@
+"""
+Ранжирование изменений очереди: в дайджест попадают самые значимые
+"""
+
+import heapq
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from app.core.digest_diff import DigestDiff
+
+logger = logging.getLogger(__name__)
+
+# Вес приоритета Tracker (display и key, в нижнем регистре)
+PRIORITY_WEIGHTS = {
+    'блокер': 5.0, 'blocker': 5.0,
+    'критичный': 4.0, 'critical': 4.0,
+    'высокий': 3.0, 'high': 3.0,
+    'средний': 2.0, 'normal': 2.0, 'medium': 2.0,
+    'низкий': 1.0, 'minor': 1.0, 'low': 1.0,
+    'незначительный': 0.5, 'trivial': 0.5,
+}
+DEFAULT_PRIORITY_WEIGHT = 2.0
+
+# Значимость вида изменения (по разности снимков)
+CHANGE_WEIGHTS = {
+    'closed': 3.0,
+    'blocked': 3.0,
+    'new': 2.0,
+    'transition': 1.5,
+    'reassigned': 1.0,
+}
+# Значимость группы статуса, если снимка прошлого дайджеста нет
+STATUS_GROUP_WEIGHTS = {
+    'Blocked': 3.0,
+    'Done': 2.5,
+    'In Progress': 1.5,
+    'To Do': 1.0,
+}
+
+# Изменение суточной давности весит вдвое меньше свежего
+RECENCY_HALF_LIFE_HOURS = 24.0
+# Задачи с исполнителем важнее неназначенных
+ASSIGNED_WEIGHT = 1.0
+
+
+def change_significance(diff: DigestDiff, normalize_status: Callable[[str], str]) -> Dict[str, float]:
+    """
+    Значимость изменения каждой задачи по разности снимков
+
+    Если задача изменилась несколькими способами (например, закрыта и
+    переназначена), берется самое значимое изменение.
+    """
+    significance: Dict[str, float] = {}
+
+    def note(issue: Dict[str, Any], weight: float):
+        key = issue.get('key')
+        if weight > significance.get(key, 0.0):
+            significance[key] = weight
+
+    for change in diff.closed:
+        note(change.issue, CHANGE_WEIGHTS['closed'])
+    for change in diff.transitions:
+        blocked = normalize_status(change.to_status) == 'Blocked'
+        note(change.issue, CHANGE_WEIGHTS['blocked' if blocked else 'transition'])
+    for issue in diff.new:
+        note(issue, CHANGE_WEIGHTS['new'])
+    for change in diff.reassigned:
+        note(change.issue, CHANGE_WEIGHTS['reassigned'])
+    return significance
+
+
+def _recency(updated: Any, now: datetime) -> float:
+    """Множитель свежести изменения от 0 до 1 (1 - если время изменения неизвестно)"""
+    if not updated:
+        return 1.0
+    try:
+        moment = updated if isinstance(updated, datetime) else datetime.fromisoformat(str(updated).replace('Z', '+00:00'))
+    except ValueError:
+        return 1.0
+    if moment.tzinfo is not None:
+        # Дайджесты работают с локальным временем без зоны
+        moment = moment.astimezone().replace(tzinfo=None)
+    age_hours = max((now - moment).total_seconds() / 3600, 0.0)
+    return 0.5 ** (age_hours / RECENCY_HALF_LIFE_HOURS)
+
+
+def rank_changes(issues: List[Dict[str, Any]], limit: int, significance: Callable[[Dict[str, Any]], float],
+                 now: Optional[datetime] = None) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Отобрать limit самых значимых изменений
+
+    Оценка: значимость изменения × вес приоритета × свежесть, плюс вес
+    назначенного исполнителя. Отбор кучей - O(n log limit).
+
+    Args:
+        issues: Измененные задачи
+        limit: Сколько задач оставить (0 - все)
+        significance: Значимость изменения задачи
+        now: Текущее время (для тестов)
+
+    Returns:
+        Отобранные задачи по убыванию оценки и число отброшенных
+    """
+    if not limit or len(issues) <= limit:
+        return issues, 0
+    now = now or datetime.now()
+
+    def score(issue: Dict[str, Any]) -> float:
+        priority = PRIORITY_WEIGHTS.get(str(issue.get('priority') or '').strip().lower(), DEFAULT_PRIORITY_WEIGHT)
+        assignee = (issue.get('assignee') or '').strip()
+        assigned = ASSIGNED_WEIGHT if assignee and assignee != 'Unassigned' else 0.0
+        return significance(issue) * priority * _recency(issue.get('updated'), now) + assigned
+
+    kept = heapq.nlargest(limit, issues, key=score)
+    logger.info(f"Ранжирование: оставлено {len(kept)} из {len(issues)} изменений")
+    return kept, len(issues) - len(kept)
+
+
+def trim_diff(diff: DigestDiff, keys: Set[str]) -> DigestDiff:
+    """Разность, ограниченная отобранными задачами (пропавшие задачи остаются счетчиком)"""
+    return DigestDiff(
+        new=[issue for issue in diff.new if issue.get('key') in keys],
+        transitions=[change for change in diff.transitions if change.issue.get('key') in keys],
+        reassigned=[change for change in diff.reassigned if change.issue.get('key') in keys],
+        closed=[change for change in diff.closed if change.issue.get('key') in keys],
+        removed=diff.removed
+    )
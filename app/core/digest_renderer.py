@@ -0,0 +1,149 @@
+"""
+Сборка HTML-текста дайджеста и нарезка его на сообщения Telegram
+"""
+
+import re
+from typing import Iterator, List, Tuple
+
+# Ограничение Telegram на длину текста сообщения
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+_TAG_PATTERN = re.compile(r'(<[^>]+>)')
+_TAG_NAME_PATTERN = re.compile(r'^</?\s*([a-zA-Z0-9-]+)')
+_WORD_PATTERN = re.compile(r'\S+\s*|\s+')
+
+
+class DigestBuilder:
+    """
+    Накопитель текста дайджеста
+
+    Части складываются в список и склеиваются один раз в build(),
+    вместо повторной конкатенации строк.
+    """
+
+    def __init__(self):
+        self._parts: List[str] = []
+
+    def add(self, text: str) -> 'DigestBuilder':
+        self._parts.append(text)
+        return self
+
+    def line(self, text: str = "") -> 'DigestBuilder':
+        self._parts.append(text)
+        self._parts.append("\n")
+        return self
+
+    def extend_lines(self, lines: List[str]) -> 'DigestBuilder':
+        for text in lines:
+            self._parts.append(text)
+            self._parts.append("\n")
+        return self
+
+    def build(self) -> str:
+        return "".join(self._parts)
+
+
+def _update_open_tags(open_tags: List[Tuple[str, str]], text: str):
+    """Учесть открывающие и закрывающие теги фрагмента"""
+    for token in _TAG_PATTERN.findall(text):
+        match = _TAG_NAME_PATTERN.match(token)
+        if not match:
+            continue
+        name = match.group(1).lower()
+        if token.startswith('</'):
+            for index in range(len(open_tags) - 1, -1, -1):
+                if open_tags[index][0] == name:
+                    del open_tags[index]
+                    break
+        elif not token.endswith('/>'):
+            open_tags.append((name, token))
+
+
+def _closing(open_tags: List[Tuple[str, str]]) -> str:
+    return "".join(f"</{name}>" for name, _ in reversed(open_tags))
+
+
+def _reopening(open_tags: List[Tuple[str, str]]) -> str:
+    return "".join(token for _, token in open_tags)
+
+
+def _hard_split(text: str, size: int) -> List[str]:
+    """Разрезать текст без тегов на куски, не разрывая HTML-сущности (&amp; и т.п.)"""
+    pieces = []
+    while len(text) > size:
+        cut = size
+        entity_start = text.rfind('&', 0, cut)
+        if entity_start != -1 and ';' not in text[entity_start:cut] and text.find(';', entity_start) != -1:
+            cut = entity_start or size
+        pieces.append(text[:cut])
+        text = text[cut:]
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+def _units(text: str, limit: int) -> Iterator[str]:
+    """
+    Неделимые фрагменты текста: строки целиком, а слишком длинные
+    строки - по тегам и словам
+    """
+    for line in text.splitlines(keepends=True):
+        if len(line) <= limit // 2:
+            yield line
+            continue
+        for token in _TAG_PATTERN.split(line):
+            if not token:
+                continue
+            if token.startswith('<'):
+                yield token
+                continue
+            for word in _WORD_PATTERN.findall(token):
+                if len(word) <= limit // 2:
+                    yield word
+                else:
+                    yield from _hard_split(word, limit // 2)
+
+
+def iter_message_chunks(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> Iterator[str]:
+    """
+    Нарезать HTML-текст на сообщения не длиннее limit символов
+
+    Разрез делается по границам строк (длинные строки - по словам), теги,
+    открытые на месте разреза, закрываются в конце сообщения и открываются
+    заново в начале следующего. Нарезка ленивая: первое сообщение можно
+    отправлять, пока готовятся следующие.
+
+    Args:
+        text: HTML-текст (parse_mode='HTML')
+        limit: Максимальная длина сообщения
+
+    Yields:
+        Тексты сообщений
+    """
+    if len(text) <= limit:
+        if text.strip():
+            yield text
+        return
+
+    open_tags: List[Tuple[str, str]] = []
+    parts: List[str] = []
+    size = 0
+    for unit in _units(text, limit):
+        tags_after = list(open_tags)
+        _update_open_tags(tags_after, unit)
+        if parts and size + len(unit) + len(_closing(tags_after)) > limit:
+            chunk = ("".join(parts).rstrip() + _closing(open_tags))
+            if chunk.strip():
+                yield chunk
+            reopen = _reopening(open_tags)
+            parts = [reopen] if reopen else []
+            size = len(reopen)
+            if not unit.strip() and not unit.startswith('<'):
+                continue
+        parts.append(unit)
+        size += len(unit)
+        _update_open_tags(open_tags, unit)
+
+    chunk = "".join(parts).rstrip()
+    if chunk.strip():
+        yield chunk
@@ -0,0 +1,224 @@
+"""
+Сводные дайджесты за неделю и месяц из сохраненных структур дайджестов
+
+Tracker повторно не опрашивается: сводка собирается из payload журнала
+дайджестов. Агрегация иерархическая - дайджесты объединяются в дни, дни
+(для месячной сводки) - в недели, и LLM каждый раз объединяет лишь
+несколько уже готовых резюме.
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from html import escape
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.core.deadline import Deadline, DeadlineExceeded
+from app.core.digest_payload import decode_payload, merge_payloads
+from app.core.digest_renderer import DigestBuilder
+from app.core.queue_digest import SharedResultCache
+from app.models.database import db_session
+from app.models.digest_log import DigestLog
+from app.services.llm_service import LLMService
+
+logger = logging.getLogger(__name__)
+
+# Резюме завершенных недель не меняются - месячные сводки переиспользуют их сутки
+BUCKET_SUMMARY_TTL_SECONDS = 24 * 3600
+# Резюме дня - склейка резюме его дайджестов, обрезанная до этой длины
+DAY_SUMMARY_MAX_CHARS = 1200
+
+
+@dataclass(frozen=True)
+class RollupPeriod:
+    """Период сводки и длина подпериодов, из резюме которых она собирается"""
+    name: str
+    title: str
+    days: int
+    bucket_days: int
+
+
+ROLLUP_PERIODS: Dict[str, RollupPeriod] = {
+    'week': RollupPeriod('week', 'неделю', 7, 1),
+    'month': RollupPeriod('month', 'месяц', 30, 7),
+}
+WEEK = ROLLUP_PERIODS['week']
+
+
+def load_daily_payloads(user_id: int, queue_key: str, since: datetime,
+                        until: datetime) -> List[Tuple[date, Dict[str, Any]]]:
+    """
+    Структуры дайджестов очереди за период, объединенные по дням
+
+    Записи без payload (сохраненные до его появления) пропускаются.
+
+    Returns:
+        Пары (день, объединенная структура) в хронологическом порядке
+    """
+    with db_session() as db:
+        rows = db.query(DigestLog.created_at, DigestLog.payload).filter(
+            DigestLog.user_id == user_id,
+            DigestLog.queue_key == queue_key,
+            DigestLog.created_at >= since,
+            DigestLog.created_at < until,
+            DigestLog.payload.isnot(None)
+        ).order_by(DigestLog.created_at).all()
+
+    days: Dict[date, List[Dict[str, Any]]] = {}
+    for created_at, data in rows:
+        payload = decode_payload(data)
+        if payload:
+            days.setdefault(created_at.date(), []).append(payload)
+    return [(day, merge_payloads(payloads)) for day, payloads in days.items()]
+
+
+def _day_summary(payload: Dict[str, Any]) -> str:
+    """Резюме дня из резюме его дайджестов"""
+    text = " ".join(summary.strip() for summary in payload.get("summaries", []) if summary and summary.strip())
+    return text if len(text) <= DAY_SUMMARY_MAX_CHARS else text[:DAY_SUMMARY_MAX_CHARS].rstrip() + "…"
+
+
+class DigestRollupService:
+    """Сводки за неделю и месяц по сохраненным дайджестам"""
+
+    def __init__(self, llm_service: LLMService):
+        self.llm_service = llm_service
+        self._bucket_summaries = SharedResultCache(BUCKET_SUMMARY_TTL_SECONDS)
+
+    async def generate_rollup(self, user_id: int, queue_key: str, period: str = 'week',
+                              deadline: Optional[Deadline] = None, now: Optional[datetime] = None) -> str:
+        """
+        Сформировать сводку очереди за период
+
+        Args:
+            user_id: ID пользователя
+            queue_key: Ключ очереди
+            period: 'week' или 'month'
+            deadline: Дедлайн генерации резюме
+            now: Конец периода (для тестов)
+
+        Returns:
+            HTML-текст сводки
+        """
+        spec = ROLLUP_PERIODS[period]
+        period_end = now or datetime.now()
+        # Период - целые дни, включая текущий
+        period_start = datetime.combine(period_end.date() - timedelta(days=spec.days - 1), datetime.min.time())
+        days = await asyncio.to_thread(load_daily_payloads, user_id, queue_key, period_start, period_end)
+        if not days:
+            return self._format_empty_rollup(queue_key, spec)
+        merged = merge_payloads([payload for _, payload in days])
+
+        if spec.bucket_days == 1:
+            entries = [{"label": day.strftime('%d.%m.%Y'), "summary": _day_summary(payload)}
+                       for day, payload in days if payload.get("summaries")]
+        else:
+            entries = await self._bucket_entries(user_id, queue_key, spec, days, period_start, period_end, deadline)
+
+        summary = await self._summarize_entries(queue_key, spec, period_start, period_end, merged, entries, deadline)
+        return self._format_rollup(queue_key, spec, period_start, period_end, merged,
+                                   summary or self._fallback_rollup_summary(merged))
+
+    async def _bucket_entries(self, user_id: int, queue_key: str, spec: RollupPeriod,
+                              days: List[Tuple[date, Dict[str, Any]]], period_start: datetime,
+                              period_end: datetime, deadline: Optional[Deadline]) -> List[Dict[str, str]]:
+        """Резюме подпериодов (недель месяца), каждое - из резюме его дней"""
+        buckets: Dict[int, List[Tuple[date, Dict[str, Any]]]] = {}
+        for day, payload in days:
+            buckets.setdefault((day - period_start.date()).days // spec.bucket_days, []).append((day, payload))
+
+        entries = []
+        for index in sorted(buckets):
+            bucket_days = buckets[index]
+            bucket_start = datetime.combine(period_start.date() + timedelta(days=index * spec.bucket_days), datetime.min.time())
+            bucket_end = min(bucket_start + timedelta(days=spec.bucket_days - 1), period_end)
+            merged = merge_payloads([payload for _, payload in bucket_days])
+            day_entries = [{"label": day.strftime('%d.%m.%Y'), "summary": _day_summary(payload)}
+                           for day, payload in bucket_days if payload.get("summaries")]
+            key = (user_id, queue_key, bucket_start, merged["digests"])
+            summary = await self._bucket_summaries.get_or_compute(
+                key,
+                lambda: self._summarize_entries(queue_key, WEEK, bucket_start, bucket_end, merged, day_entries, deadline),
+                cacheable=lambda result: result is not None
+            )
+            entries.append({
+                "label": f"{bucket_start.strftime('%d.%m')} – {bucket_end.strftime('%d.%m.%Y')}",
+                "summary": summary or self._fallback_rollup_summary(merged)
+            })
+        return entries
+
+    async def _summarize_entries(self, queue_key: str, spec: RollupPeriod, period_start: datetime, period_end: datetime,
+                                 merged: Dict[str, Any], entries: List[Dict[str, str]],
+                                 deadline: Optional[Deadline]) -> Optional[str]:
+        """
+        Объединить резюме подпериодов через LLM
+
+        Returns:
+            Резюме периода или None, если резюме нет или LLM не справилась
+        """
+        if not entries:
+            return None
+        if len(entries) == 1:
+            return entries[0]["summary"]
+        rollup_data = {
+            "queue_key": queue_key,
+            "period_title": spec.title,
+            "period_start": period_start,
+            "period_end": period_end,
+            "digests": merged.get("digests", 0),
+            "closed_count": len(merged.get("closed", [])),
+            "new_count": len(merged.get("new", [])),
+            "status_counts": self._status_counts(merged),
+            "entries": entries
+        }
+        try:
+            summary = await self.llm_service.create_rollup_summary(rollup_data, deadline=deadline)
+        except DeadlineExceeded:
+            logger.warning(f"Истек дедлайн при генерации сводки за {spec.title} для очереди {queue_key}")
+            return None
+        return summary.strip() or None
+
+    @staticmethod
+    def _status_counts(merged: Dict[str, Any]) -> Dict[str, int]:
+        """Число задач по группам статусов на конец периода"""
+        return dict(Counter(row[1] for row in merged.get("issues", [])))
+
+    def _fallback_rollup_summary(self, merged: Dict[str, Any]) -> str:
+        """Сводка без LLM по итоговым цифрам"""
+        return (f"Дайджестов за период: {merged.get('digests', 0)}. Закрыто задач: {len(merged.get('closed', []))}, "
+                f"новых: {len(merged.get('new', []))}.")
+
+    def _format_rollup(self, queue_key: str, spec: RollupPeriod, period_start: datetime, period_end: datetime,
+                       merged: Dict[str, Any], summary: str) -> str:
+        """Форматировать сводку в HTML для Telegram"""
+        queue_url = f"https://tracker.yandex.ru/queues/{queue_key}"
+        digest = DigestBuilder()
+        digest.line(f"📆 <b>Сводка очереди <a href=\"{queue_url}\">{queue_key}</a> за {spec.title}</b>")
+        digest.line(f"📅 {period_start.strftime('%d.%m.%Y')} – {period_end.strftime('%d.%m.%Y')}, "
+                    f"дайджестов: {merged.get('digests', 0)}").line()
+        if merged.get("partial"):
+            digest.line("⏱ <i>Часть дайджестов периода была сформирована не полностью.</i>").line()
+
+        digest.line(f"📝 <b>Резюме:</b> {escape(summary, quote=False)}").line()
+
+        closed = merged.get("closed", [])
+        digest.line(f"📈 <b>Итоги:</b> закрыто {len(closed)}, новых {len(merged.get('new', []))}")
+        status_counts = self._status_counts(merged)
+        if status_counts:
+            digest.line(f"📋 <b>Статусы задач:</b> {', '.join(f'{status} - {count}' for status, count in status_counts.items())}")
+        if closed:
+            limit = settings.DIGEST_TOP_N or len(closed)
+            links = ', '.join(f"<a href=\"https://tracker.yandex.ru/{key}\">{key}</a>" for key in closed[:limit])
+            more = len(closed) - limit
+            digest.line().line(f"✅ <b>Закрыто:</b> {links}{f' и еще {more}' if more > 0 else ''}")
+
+        return digest.build()
+
+    def _format_empty_rollup(self, queue_key: str, spec: RollupPeriod) -> str:
+        """Сводка, когда за период нет сохраненных дайджестов"""
+        queue_url = f"https://tracker.yandex.ru/queues/{queue_key}"
+        return (f"📆 <b>Сводка очереди <a href=\"{queue_url}\">{queue_key}</a> за {spec.title}</b>\n\n"
+                f"Нет сохраненных дайджестов за этот период.")
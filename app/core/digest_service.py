@@ -1,22 +1,270 @@
+import asyncio
+import functools
 import logging
+from collections import Counter
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from app.core.deadline import Deadline, DeadlineExceeded
+from app.core.digest_diff import DigestDiff, IssueState, build_snapshot, decode_snapshot, diff_snapshots, encode_snapshot
+from app.core.digest_payload import build_payload, encode_payload
+from app.core.digest_ranking import STATUS_GROUP_WEIGHTS, change_significance, rank_changes, trim_diff
+from app.core.digest_renderer import DigestBuilder
+from app.core.queue_digest import DigestDraft, QueueDigest, SharedResultCache, snapshot_fingerprint, window_start
 from app.services.tracker_service import TrackerService
 from app.services.llm_service import LLMService
-from app.models.database import get_db
+from app.services.llm.metrics import llm_metrics
+from app.config import settings
+from app.models.database import db_session, upsert
+from sqlalchemy.sql import func
 from app.models.digest_log import DigestLog
+from app.models.digest_snapshot import DigestSnapshot
+from app.models.digest_watermark import DigestWatermark
 import re
+from html import escape
+from urllib.parse import quote
 
 logger = logging.getLogger(__name__)
 
+# Сколько исполнителей и закрытых задач называть в резюме быстрого режима
+FAST_SUMMARY_TOP_ASSIGNEES = 3
+FAST_SUMMARY_CLOSED_KEYS = 5
+# Сколько самых значимых изменений каждой очереди передавать в общее резюме
+COMBINED_SUMMARY_ISSUES_PER_QUEUE = 10
+
 
 class DigestService:
     def __init__(self, tracker_service: TrackerService, llm_service: LLMService):
         self.tracker_service = tracker_service
         self.llm_service = llm_service
+        # Выборки и результаты обработки очередей общие для всех подписчиков
+        self._queue_fetches = SharedResultCache(settings.DIGEST_SHARED_WINDOW_SECONDS)
+        self._queue_digests = SharedResultCache(settings.DIGEST_SHARED_WINDOW_SECONDS)
+        # Классификация статусов через LLM (набор статусов Tracker невелик)
+        self._status_classes: Dict[str, str] = {}
+        # Дедлайны идущих общих обработок очередей (самый поздний из дедлайнов подписчиков)
+        self._compute_deadlines: Dict[Tuple, Deadline] = {}
+        # Время последних дайджестов, загруженное пачкой на все очереди пользователя
+        self._preloaded_watermarks: Dict[Tuple[int, str], datetime] = {}
+        # Ограничения параллельных обращений к Tracker и LLM для всех одновременных дайджестов
+        self._tracker_limit = asyncio.Semaphore(settings.DIGEST_TRACKER_CONCURRENCY)
+        self._llm_limit = asyncio.Semaphore(settings.DIGEST_LLM_CONCURRENCY)
+
+    async def generate_digest(self, user_id: int, queue_key: str, since_hours: int = 24, status_callback=None,
+                              deadline: Optional[Deadline] = None, refresh: bool = False,
+                              fast: bool = False, deferred: Optional[List[Callable[[], Any]]] = None) -> Optional[str]:
+        """
+        Генерировать дайджест для очереди с отслеживанием изменений
+
+        При истечении дедлайна оставшиеся этапы выполняются без LLM
+        и возвращается частичный дайджест. Стоимость LLM-вызовов дайджеста
+        сохраняется в llm_metrics.
+
+        refresh=True - дозапрос изменений после заранее подготовленного
+        дайджеста: задачи берутся из Tracker заново (без общей выборки),
+        а при отсутствии изменений возвращается None.
+
+        fast=True - быстрый режим без LLM: статусы нормализуются по словарю,
+        резюме строится по статистике изменений.
+
+        deferred - список, в который откладываются записи в базу (журнал,
+        отметка, снимок) вместо немедленной записи; их выполняет
+        commit_deferred после доставки дайджеста.
+        """
+        with llm_metrics.track_usage() as usage:
+            digest, queue_digest = await self._prepare_digest(user_id, queue_key, since_hours, status_callback, deadline,
+                                                              refresh=refresh, fast=fast, deferred=deferred)
+            if queue_digest is not None:
+                try:
+                    if status_callback and queue_digest.summary_task is not None and not queue_digest.summary_task.done():
+                        await status_callback("🤖 Анализирую изменения...")
+                    # Общее резюме может считаться дольше, чем бюджет этого подписчика
+                    partial = False
+                    try:
+                        summary = await self._await_summary(queue_digest, deadline.remaining() if deadline else None)
+                    except asyncio.TimeoutError:
+                        logger.warning(f"Истек дедлайн при ожидании резюме для очереди {queue_key}")
+                        summary = self._fallback_changes_summary(queue_digest.status_groups, queue_digest.top_issues)
+                        partial = True
+
+                    # Формируем дайджест
+                    if status_callback:
+                        await status_callback("📝 Формирую дайджест...")
+
+                    digest = self._format_queue_digest(queue_digest, summary, partial=partial)
+                    self._run_or_defer(deferred, self._log_digest, user_id, queue_key, digest, queue_digest.issues_count,
+                                       payload=build_payload(queue_digest, summary, partial=partial),
+                                       snapshot=queue_digest.snapshot,
+                                       digest_at=datetime.now() if deferred is not None else None)
+                except Exception as e:
+                    logger.error(f"Ошибка при формировании дайджеста для очереди {queue_key}: {e}")
+                    digest = self._format_error_digest(queue_key)
+        llm_metrics.record_digest(user_id, queue_key, usage)
+        return digest
+
+    async def generate_digest_draft(self, user_id: int, queue_key: str, since_hours: int = 24,
+                                    deadline: Optional[Deadline] = None) -> DigestDraft:
+        """
+        Двухфазный дайджест: сначала список изменений, затем резюме LLM
+
+        Первая фаза возвращается сразу после группировки задач (резюме еще
+        генерируется). finalize() дожидается резюме не дольше
+        DIGEST_SUMMARY_TIMEOUT_SECONDS и возвращает полный текст; если резюме
+        не успело, оно отбрасывается и возвращается текст без него.
+
+        Returns:
+            DigestDraft с текстом первой фазы и функцией finalize (None, если резюме не требуется)
+        """
+        with llm_metrics.track_usage() as usage:
+            digest, queue_digest = await self._prepare_digest(user_id, queue_key, since_hours, None, deadline)
+            if queue_digest is None:
+                llm_metrics.record_digest(user_id, queue_key, usage)
+                return DigestDraft(text=digest)
+            draft_text = self._format_queue_digest(queue_digest, None, summary_pending=True)
+            log_id = self._log_digest(user_id, queue_key, draft_text, queue_digest.issues_count,
+                                      payload=build_payload(queue_digest, None), snapshot=queue_digest.snapshot)
+
+        async def finalize() -> str:
+            timeout = settings.DIGEST_SUMMARY_TIMEOUT_SECONDS
+            if deadline:
+                timeout = deadline.clamp(timeout)
+            try:
+                summary = await self._await_summary(queue_digest, timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Резюме для очереди {queue_key} не готово за {timeout:.0f} с, отправляем дайджест без него")
+                summary = None
+            finally:
+                llm_metrics.record_digest(user_id, queue_key, usage)
+            final_text = self._format_queue_digest(queue_digest, summary)
+            if log_id is not None and summary:
+                self._update_log(log_id, final_text, build_payload(queue_digest, summary))
+            return final_text
+
+        return DigestDraft(text=draft_text, finalize=finalize)
+
+    async def generate_combined_digest(self, user_id: int, queue_keys: List[str], since_hours: int = 24,
+                                       deadline: Optional[Deadline] = None, refresh: bool = False,
+                                       fast: bool = False,
+                                       deferred: Optional[List[Callable[[], Any]]] = None) -> Optional[str]:
+        """
+        Общий дайджест по нескольким очередям: одно резюме и один текст
+
+        Очереди обрабатываются параллельно (выборки и группировки общие с
+        остальными дайджестами), резюме по всем очередям генерируется одним
+        запросом к LLM. В быстром режиме резюме собирается из статистики очередей.
+        deferred - как в generate_digest.
+
+        Returns:
+            HTML-текст дайджеста (None при refresh без изменений)
+        """
+        label = ", ".join(queue_keys)
+        with llm_metrics.track_usage() as usage:
+            prepared = await asyncio.gather(*(
+                self._prepare_digest(user_id, queue_key, since_hours, None, deadline,
+                                     refresh=refresh, fast=fast, summarize=False, deferred=deferred)
+                for queue_key in queue_keys
+            ))
+            queue_digests = [queue_digest for _, queue_digest in prepared if queue_digest is not None]
+            # Очереди без изменений, пустые и с ошибками - одной строкой каждая
+            notes = [(queue_key, text) for queue_key, (text, queue_digest) in zip(queue_keys, prepared)
+                     if queue_digest is None and text]
+            if refresh and not queue_digests:
+                llm_metrics.record_digest(user_id, label, usage)
+                return None
+            try:
+                summary, sections, partial = await self._generate_combined_summary(queue_digests, fast, deadline)
+                digest = self._format_combined_digest(queue_digests, summary, notes, partial=partial)
+                for queue_digest in queue_digests:
+                    queue_summary, queue_partial = self._queue_section(queue_digest, sections, partial)
+                    queue_text = (self._format_queue_digest(queue_digest, queue_summary, partial=queue_partial)
+                                  if settings.DIGEST_LOG_STORE_TEXT else None)
+                    self._run_or_defer(deferred, self._log_digest, user_id, queue_digest.queue_key, queue_text,
+                                       queue_digest.issues_count,
+                                       payload=build_payload(queue_digest, queue_summary or None, partial=queue_partial),
+                                       snapshot=queue_digest.snapshot,
+                                       digest_at=datetime.now() if deferred is not None else None)
+            except Exception as e:
+                logger.error(f"Ошибка при формировании общего дайджеста по очередям {label}: {e}")
+                digest = f"❌ Ошибка при генерации общего дайджеста по очередям {escape(label, quote=False)}"
+        llm_metrics.record_digest(user_id, label, usage)
+        return digest
+
+    async def _generate_combined_summary(self, queue_digests: List[QueueDigest], fast: bool,
+                                         deadline: Optional[Deadline]) -> Tuple[str, Dict[str, str], bool]:
+        """
+        Одно резюме изменений по всем очередям
+
+        Returns:
+            Общее резюме, резюме по очередям (если общее собрано из них, иначе
+            пустой словарь) и флаг, что LLM не успела и резюме собрано без нее
+        """
+        if not queue_digests:
+            return "", {}, False
+        # Быстрый режим (в том числе включенный для больших очередей) - статистика каждой очереди
+        if fast or all(queue_digest.summary for queue_digest in queue_digests):
+            sections = {queue_digest.queue_key: queue_digest.summary for queue_digest in queue_digests}
+            return self._join_sections(sections), sections, False
 
-    async def generate_digest(self, user_id: int, queue_key: str, since_hours: int = 24, status_callback=None) -> Optional[str]:
-        """Генерировать дайджест для очереди с отслеживанием изменений"""
+        queues = []
+        for queue_digest in queue_digests:
+            issues = queue_digest.top_issues[:COMBINED_SUMMARY_ISSUES_PER_QUEUE]
+            queues.append({
+                "queue_key": queue_digest.queue_key,
+                "time_description": queue_digest.time_description,
+                "issues_count": queue_digest.issues_count,
+                "status_counts": {status: len(issues) for status, issues in queue_digest.status_groups.items() if issues},
+                "closed_count": len(queue_digest.diff.closed) if queue_digest.diff is not None else 0,
+                "issues": issues,
+                "more": queue_digest.issues_count - len(issues)
+            })
+        async with self._llm_limit:
+            try:
+                summary = await self.llm_service.create_combined_summary(
+                    {"queues": queues, "current_time": datetime.now()}, deadline=deadline
+                )
+            except DeadlineExceeded:
+                logger.warning("Истек дедлайн при генерации общего резюме по очередям")
+                summary = ""
+        if summary:
+            return summary, {}, False
+        # Обработки очередей общие с другими дайджестами - частичность отмечаем только в этом дайджесте
+        sections = {
+            queue_digest.queue_key: self._fallback_changes_summary(queue_digest.status_groups, queue_digest.top_issues)
+            for queue_digest in queue_digests
+        }
+        return self._join_sections(sections), sections, True
+
+    def _queue_section(self, queue_digest: QueueDigest, sections: Dict[str, str], partial: bool) -> Tuple[str, bool]:
+        """
+        Резюме очереди для ее журнала из общего дайджеста
+
+        Журнал очереди хранит только ее собственные изменения: если общее
+        резюме не разбито по очередям, берется резюме самой очереди, а без
+        него - статистика очереди с отметкой частичности.
+        """
+        if queue_digest.queue_key in sections:
+            return sections[queue_digest.queue_key], partial
+        if queue_digest.summary:
+            return queue_digest.summary, partial
+        return self._fallback_changes_summary(queue_digest.status_groups, queue_digest.top_issues), True
+
+    @staticmethod
+    def _join_sections(sections: Dict[str, str]) -> str:
+        """Общее резюме из резюме очередей"""
+        return " ".join(f"{queue_key}: {summary}" for queue_key, summary in sections.items())
+
+    async def _prepare_digest(self, user_id: int, queue_key: str, since_hours: int, status_callback,
+                              deadline: Optional[Deadline], refresh: bool = False, fast: bool = False,
+                              summarize: bool = True,
+                              deferred: Optional[List[Callable[[], Any]]] = None) -> Tuple[Optional[str], Optional[QueueDigest]]:
+        """
+        Получить обработанную очередь (выборка, разность, группировка; резюме запускается в фоне)
+
+        summarize=False - без резюме очереди (для общего дайджеста по нескольким очередям)
+
+        Returns:
+            Готовый текст (пустая очередь, нет изменений, ошибка; None при refresh без изменений)
+            или QueueDigest для форматирования
+        """
         try:
             logger.info(f"Генерируем дайджест для очереди {queue_key}")
             
@@ -26,103 +274,421 @@ class DigestService:
             if status_callback:
                 await status_callback("📡 Получаю данные из Yandex Tracker...")
             
-            # Получаем ВСЕ задачи из очереди
-            all_issues = self.tracker_service.get_queue_issues(queue_key)
+            # Получаем ВСЕ задачи из очереди (одна выборка на всех подписчиков в пределах окна)
+            try:
+                fetched_at, all_issues, partial = await self._fetch_shared(queue_key, deadline, fresh=refresh)
+            except DeadlineExceeded:
+                logger.warning(f"Истек дедлайн при получении задач очереди {queue_key}")
+                return self._format_timeout_digest(queue_key), None
             logger.info(f"Получено {len(all_issues)} задач из очереди {queue_key}")
             
             if not all_issues:
                 logger.info(f"Нет задач в очереди {queue_key}")
-                return self._format_empty_digest(queue_key, since_hours)
-
-            # Определяем период для анализа изменений
-            if last_digest_time:
-                # Если есть предыдущий дайджест, анализируем изменения с того момента
-                cutoff_time = last_digest_time
-                time_description = f"с {last_digest_time.strftime('%d.%m.%Y %H:%M')}"
-                logger.info(f"Анализируем изменения {time_description}")
+                return (None if refresh else self._format_empty_digest(queue_key, since_hours)), None
+
+            # Обработка очереди не зависит от пользователя - берем готовую, если окно и снимок совпадают
+            previous_snapshot = self._load_snapshot(user_id, queue_key)
+            key = (queue_key, window_start(last_digest_time), fetched_at, snapshot_fingerprint(previous_snapshot),
+                   None if last_digest_time else since_hours, fast, summarize)
+            if status_callback:
+                await status_callback("📊 Группирую задачи по статусам...")
+            queue_digest = await self._shared_queue_digest(key, all_issues, previous_snapshot, last_digest_time,
+                                                           since_hours, partial, deadline)
+            
+            if not queue_digest.has_changes:
+                logger.info(f"Нет изменений в очереди {queue_key} {queue_digest.time_description}")
+                # Дайджест без изменений в журнал не пишется - запоминаем только состояние задач
+                self._run_or_defer(deferred, self._save_snapshot, user_id, queue_key, queue_digest.snapshot)
+                if refresh:
+                    return None, None
+                return self._format_no_changes_digest(queue_key, queue_digest.time_description), None
+
+            return None, queue_digest
+
+        except Exception as e:
+            logger.error(f"Ошибка при генерации дайджеста для очереди {queue_key}: {e}")
+            return self._format_error_digest(queue_key), None
+
+    async def _shared_queue_digest(self, key: Tuple, all_issues: List[Dict[str, Any]],
+                                   previous_snapshot: Optional[List[IssueState]], last_digest_time: Optional[datetime],
+                                   since_hours: int, partial: bool, deadline: Optional[Deadline]) -> QueueDigest:
+        """
+        Обработка очереди, общая для всех подписчиков с тем же ключом
+
+        Общая обработка идет под собственным дедлайном: он продлевается до
+        самого позднего дедлайна присоединившихся подписчиков. Каждый
+        подписчик ждет не дольше своего дедлайна, после чего получает дайджест
+        быстрого режима. Частичный результат (истек общий дедлайн) подписчик,
+        у которого еще есть время, пересчитывает.
+        """
+        fast, summarize = key[-2], key[-1]
+        budget = deadline.remaining() if deadline else settings.SCHEDULED_DIGEST_DEADLINE_SECONDS
+
+        async def compute() -> QueueDigest:
+            shared_deadline = self._compute_deadlines[key] = Deadline(budget)
+            try:
+                result = await self._compute_queue_digest(key, all_issues, previous_snapshot, last_digest_time,
+                                                          since_hours, partial, shared_deadline, fast, summarize)
+            except BaseException:
+                self._release_deadline(key, shared_deadline)
+                raise
+            # Дедлайн нужен, пока в фоне генерируется резюме
+            if result.summary_task is None:
+                self._release_deadline(key, shared_deadline)
             else:
-                # Если нет предыдущего дайджеста, используем фиксированный период
-                cutoff_time = datetime.now() - timedelta(hours=since_hours)
-                time_description = f"за последние {since_hours} часов"
-                logger.info(f"Первый дайджест, анализируем {time_description}")
-
-            # Фильтруем задачи по дате обновления
-            recent_issues = []
-            for issue in all_issues:
-                updated_str = issue.get('updated')
-                if updated_str:
-                    try:
-                        # Парсим дату обновления
-                        if 'T' in updated_str:
-                            updated_time = datetime.fromisoformat(updated_str.replace('Z', '+00:00'))
-                        else:
-                            updated_time = datetime.fromisoformat(updated_str)
-                        
-                        # Проверяем, была ли задача обновлена в указанный период
-                        if updated_time >= cutoff_time:
-                            recent_issues.append(issue)
-                            logger.info(f"Задача {issue.get('key')} обновлена {updated_time} - включаем в дайджест")
-                        else:
-                            logger.info(f"Задача {issue.get('key')} обновлена {updated_time} - слишком старая")
-                    except Exception as e:
-                        logger.error(f"Ошибка при парсинге даты {updated_str}: {e}")
-                        # Если не удалось распарсить дату, включаем задачу
-                        recent_issues.append(issue)
+                result.summary_task.add_done_callback(lambda _: self._release_deadline(key, shared_deadline))
+            return result
+
+        for attempt in range(2):
+            shared_deadline = self._compute_deadlines.get(key)
+            if shared_deadline is not None:
+                shared_deadline.extend(budget)
+            shared = self._queue_digests.get_or_compute(key, compute, cacheable=lambda result: not result.partial)
+            try:
+                queue_digest = await (deadline.run(shared, f"{key[0]} processing") if deadline else shared)
+            except DeadlineExceeded:
+                logger.warning(f"Истек дедлайн при обработке очереди {key[0]}, дайджест в быстром режиме")
+                fast_key = key[:-2] + (True, summarize)
+                return await self._queue_digests.get_or_compute(
+                    fast_key,
+                    lambda: self._compute_queue_digest(fast_key, all_issues, previous_snapshot, last_digest_time,
+                                                       since_hours, partial, None, True, summarize),
+                    cacheable=lambda result: not result.partial
+                )
+            # Выборка неполная - пересчет ее не дополнит
+            if not queue_digest.partial or partial or attempt or (deadline and deadline.expired):
+                return queue_digest
+            logger.info(f"Обработка очереди {key[0]} завершилась частично, пересчитываем в пределах своего дедлайна")
+        return queue_digest
+
+    def _release_deadline(self, key: Tuple, deadline: Deadline):
+        """Забыть дедлайн завершенной общей обработки (если его еще не заменил пересчет)"""
+        if self._compute_deadlines.get(key) is deadline:
+            del self._compute_deadlines[key]
+
+    async def _compute_queue_digest(self, key: Tuple, all_issues: List[Dict[str, Any]],
+                                    previous_snapshot: Optional[List[IssueState]], last_digest_time: Optional[datetime],
+                                    since_hours: int, partial: bool,
+                                    deadline: Optional[Deadline], fast: bool = False,
+                                    summarize: bool = True) -> QueueDigest:
+        """Отобрать изменения очереди, сгруппировать их и запустить генерацию резюме"""
+        queue_key = key[0]
+        # Есть снимок прошлого дайджеста - сравниваем состояния задач
+        diff: Optional[DigestDiff] = None
+        if previous_snapshot is not None:
+            diff, snapshot = diff_snapshots(
+                previous_snapshot, all_issues, complete=not partial,
+                is_closed=lambda status: self._normalize_status(status) == 'Done'
+            )
+            time_description = f"с {last_digest_time.strftime('%d.%m.%Y %H:%M')}" if last_digest_time else "с прошлого дайджеста"
+            recent_issues = diff.changed_issues()
+        else:
+            snapshot = build_snapshot(all_issues)
+            recent_issues, time_description = self._filter_recent_issues(all_issues, last_digest_time, since_hours)
+
+        queue_digest = QueueDigest(queue_key=queue_key, time_description=time_description, snapshot=snapshot,
+                                   issues_count=len(recent_issues), diff=diff, shown_diff=diff, partial=partial,
+                                   since=last_digest_time or datetime.now() - timedelta(hours=since_hours))
+        if not queue_digest.has_changes:
+            return queue_digest
+
+        # В дайджест и в LLM идут только самые значимые изменения
+        kept_issues, queue_digest.omitted_count = rank_changes(recent_issues, settings.DIGEST_TOP_N,
+                                                               self._change_significance(diff))
+        kept_keys = {issue.get('key') for issue in kept_issues}
+        queue_digest.top_issues = kept_issues
+        if queue_digest.omitted_count and diff is not None:
+            queue_digest.shown_diff = trim_diff(diff, kept_keys)
+
+        # Слишком много изменений для LLM - сразу переходим в быстрый режим
+        max_issues = settings.DIGEST_FAST_MODE_MAX_ISSUES
+        if not fast and max_issues and len(recent_issues) > max_issues:
+            logger.info(f"В очереди {queue_key} {len(recent_issues)} изменений (больше {max_issues}), дайджест без LLM")
+            fast = True
+        if fast:
+            # Статистика - по всем изменениям, списки - только по отобранным
+            status_groups, queue_digest.summary = self._build_fast_digest(recent_issues, diff)
+            rank = {issue.get('key'): index for index, issue in enumerate(kept_issues)}
+            queue_digest.status_groups = {
+                status: sorted((issue for issue in issues if issue.get('key') in kept_keys), key=lambda issue: rank[issue.get('key')])
+                for status, issues in status_groups.items()
+            }
+            return queue_digest
+
+        # Группируем задачи по статусу
+        async with self._llm_limit:
+            queue_digest.status_groups, grouped_fully = await self._group_issues_by_status(kept_issues, deadline)
+        queue_digest.partial = queue_digest.partial or not grouped_fully
+        if not summarize:
+            return queue_digest
+
+        # Резюме генерируется в фоне: список изменений уже можно показывать
+        queue_digest.summary_task = asyncio.ensure_future(
+            self._summarize(key, queue_digest, kept_issues, last_digest_time, deadline)
+        )
+        return queue_digest
+
+    def _change_significance(self, diff: Optional[DigestDiff]):
+        """Функция значимости изменения задачи: по разности снимков или, без снимка, по группе статуса"""
+        if diff is not None:
+            significance = change_significance(diff, self._normalize_status)
+            return lambda issue: significance.get(issue.get('key'), 1.0)
+
+        status_classes: Dict[str, str] = {}
+
+        def by_status(issue: Dict[str, Any]) -> float:
+            status = issue.get('status') or 'Unknown'
+            if status not in status_classes:
+                status_classes[status] = self._normalize_status(status)
+            return STATUS_GROUP_WEIGHTS.get(status_classes[status], 1.0)
+        return by_status
+
+    def _build_fast_digest(self, issues: List[Dict[str, Any]],
+                           diff: Optional[DigestDiff]) -> Tuple[Dict[str, List[Dict[str, Any]]], str]:
+        """
+        Группировка и резюме без LLM за один проход по задачам
+
+        Статусы нормализуются по словарю (каждый статус один раз), резюме -
+        статистика: число задач по статусам, самые загруженные исполнители,
+        закрытые задачи.
+
+        Returns:
+            Группы задач по статусам и текст резюме
+        """
+        status_groups: Dict[str, List[Dict[str, Any]]] = {
+            'To Do': [],
+            'In Progress': [],
+            'Blocked': [],
+            'Done': []
+        }
+        status_classes: Dict[str, str] = {}
+        assignees: Counter = Counter()
+        for issue in issues:
+            original_status = issue.get('status') or 'Unknown'
+            normalized_status = status_classes.get(original_status)
+            if normalized_status is None:
+                normalized_status = status_classes[original_status] = self._normalize_status(original_status)
+            status_groups[normalized_status].append(issue)
+            assignee = (issue.get('assignee') or '').strip()
+            if assignee and assignee != 'Unassigned':
+                assignees[assignee] += 1
+
+        # По разности снимков закрытые известны точно, без снимка - это задачи, попавшие в Done
+        closed = [change.issue for change in diff.closed] if diff is not None else status_groups['Done']
+
+        summary = f"Изменено задач: {len(issues)}. "
+        counts = [f"{status} - {len(status_issues)}" for status, status_issues in status_groups.items() if status_issues]
+        if counts:
+            summary += f"По статусам: {', '.join(counts)}. "
+        if assignees:
+            top = ', '.join(f"{name} ({count})" for name, count in assignees.most_common(FAST_SUMMARY_TOP_ASSIGNEES))
+            summary += f"Больше всего задач у: {top}. "
+        if closed:
+            keys = ', '.join(issue.get('key', '') for issue in closed[:FAST_SUMMARY_CLOSED_KEYS])
+            more = len(closed) - FAST_SUMMARY_CLOSED_KEYS
+            summary += f"Закрыто: {len(closed)} ({keys}{f' и еще {more}' if more > 0 else ''})."
+        return status_groups, summary.strip()
+
+    async def _summarize(self, key: Tuple, queue_digest: QueueDigest, recent_issues: List[Dict[str, Any]],
+                         last_digest_time: Optional[datetime], deadline: Optional[Deadline]) -> str:
+        """Сгенерировать резюме изменений обработанной очереди"""
+        queue_key = queue_digest.queue_key
+
+        # Этапы с LLM выполняются не более чем для DIGEST_LLM_CONCURRENCY очередей одновременно
+        async with self._llm_limit:
+            try:
+                if queue_digest.shown_diff is not None:
+                    summary = await self._generate_delta_summary(queue_key, queue_digest.shown_diff, queue_digest.status_groups,
+                                                                 last_digest_time, deadline, queue_digest.omitted_count)
                 else:
-                    # Если нет даты обновления, включаем задачу
+                    summary = await self._generate_changes_summary(queue_key, queue_digest.status_groups,
+                                                                   recent_issues, last_digest_time, deadline,
+                                                                   queue_digest.omitted_count)
+            except DeadlineExceeded:
+                logger.warning(f"Истек дедлайн при генерации резюме для очереди {queue_key}")
+                queue_digest.partial = True
+                # Резюме без LLM не переиспользуем: у следующего подписчика может хватить времени
+                self._queue_digests.discard(key)
+                summary = self._fallback_changes_summary(queue_digest.status_groups, recent_issues)
+
+        queue_digest.summary = summary
+        return summary
+
+    async def _await_summary(self, queue_digest: QueueDigest, timeout: Optional[float] = None) -> str:
+        """Дождаться резюме очереди (общего для всех подписчиков)"""
+        if queue_digest.summary_task is None:
+            return queue_digest.summary
+        return await asyncio.wait_for(asyncio.shield(queue_digest.summary_task), timeout)
+
+    def _format_queue_digest(self, queue_digest: QueueDigest, summary: Optional[str], summary_pending: bool = False,
+                             partial: bool = False) -> str:
+        """
+        Форматировать обработанную очередь
+
+        partial=True - дайджест частичный для этого подписчика (общий результат
+        очереди при этом не меняется)
+        """
+        return self._format_digest(queue_digest.queue_key, queue_digest.status_groups, summary or "",
+                                   queue_digest.time_description, partial=queue_digest.partial or partial,
+                                   diff=queue_digest.shown_diff, summary_pending=summary_pending,
+                                   omitted_count=queue_digest.omitted_count, since=queue_digest.since)
+
+    def _format_error_digest(self, queue_key: str) -> str:
+        """Сообщение об ошибке генерации дайджеста"""
+        queue_url = f"https://tracker.yandex.ru/queues/{queue_key}"
+        return f"❌ Ошибка при генерации дайджеста для очереди <a href=\"{queue_url}\">{queue_key}</a>"
+
+    def _filter_recent_issues(self, all_issues: List[Dict[str, Any]], last_digest_time: Optional[datetime],
+                              since_hours: int) -> Tuple[List[Dict[str, Any]], str]:
+        """Отобрать задачи, обновленные после прошлого дайджеста (когда снимка еще нет)"""
+        # Определяем период для анализа изменений
+        if last_digest_time:
+            # Если есть предыдущий дайджест, анализируем изменения с того момента
+            cutoff_time = last_digest_time
+            time_description = f"с {last_digest_time.strftime('%d.%m.%Y %H:%M')}"
+            logger.info(f"Анализируем изменения {time_description}")
+        else:
+            # Если нет предыдущего дайджеста, используем фиксированный период
+            cutoff_time = datetime.now() - timedelta(hours=since_hours)
+            time_description = f"за последние {since_hours} часов"
+            logger.info(f"Первый дайджест, анализируем {time_description}")
+
+        # Фильтруем задачи по дате обновления
+        recent_issues = []
+        for issue in all_issues:
+            updated_str = issue.get('updated')
+            if updated_str:
+                try:
+                    # Парсим дату обновления
+                    if 'T' in updated_str:
+                        updated_time = datetime.fromisoformat(updated_str.replace('Z', '+00:00'))
+                    else:
+                        updated_time = datetime.fromisoformat(updated_str)
+                    
+                    # Проверяем, была ли задача обновлена в указанный период
+                    if updated_time >= cutoff_time:
+                        recent_issues.append(issue)
+                        logger.info(f"Задача {issue.get('key')} обновлена {updated_time} - включаем в дайджест")
+                    else:
+                        logger.info(f"Задача {issue.get('key')} обновлена {updated_time} - слишком старая")
+                except Exception as e:
+                    logger.error(f"Ошибка при парсинге даты {updated_str}: {e}")
+                    # Если не удалось распарсить дату, включаем задачу
                     recent_issues.append(issue)
-                    logger.info(f"Задача {issue.get('key')} без даты обновления - включаем в дайджест")
+            else:
+                # Если нет даты обновления, включаем задачу
+                recent_issues.append(issue)
+                logger.info(f"Задача {issue.get('key')} без даты обновления - включаем в дайджест")
 
-            logger.info(f"Отфильтровано {len(recent_issues)} задач {time_description}")
-            
-            if not recent_issues:
-                logger.info(f"Нет изменений в очереди {queue_key} {time_description}")
-                return self._format_no_changes_digest(queue_key, time_description)
+        logger.info(f"Отфильтровано {len(recent_issues)} задач {time_description}")
+        return recent_issues, time_description
 
-            # Группируем задачи по статусу
-            if status_callback:
-                await status_callback("📊 Группирую задачи по статусам...")
-                
-            status_groups = await self._group_issues_by_status(recent_issues)
+    async def _fetch_shared(self, queue_key: str, deadline: Optional[Deadline],
+                            fresh: bool = False) -> Tuple[datetime, List[Dict[str, Any]], bool]:
+        """
+        Получить задачи очереди, переиспользуя выборку в пределах окна DIGEST_SHARED_WINDOW_SECONDS
 
-            # Генерируем резюме изменений
-            if status_callback:
-                await status_callback("🤖 Анализирую изменения...")
-                
-            summary = await self._generate_changes_summary(queue_key, status_groups, recent_issues, last_digest_time)
+        Args:
+            queue_key: Ключ очереди
+            deadline: Дедлайн выборки
+            fresh: Не брать готовую выборку (новая заменит ее для остальных подписчиков)
 
-            # Формируем дайджест
-            if status_callback:
-                await status_callback("📝 Формирую дайджест...")
-                
-            digest = self._format_digest(queue_key, status_groups, summary, time_description)
+        Returns:
+            Время выборки, задачи и флаг, что выборка неполная (истек дедлайн)
+        """
+        budget = deadline.remaining() if deadline else settings.SCHEDULED_DIGEST_DEADLINE_SECONDS
+        deadline_key = ("fetch", queue_key)
+
+        async def fetch() -> Tuple[datetime, List[Dict[str, Any]], bool]:
+            # Дедлайн выборки общий: присоединившиеся подписчики продлевают его до своего
+            shared_deadline = self._compute_deadlines[deadline_key] = Deadline(budget)
+            try:
+                issues = await self._fetch_queue_issues(queue_key, shared_deadline)
+            finally:
+                self._release_deadline(deadline_key, shared_deadline)
+            return datetime.now(), issues, shared_deadline.expired
+
+        if fresh:
+            self._queue_fetches.discard(queue_key)
+        for attempt in range(2):
+            shared_deadline = self._compute_deadlines.get(deadline_key)
+            if shared_deadline is not None:
+                shared_deadline.extend(budget)
+            shared = self._queue_fetches.get_or_compute(queue_key, fetch, cacheable=lambda result: not result[2])
+            result = await (deadline.run(shared, "tracker") if deadline else shared)
+            # Неполную выборку подписчик, у которого еще есть время, запрашивает заново
+            if not result[2] or attempt or (deadline and deadline.expired):
+                return result
+            logger.info(f"Выборка очереди {queue_key} неполная, запрашиваем заново в пределах своего дедлайна")
+        return result
 
-            # Логируем дайджест
-            self._log_digest(user_id, queue_key, digest, len(recent_issues))
+    async def _fetch_queue_issues(self, queue_key: str, deadline: Optional[Deadline]) -> List[Dict[str, Any]]:
+        """Получить задачи очереди из Tracker в отдельном потоке с учетом дедлайна"""
+        async with self._tracker_limit:
+            fetch = asyncio.to_thread(self.tracker_service.get_queue_issues, queue_key, None, deadline)
+            if deadline:
+                return await deadline.run(fetch, "tracker")
+            return await fetch
 
-            return digest
+    def preload_last_digest_times(self, user_id: int, queue_keys: List[str]):
+        """
+        Загрузить время последних дайджестов по всем очередям пользователя одним запросом
 
+        Значения используются следующими вызовами _get_last_digest_time
+        для этих очередей (каждое - один раз).
+        """
+        try:
+            with db_session() as db:
+                rows = db.query(DigestWatermark.queue_key, DigestWatermark.last_digest_at).filter(
+                    DigestWatermark.user_id == user_id,
+                    DigestWatermark.queue_key.in_(queue_keys)
+                ).all()
+            found = {queue_key: last_digest_at for queue_key, last_digest_at in rows}
+            for queue_key in queue_keys:
+                # Очереди без отметки проверяются по журналу при первом обращении
+                if queue_key in found:
+                    self._preloaded_watermarks[(user_id, queue_key)] = found[queue_key].replace(tzinfo=None)
+            logger.info(f"Загружены отметки последних дайджестов пользователя {user_id}: {len(found)} из {len(queue_keys)}")
         except Exception as e:
-            logger.error(f"Ошибка при генерации дайджеста для очереди {queue_key}: {e}")
-            queue_url = f"https://tracker.yandex.ru/queues/{queue_key}"
-            return f"❌ Ошибка при генерации дайджеста для очереди <a href=\"{queue_url}\">{queue_key}</a>"
+            logger.error(f"Ошибка при загрузке отметок последних дайджестов: {e}")
+
+    def forget_preloaded_times(self, user_id: int, queue_keys: List[str]):
+        """Удалить неиспользованные предзагруженные отметки очередей пользователя"""
+        for queue_key in queue_keys:
+            self._preloaded_watermarks.pop((user_id, queue_key), None)
 
     def _get_last_digest_time(self, user_id: int, queue_key: str) -> Optional[datetime]:
         """Получить время последнего дайджеста для пользователя и очереди"""
+        preloaded = self._preloaded_watermarks.pop((user_id, queue_key), None)
+        if preloaded is not None:
+            return preloaded
         try:
-            db = next(get_db())
-            last_digest = db.query(DigestLog).filter(
-                DigestLog.user_id == user_id,
-                DigestLog.queue_key == queue_key
-            ).order_by(DigestLog.created_at.desc()).first()
+            with db_session() as db:
+                watermark = db.query(DigestWatermark.last_digest_at).filter(
+                    DigestWatermark.user_id == user_id,
+                    DigestWatermark.queue_key == queue_key
+                ).first()
+                if watermark:
+                    logger.info(f"Последний дайджест для {queue_key}: {watermark.last_digest_at}")
+                    return watermark.last_digest_at.replace(tzinfo=None)
+
+                # Отметки еще нет (дайджесты до появления таблицы) - берем из журнала и запоминаем
+                last_digest = db.query(DigestLog).filter(
+                    DigestLog.user_id == user_id,
+                    DigestLog.queue_key == queue_key
+                ).order_by(DigestLog.created_at.desc()).first()
             
-            if last_digest:
-                created_at = last_digest.created_at
-                logger.info(f"Последний дайджест для {queue_key}: {created_at}")
-                return created_at.replace(tzinfo=None)
-            else:
-                logger.info(f"Нет предыдущих дайджестов для {queue_key}")
-                return None
+                if last_digest:
+                    created_at = last_digest.created_at
+                    # Отметку мог уже записать параллельный дайджест - его не перезаписываем
+                    upsert(db, DigestWatermark, {"user_id": user_id, "queue_key": queue_key, "last_digest_at": created_at},
+                           ["user_id", "queue_key"])
+                    db.commit()
+                    logger.info(f"Последний дайджест для {queue_key}: {created_at}")
+                    return created_at.replace(tzinfo=None)
+                else:
+                    logger.info(f"Нет предыдущих дайджестов для {queue_key}")
+                    return None
                 
         except Exception as e:
             logger.error(f"Ошибка при получении времени последнего дайджеста: {e}")
@@ -150,7 +716,18 @@ class DigestService:
 
 📝 Нет изменений в задачах за этот период."""
 
-    async def _generate_changes_summary(self, queue_key: str, status_groups: Dict[str, List[Dict]], issues: List[Dict], last_digest_time: Optional[datetime]) -> str:
+    def _format_timeout_digest(self, queue_key: str) -> str:
+        """Форматировать дайджест, если данные не успели загрузиться до дедлайна"""
+        queue_url = f"https://tracker.yandex.ru/queues/{queue_key}"
+        current_time = datetime.now().strftime('%d.%m.%Y %H:%M UTC')
+        
+        return f"""📊 <b>Дайджест очереди <a href="{queue_url}">{queue_key}</a></b>
+🕐 Сформирован: {current_time}
+
+⏱ Не удалось получить задачи из Yandex Tracker за отведенное время. Попробуйте позже."""
+
+    async def _generate_changes_summary(self, queue_key: str, status_groups: Dict[str, List[Dict]], issues: List[Dict], last_digest_time: Optional[datetime],
+                                        deadline: Optional[Deadline] = None, omitted_count: int = 0) -> str:
         """Генерировать резюме изменений относительно последнего дайджеста"""
         try:
             # Подготавливаем данные для LLM
@@ -159,30 +736,73 @@ class DigestService:
                 "total_issues": len(issues),
                 "status_groups": status_groups,
                 "issues": issues,
+                "omitted_count": omitted_count,
                 "last_digest_time": last_digest_time,
                 "current_time": datetime.now()
             }
             
-            summary = await self.llm_service.create_changes_summary(summary_data)
+            summary = await self.llm_service.create_changes_summary(summary_data, deadline=deadline)
             return summary if summary else "Обнаружены изменения в задачах."
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Ошибка при генерации резюме изменений для очереди {queue_key}: {e}")
-            # Возвращаем fallback с информацией о пользователях
-            participants = self._extract_participants(status_groups)
-            fallback = f"Обнаружены изменения в {len(issues)} задачах. "
-            if participants:
-                fallback += f"Задействованные участники: {', '.join(participants)}. "
+            return self._fallback_changes_summary(status_groups, issues)
+
+    async def _generate_delta_summary(self, queue_key: str, diff: DigestDiff, status_groups: Dict[str, List[Dict]],
+                                      last_digest_time: Optional[datetime], deadline: Optional[Deadline] = None,
+                                      omitted_count: int = 0) -> str:
+        """Генерировать резюме только по изменениям между снимками"""
+        issues = diff.changed_issues()
+        try:
+            delta_data = {
+                "queue_key": queue_key,
+                "new": diff.new,
+                "transitions": diff.transitions,
+                "closed": diff.closed,
+                "reassigned": diff.reassigned,
+                "removed_count": len(diff.removed),
+                "omitted_count": omitted_count,
+                "total_issues": len(issues),
+                "status_groups": status_groups,
+                "issues": issues,
+                "last_digest_time": last_digest_time,
+                "current_time": datetime.now()
+            }
             
-            # Добавляем краткую сводку по статусам
-            for status, status_issues in status_groups.items():
-                if status_issues:
-                    fallback += f"{status}: {len(status_issues)} задач. "
+            summary = await self.llm_service.create_delta_summary(delta_data, deadline=deadline)
+            return summary if summary else "Обнаружены изменения в задачах."
             
-            return fallback
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при генерации резюме по изменениям для очереди {queue_key}: {e}")
+            return self._fallback_changes_summary(status_groups, issues)
+
+    def _fallback_changes_summary(self, status_groups: Dict[str, List[Dict]], issues: List[Dict]) -> str:
+        """Резюме без LLM с информацией о пользователях и статусах"""
+        participants = self._extract_participants(status_groups)
+        fallback = f"Обнаружены изменения в {len(issues)} задачах. "
+        if participants:
+            fallback += f"Задействованные участники: {', '.join(participants)}. "
+        
+        # Добавляем краткую сводку по статусам
+        for status, status_issues in status_groups.items():
+            if status_issues:
+                fallback += f"{status}: {len(status_issues)} задач. "
+        
+        return fallback
+
+    async def _group_issues_by_status(self, issues: List[Dict[str, Any]],
+                                      deadline: Optional[Deadline] = None) -> Tuple[Dict[str, List[Dict[str, Any]]], bool]:
+        """
+        Группировать задачи по статусу через LLM
 
-    async def _group_issues_by_status(self, issues: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
-        """Группировать задачи по статусу через LLM"""
+        Returns:
+            Группы задач и флаг, что все статусы классифицированы через LLM
+            (False, если дедлайн истек и часть задач разнесена без LLM)
+        """
         status_groups = {
             'To Do': [],
             'In Progress': [],
@@ -192,13 +812,28 @@ class DigestService:
 
         logger.info(f"Группируем {len(issues)} задач по статусам через LLM")
         
+        llm_available = True
         for issue in issues:
             original_status = issue.get('status', 'Unknown')
             
-            # Используем LLM для классификации статуса
-            normalized_status = await self.llm_service.classify_status(original_status)
-            
-            logger.info(f"Задача {issue.get('key', 'unknown')}: '{original_status}' -> '{normalized_status}' (LLM)")
+            if llm_available:
+                try:
+                    # Используем LLM для классификации статуса (каждый статус классифицируется один раз)
+                    normalized_status = self._status_classes.get(original_status)
+                    if normalized_status is None:
+                        normalized_status = await self.llm_service.classify_status(original_status, deadline=deadline,
+                                                                                   fallback=False)
+                        if normalized_status is None:
+                            # Ошибка LLM: статус разносим по словарю и не запоминаем - в следующий раз спросим снова
+                            normalized_status = self._normalize_status(original_status)
+                        else:
+                            self._status_classes[original_status] = normalized_status
+                    logger.info(f"Задача {issue.get('key', 'unknown')}: '{original_status}' -> '{normalized_status}'")
+                except DeadlineExceeded:
+                    logger.warning("Истек дедлайн классификации, оставшиеся статусы нормализуем без LLM")
+                    llm_available = False
+            if not llm_available:
+                normalized_status = self._normalize_status(original_status)
             
             if normalized_status in status_groups:
                 status_groups[normalized_status].append(issue)
@@ -210,7 +845,7 @@ class DigestService:
         for status, status_issues in status_groups.items():
             logger.info(f"Статус '{status}': {len(status_issues)} задач")
 
-        return status_groups
+        return status_groups, llm_available
 
     def _normalize_status(self, status: str) -> str:
         """Нормализовать статус задачи"""
@@ -247,7 +882,9 @@ class DigestService:
                     participants.add(assignee.strip())
         return list(participants)
 
-    def _format_digest(self, queue_key: str, status_groups: Dict[str, List[Dict]], summary: str, time_description: str) -> str:
+    def _format_digest(self, queue_key: str, status_groups: Dict[str, List[Dict]], summary: str, time_description: str,
+                       partial: bool = False, diff: Optional[DigestDiff] = None, summary_pending: bool = False,
+                       omitted_count: int = 0, since: Optional[datetime] = None) -> str:
         """Форматировать дайджест с гиперссылками в HTML формате для Telegram"""
         logger.info(f"Форматируем дайджест для очереди {queue_key}")
         logger.info(f"Статусы в дайджесте: {list(status_groups.keys())}")
@@ -256,62 +893,265 @@ class DigestService:
         queue_url = f"https://tracker.yandex.ru/queues/{queue_key}"
         current_time = datetime.now().strftime('%d.%m.%Y %H:%M UTC')
         
-        digest = f"📊 <b>Дайджест очереди <a href=\"{queue_url}\">{queue_key}</a></b>\n"
-        digest += f"📅 {time_description}\n"
-        digest += f"🕐 Сформирован: {current_time}\n\n"
+        digest = DigestBuilder()
+        digest.line(f"📊 <b>Дайджест очереди <a href=\"{queue_url}\">{queue_key}</a></b>")
+        digest.line(f"📅 {time_description}")
+        digest.line(f"🕐 Сформирован: {current_time}").line()
+
+        if partial:
+            digest.line("⏱ <i>Дайджест сформирован частично: истекло время ожидания.</i>").line()
 
         # Добавляем резюме с гиперссылками на очереди
         if summary and summary.strip():
-            # Убираем возможные дублирующиеся заголовки из LLM
-            clean_summary = summary.strip()
-            if clean_summary.startswith("📝 Резюме:"):
-                clean_summary = clean_summary.replace("📝 Резюме:", "").strip()
-            if clean_summary.startswith("Резюме:"):
-                clean_summary = clean_summary.replace("Резюме:", "").strip()
-            
-            # Заменяем упоминания очереди на гиперссылки в HTML формате
-            # Паттерн для поиска упоминаний очереди (с учетом регистра)
-            queue_pattern = re.compile(r'\b' + re.escape(queue_key) + r'\b', re.IGNORECASE)
-            clean_summary = queue_pattern.sub(f'<a href="{queue_url}">{queue_key}</a>', clean_summary)
-                
-            digest += f"📝 <b>Резюме:</b> {clean_summary}\n\n"
+            digest.line(f"📝 <b>Резюме:</b> {self._summary_html(summary, [queue_key])}").line()
+        elif summary_pending:
+            digest.line("📝 <i>Резюме готовится...</i>").line()
 
         # Добавляем участников (если есть)
         participants = self._extract_participants(status_groups)
         if participants:
-            digest += f"👥 <b>Задействованные участники:</b> {', '.join(participants)}\n\n"
-
-        # Добавляем задачи по статусам
-        for status, issues in status_groups.items():
-            if issues:
-                logger.info(f"Добавляем статус '{status}' с {len(issues)} задачами")
-                digest += f"📋 <b>{status} ({len(issues)}):</b>\n"
-                for issue in issues:
-                    assignee = issue.get('assignee', '')
-                    assignee_text = f" (👤 {assignee})" if assignee and assignee != 'Unassigned' else ""
-                    
-                    # Формируем URL для задачи
-                    issue_key = issue.get('key', '')
-                    issue_url = f"https://tracker.yandex.ru/{issue_key}"
-                    
-                    # Используем HTML разметку для ссылок
-                    digest += f"• <a href=\"{issue_url}\">{issue_key}</a> – {issue.get('summary', '')}{assignee_text}\n"
-                digest += "\n"
+            digest.line(f"👥 <b>Задействованные участники:</b> {escape(', '.join(participants), quote=False)}").line()
 
-        logger.info(f"Дайджест сформирован, длина: {len(digest)} символов")
-        return digest
+        self._format_issue_sections(digest, queue_key, status_groups, diff, omitted_count, since)
+
+        text = digest.build()
+        logger.info(f"Дайджест сформирован, длина: {len(text)} символов")
+        return text
+
+    def _summary_html(self, summary: str, queue_keys: List[str]) -> str:
+        """Резюме LLM в HTML: без дублирующегося заголовка, с гиперссылками на упомянутые очереди"""
+        # Убираем возможные дублирующиеся заголовки из LLM
+        clean_summary = summary.strip()
+        if clean_summary.startswith("📝 Резюме:"):
+            clean_summary = clean_summary.replace("📝 Резюме:", "").strip()
+        if clean_summary.startswith("Резюме:"):
+            clean_summary = clean_summary.replace("Резюме:", "").strip()
+        clean_summary = escape(clean_summary, quote=False)
+
+        # Заменяем упоминания очередей на гиперссылки в HTML формате
+        # Паттерн для поиска упоминаний очереди (с учетом регистра), ключи задач (QUEUE-123) не трогаем
+        for queue_key in queue_keys:
+            queue_url = f"https://tracker.yandex.ru/queues/{queue_key}"
+            queue_pattern = re.compile(r'\b' + re.escape(queue_key) + r'\b(?!-\d)', re.IGNORECASE)
+            clean_summary = queue_pattern.sub(f'<a href="{queue_url}">{queue_key}</a>', clean_summary)
+        return clean_summary
+
+    def _format_combined_digest(self, queue_digests: List[QueueDigest], summary: str,
+                                notes: List[Tuple[str, str]], partial: bool = False) -> str:
+        """Форматировать общий дайджест по нескольким очередям (partial - резюме без LLM по дедлайну)"""
+        current_time = datetime.now().strftime('%d.%m.%Y %H:%M UTC')
+        digest = DigestBuilder()
+        digest.line(f"📊 <b>Дайджест по очередям ({len(queue_digests) + len(notes)})</b>")
+        digest.line(f"🕐 Сформирован: {current_time}").line()
+
+        if partial or any(queue_digest.partial for queue_digest in queue_digests):
+            digest.line("⏱ <i>Дайджест сформирован частично: истекло время ожидания.</i>").line()
+
+        if summary and summary.strip():
+            queue_keys = [queue_digest.queue_key for queue_digest in queue_digests]
+            digest.line(f"📝 <b>Резюме:</b> {self._summary_html(summary, queue_keys)}").line()
+
+        for queue_digest in queue_digests:
+            queue_key = queue_digest.queue_key
+            queue_url = f"https://tracker.yandex.ru/queues/{queue_key}"
+            digest.line(f"📂 <b>Очередь <a href=\"{queue_url}\">{queue_key}</a></b> – {queue_digest.time_description}, "
+                        f"изменений: {queue_digest.issues_count}").line()
+            self._format_issue_sections(digest, queue_key, queue_digest.status_groups, queue_digest.shown_diff,
+                                        queue_digest.omitted_count, queue_digest.since)
+
+        if notes:
+            # Из отдельного сообщения очереди оставляем последнюю строку - сам итог
+            digest.line("ℹ️ <b>Остальные очереди:</b>" if queue_digests else "ℹ️ <b>Очереди:</b>")
+            digest.extend_lines([
+                f"• <a href=\"https://tracker.yandex.ru/queues/{queue_key}\">{queue_key}</a>: {text.strip().splitlines()[-1]}"
+                for queue_key, text in notes
+            ])
+
+        text = digest.build()
+        logger.info(f"Общий дайджест по {len(queue_digests)} очередям сформирован, длина: {len(text)} символов")
+        return text
+
+    def _format_issue_sections(self, digest: DigestBuilder, queue_key: str, status_groups: Dict[str, List[Dict]],
+                               diff: Optional[DigestDiff], omitted_count: int = 0, since: Optional[datetime] = None):
+        """Списки изменений очереди: по видам изменений или по статусам, и ссылка на не вошедшие"""
+        # Есть снимок прошлого дайджеста - показываем только изменения
+        if diff is not None:
+            self._format_diff_sections(digest, diff)
+        else:
+            # Добавляем задачи по статусам
+            for status, issues in status_groups.items():
+                if issues:
+                    logger.info(f"Добавляем статус '{status}' с {len(issues)} задачами")
+                    digest.line(f"📋 <b>{status} ({len(issues)}):</b>")
+                    digest.extend_lines([
+                        f"• {self._issue_link(issue)} – {escape(issue.get('summary') or '', quote=False)}"
+                        f"{self._assignee_text(issue.get('assignee'))}"
+                        for issue in issues
+                    ])
+                    digest.line()
+
+        # Отброшенные ранжированием изменения - одной ссылкой на фильтр Tracker
+        if omitted_count:
+            digest.line(f"➕ <a href=\"{self._changes_filter_url(queue_key, since)}\">Еще {omitted_count} изменений в Tracker</a>")
+            digest.line()
+
+    def _format_diff_sections(self, digest: DigestBuilder, diff: DigestDiff):
+        """Разделы дайджеста по видам изменений: закрытые, смены статуса, новые, переназначения"""
+        def summary_text(issue: Dict[str, Any]) -> str:
+            return escape(issue.get('summary') or '', quote=False)
 
-    def _log_digest(self, user_id: int, queue_key: str, digest_text: str, issues_count: int):
-        """Логировать дайджест в базу данных"""
+        if diff.closed:
+            digest.line(f"✅ <b>Закрыто ({len(diff.closed)}):</b>")
+            digest.extend_lines([
+                f"• {self._issue_link(change.issue)} – {summary_text(change.issue)}{self._assignee_text(change.issue.get('assignee'))}"
+                for change in diff.closed
+            ])
+            digest.line()
+        if diff.transitions:
+            digest.line(f"🔀 <b>Смена статуса ({len(diff.transitions)}):</b>")
+            digest.extend_lines([
+                f"• {self._issue_link(change.issue)} – {summary_text(change.issue)}: "
+                f"{escape(change.from_status, quote=False)} → {escape(change.to_status, quote=False)}"
+                for change in diff.transitions
+            ])
+            digest.line()
+        if diff.new:
+            digest.line(f"🆕 <b>Новые ({len(diff.new)}):</b>")
+            digest.extend_lines([
+                f"• {self._issue_link(issue)} – {summary_text(issue)} [{escape(issue.get('status') or '', quote=False)}]"
+                f"{self._assignee_text(issue.get('assignee'))}"
+                for issue in diff.new
+            ])
+            digest.line()
+        if diff.reassigned:
+            digest.line(f"👤 <b>Смена исполнителя ({len(diff.reassigned)}):</b>")
+            digest.extend_lines([
+                f"• {self._issue_link(change.issue)}: {escape(change.from_assignee or 'не назначен', quote=False)} → "
+                f"{escape(change.to_assignee or 'не назначен', quote=False)}"
+                for change in diff.reassigned
+            ])
+            digest.line()
+        if diff.removed:
+            digest.line(f"🗑 Пропало из очереди задач: {len(diff.removed)}").line()
+
+    @staticmethod
+    def _changes_filter_url(queue_key: str, since: Optional[datetime]) -> str:
+        """Ссылка на фильтр Tracker с задачами очереди, обновленными с начала окна"""
+        query = f"Queue: {queue_key}"
+        if since:
+            query += f" AND Updated: >= \"{since.strftime('%Y-%m-%d %H:%M')}\""
+        return f"https://tracker.yandex.ru/issues/?_q={quote(query)}"
+
+    @staticmethod
+    def _issue_link(issue: Dict[str, Any]) -> str:
+        """HTML-ссылка на задачу"""
+        issue_key = issue.get('key', '')
+        return f"<a href=\"https://tracker.yandex.ru/{issue_key}\">{issue_key}</a>"
+
+    @staticmethod
+    def _assignee_text(assignee: Optional[str]) -> str:
+        """Исполнитель задачи в строке дайджеста"""
+        return f" (👤 {escape(assignee, quote=False)})" if assignee and assignee != 'Unassigned' else ""
+
+    def _load_snapshot(self, user_id: int, queue_key: str) -> Optional[List[IssueState]]:
+        """Загрузить снимок задач очереди с прошлого дайджеста"""
         try:
-            db = next(get_db())
-            log_entry = DigestLog(
-                user_id=user_id,
-                queue_key=queue_key,
-                digest_text=digest_text,
-                issues_count=issues_count
-            )
-            db.add(log_entry)
-            db.commit()
+            with db_session() as db:
+                row = db.query(DigestSnapshot).filter(
+                    DigestSnapshot.user_id == user_id,
+                    DigestSnapshot.queue_key == queue_key
+                ).first()
+                if row is None:
+                    logger.info(f"Нет снимка очереди {queue_key}, используем фильтр по дате обновления")
+                    return None
+                return decode_snapshot(row.issues)
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке снимка очереди {queue_key}: {e}")
+            return None
+
+    @staticmethod
+    def _run_or_defer(deferred: Optional[List[Callable[[], Any]]], write: Callable[..., Any], *args, **kwargs):
+        """Выполнить запись в базу сразу или отложить ее в deferred"""
+        if deferred is None:
+            return write(*args, **kwargs)
+        deferred.append(functools.partial(write, *args, **kwargs))
+        return None
+
+    def commit_deferred(self, deferred: List[Callable[[], Any]]):
+        """Выполнить отложенные записи дайджеста (после успешной доставки)"""
+        for write in deferred:
+            write()
+        deferred.clear()
+
+    def _save_snapshot(self, user_id: int, queue_key: str, snapshot: List[IssueState]):
+        """Сохранить снимок задач очереди для следующего дайджеста"""
+        try:
+            with db_session() as db:
+                self._store_snapshot(db, user_id, queue_key, snapshot)
+                db.commit()
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении снимка очереди {queue_key}: {e}")
+
+    @staticmethod
+    def _store_snapshot(db, user_id: int, queue_key: str, snapshot: List[IssueState]):
+        """Записать снимок задач очереди в текущую транзакцию"""
+        upsert(db, DigestSnapshot, {
+            "user_id": user_id,
+            "queue_key": queue_key,
+            "issues": encode_snapshot(snapshot),
+            "issues_count": len(snapshot),
+            "taken_at": func.now()
+        }, ["user_id", "queue_key"], ["issues", "issues_count", "taken_at"])
+
+    def _log_digest(self, user_id: int, queue_key: str, digest_text: str, issues_count: int,
+                    payload: Optional[Dict[str, Any]] = None,
+                    snapshot: Optional[List[IssueState]] = None,
+                    digest_at: Optional[datetime] = None) -> Optional[int]:
+        """
+        Логировать дайджест в базу данных
+
+        Снимок задач, с которым сравнится следующий дайджест, сохраняется в
+        той же транзакции: если дайджест не сформирован, снимок не меняется.
+        digest_at - время формирования отложенного дайджеста: следующее окно
+        начинается с него, а не с момента доставки.
+
+        Returns:
+            id записи журнала (None при ошибке)
+        """
+        try:
+            with db_session() as db:
+                log_entry = DigestLog(
+                    user_id=user_id,
+                    queue_key=queue_key,
+                    digest_text=digest_text if settings.DIGEST_LOG_STORE_TEXT else None,
+                    payload=encode_payload(payload) if payload else None,
+                    issues_count=issues_count
+                )
+                db.add(log_entry)
+                
+                # Отметка обновляется в той же транзакции, что и запись журнала
+                upsert(db, DigestWatermark, {"user_id": user_id, "queue_key": queue_key, "last_digest_at": digest_at or func.now()},
+                       ["user_id", "queue_key"], ["last_digest_at"])
+                if snapshot is not None:
+                    self._store_snapshot(db, user_id, queue_key, snapshot)
+                db.commit()
+                log_id = log_entry.id
+            self._preloaded_watermarks.pop((user_id, queue_key), None)
+            return log_id
+        except Exception as e:
+            logger.error(f"Ошибка при логировании дайджеста: {e}")
+            return None
+
+    def _update_log(self, log_id: int, digest_text: str, payload: Dict[str, Any]):
+        """Дописать в запись журнала итоговый текст и резюме (вторая фаза дайджеста)"""
+        try:
+            with db_session() as db:
+                log_entry = db.get(DigestLog, log_id)
+                if log_entry is None:
+                    return
+                if settings.DIGEST_LOG_STORE_TEXT:
+                    log_entry.digest_text = digest_text
+                log_entry.payload = encode_payload(payload)
+                db.commit()
         except Exception as e:
-            logger.error(f"Ошибка при логировании дайджеста: {e}") 
\ No newline at end of file
+            logger.error(f"Ошибка при обновлении записи журнала дайджестов {log_id}: {e}") 
\ No newline at end of file
@@ -0,0 +1,145 @@
+"""
+Общие для всех подписчиков результаты обработки очереди
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from app.core.digest_diff import DigestDiff, IssueState, encode_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QueueDigest:
+    """
+    Результат обработки очереди за окно (выборка, группировка, резюме)
+
+    Не зависит от пользователя: одинаковое окно и одинаковый снимок дают
+    одинаковый результат, поэтому он переиспользуется всеми подписчиками очереди.
+    """
+    queue_key: str
+    time_description: str
+    snapshot: List[IssueState]
+    status_groups: Dict[str, List[Dict[str, Any]]] = field(default_factory=dict)
+    summary: str = ""
+    issues_count: int = 0
+    diff: Optional[DigestDiff] = None
+    partial: bool = False
+    # Ранжирование: в дайджест попадают самые значимые изменения, остальные - ссылкой на фильтр Tracker
+    shown_diff: Optional[DigestDiff] = None
+    top_issues: List[Dict[str, Any]] = field(default_factory=list)
+    omitted_count: int = 0
+    since: Optional[datetime] = None
+    # Резюме генерируется в фоне после группировки; его ждут все подписчики
+    summary_task: Optional['asyncio.Task[str]'] = None
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.issues_count) or (self.diff is not None and not self.diff.is_empty)
+
+
+@dataclass
+class DigestDraft:
+    """Дайджест первой фазы: текст без резюме и функция, дожидающаяся резюме"""
+    text: Optional[str]
+    finalize: Optional[Callable[[], Awaitable[str]]] = None
+
+
+def snapshot_fingerprint(snapshot: Optional[List[IssueState]]) -> Optional[str]:
+    """Отпечаток снимка: у пользователей с одинаковым снимком одинаковая разность"""
+    if snapshot is None:
+        return None
+    return hashlib.sha1(encode_snapshot(snapshot).encode('utf-8')).hexdigest()
+
+
+class SharedResultCache:
+    """
+    Кэш результатов с TTL и объединением одновременных вычислений
+
+    Пока результат по ключу вычисляется, остальные запросы с тем же ключом
+    ждут его, а не запускают вычисление повторно.
+    """
+
+    def __init__(self, ttl: float, capacity: int = 256):
+        """
+        Args:
+            ttl: Время жизни результата в секундах
+            capacity: Максимальное число хранимых результатов
+        """
+        self.ttl = ttl
+        self.capacity = capacity
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]],
+                             cacheable: Callable[[Any], bool] = lambda result: True) -> Any:
+        """
+        Получить результат из кэша или вычислить его
+
+        Args:
+            key: Ключ результата
+            compute: Корутина-фабрика, вычисляющая результат
+            cacheable: Можно ли сохранить результат (например, не частичный)
+
+        Returns:
+            Результат вычисления
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        task = self._inflight.get(key)
+        if task is not None and not task.done():
+            self.hits += 1
+            return await asyncio.shield(task)
+
+        self.misses += 1
+        task = asyncio.ensure_future(compute())
+        self._inflight[key] = task
+        # Результат сохраняет само вычисление: ожидающих могут отменить по дедлайну, а оно продолжится
+        task.add_done_callback(lambda done: self._complete(key, done, cacheable))
+        return await asyncio.shield(task)
+
+    def _complete(self, key: Hashable, task: asyncio.Task, cacheable: Callable[[Any], bool]):
+        """Завершение вычисления: убрать его из текущих и сохранить результат"""
+        # Завершенное вычисление могли уже заменить новым (пересчет частичного результата)
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        result = task.result()
+        if cacheable(result):
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._evict()
+
+    def _evict(self):
+        """Удалить просроченные и самые старые записи"""
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+        while len(self._entries) > self.capacity:
+            del self._entries[min(self._entries, key=lambda key: self._entries[key][0])]
+
+    def discard(self, key: Hashable):
+        """Удалить результат (например, частичный), чтобы следующий запрос вычислил его заново"""
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def window_start(last_digest_time: Optional[datetime]) -> Optional[datetime]:
+    """Начало окна с точностью до минуты: у подписчиков одного расписания оно совпадает"""
+    return last_digest_time.replace(second=0, microsecond=0) if last_digest_time else None
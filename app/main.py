@@ -9,9 +9,13 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
 from app.infrastructure.database.models import engine, Base
+from app import models as app_models
+from app.models.database import add_missing_columns
+from app.prompts import PromptLoader
 from app.telegram.bot import TelegramBot
 from app.scheduler.digest_scheduler import DigestScheduler
 from app.services.llm_service import LLMService
+from app.services.llm.metrics import llm_metrics
 from app.services.tracker_service import TrackerService
 
 # Настройка логирования
@@ -55,6 +59,12 @@ async def lifespan(app: FastAPI):
     # Создаем таблицы при запуске
     logger.info("🗄️ Создаю таблицы базы данных...")
     Base.metadata.create_all(bind=engine)
+    # Таблицы сервисов дайджестов (журнал, снимки очередей)
+    app_models.Base.metadata.create_all(bind=app_models.engine)
+    add_missing_columns(app_models.engine)
+    
+    # Компилируем шаблоны промтов до первого запроса
+    PromptLoader.shared().precompile()
     
     # Проверяем модель Ollama
     model_available = await check_ollama_model()
@@ -160,6 +170,14 @@ async def model_status():
         raise HTTPException(status_code=500, detail="Model status check failed")
 
 
+@app.get("/metrics")
+async def metrics():
+    """Телеметрия LLM: гистограммы скоростей и ожидания, токены, стоимость дайджестов"""
+    return {
+        "llm": llm_metrics.snapshot()
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
     
@@ -2,5 +2,7 @@ from .database import Base, engine, get_db
 from .user import User
 from .queue import Queue
 from .digest_log import DigestLog
+from .digest_snapshot import DigestSnapshot
+from .digest_watermark import DigestWatermark
 
-__all__ = ["Base", "engine", "get_db", "User", "Queue", "DigestLog"] 
\ No newline at end of file
+__all__ = ["Base", "engine", "get_db", "User", "Queue", "DigestLog", "DigestSnapshot", "DigestWatermark"] 
\ No newline at end of file
@@ -1,4 +1,8 @@
-from sqlalchemy import create_engine
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import declarative_base, sessionmaker
 from app.config import settings
 
@@ -6,10 +10,70 @@ engine = create_engine(settings.DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+logger = logging.getLogger(__name__)
+
 
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close() 
+
+
+@contextmanager
+def db_session():
+    """Сессия, которая закрывается (и возвращает соединение в пул) при выходе из блока"""
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def upsert(db, model, values: Dict[str, Any], conflict_columns: List[str],
+           update_columns: Optional[List[str]] = None):
+    """
+    INSERT ... ON CONFLICT по уникальному ключу в текущей транзакции
+
+    Одновременные вставки одной пары не падают на уникальном ограничении
+    (и не откатывают остальные изменения транзакции).
+
+    Args:
+        db: Сессия
+        model: Модель таблицы
+        values: Значения строки
+        conflict_columns: Колонки уникального ключа
+        update_columns: Колонки, которые обновляются при конфликте (None - оставить существующую строку)
+    """
+    # PostgreSQL в рабочем окружении, SQLite - для локального запуска
+    insert = postgresql.insert if db.get_bind().dialect.name == 'postgresql' else sqlite.insert
+    statement = insert(model).values(**values)
+    if update_columns:
+        statement = statement.on_conflict_do_update(
+            index_elements=conflict_columns,
+            set_={column: statement.excluded[column] for column in update_columns}
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=conflict_columns)
+    db.execute(statement)
+
+
+def add_missing_columns(bind=engine):
+    """
+    Добавить в существующие таблицы новые nullable-колонки моделей
+
+    create_all не изменяет уже созданные таблицы, а миграций в проекте нет.
+    """
+    inspector = inspect(bind)
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                logger.info(f"В таблицу {table.name} добавлена колонка {column.name} {column_type}")
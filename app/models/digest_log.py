@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, String, DateTime, Text, LargeBinary
 from sqlalchemy.sql import func
 from .database import Base
 
@@ -9,6 +9,7 @@ class DigestLog(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, nullable=False)
     queue_key = Column(String, nullable=False)
-    digest_text = Column(Text, nullable=True)
+    digest_text = Column(Text, nullable=True)  # Текст для аудита; удаляется при компактизации
+    payload = Column(LargeBinary, nullable=True)  # zlib(JSON): задачи, статусы, резюме (app.core.digest_payload)
     issues_count = Column(Integer, default=0)
     created_at = Column(DateTime(timezone=True), server_default=func.now()) 
\ No newline at end of file
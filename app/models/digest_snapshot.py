@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, UniqueConstraint
+from sqlalchemy.sql import func
+from .database import Base
+
+
+class DigestSnapshot(Base):
+    """Состояние задач очереди на момент последнего дайджеста пользователя"""
+    __tablename__ = "digest_snapshots"
+    __table_args__ = (UniqueConstraint("user_id", "queue_key", name="uq_digest_snapshot_user_queue"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    queue_key = Column(String, nullable=False)
+    issues = Column(Text, nullable=False)  # JSON: [[key, status, assignee, summary, updated], ...], по ключу
+    issues_count = Column(Integer, default=0)
+    taken_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
\ No newline at end of file
@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String, DateTime, UniqueConstraint
+from sqlalchemy.sql import func
+from .database import Base
+
+
+class DigestWatermark(Base):
+    """Время последнего дайджеста пользователя по очереди (одна строка на пару)"""
+    __tablename__ = "digest_watermarks"
+    __table_args__ = (UniqueConstraint("user_id", "queue_key", name="uq_digest_watermark_user_queue"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    queue_key = Column(String, nullable=False)
+    last_digest_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
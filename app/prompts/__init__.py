@@ -3,6 +3,7 @@
 """
 
 from .prompt_loader import PromptLoader
+from .token_budget import BudgetReport, estimate_tokens, fit_status_groups
 from .templates import *
 
-__all__ = ['PromptLoader'] 
\ No newline at end of file
+__all__ = ['PromptLoader', 'BudgetReport', 'estimate_tokens', 'fit_status_groups'] 
\ No newline at end of file
@@ -4,22 +4,38 @@
 
 import os
 import logging
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Any, Optional
-from jinja2 import Environment, FileSystemLoader, Template
+from typing import Dict, Any, List, Optional, Tuple
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
+from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+_shared_loader: Optional['PromptLoader'] = None
+_shared_lock = threading.Lock()
+
 
 class PromptLoader:
     """Загрузчик и рендерер промтов с поддержкой jinja2"""
     
-    def __init__(self, prompts_dir: Optional[str] = None):
+    # Поддиректория со статическими системными промтами для chat API
+    SYSTEM_DIR = "system"
+    
+    # Небольшие детерминированные шаблоны, результат рендеринга которых
+    # запоминается по значениям переменных (системные промты - всегда)
+    MEMOIZED_TEMPLATES = {'status_classification.md'}
+    RENDER_MEMO_SIZE = 1024
+    
+    def __init__(self, prompts_dir: Optional[str] = None, bytecode_cache_dir: Optional[str] = None):
         """
         Инициализация загрузчика промтов
         
         Args:
             prompts_dir: Путь к директории с промтами (по умолчанию app/prompts/templates)
+            bytecode_cache_dir: Каталог для скомпилированных шаблонов (без кэша, если не задан)
         """
         if prompts_dir is None:
             # Путь относительно корня проекта
@@ -28,19 +44,88 @@ class PromptLoader:
         self.prompts_dir = str(prompts_dir)
         self._ensure_prompts_dir()
         
+        # Байткод шаблонов переживает перезапуск - повторная компиляция не нужна
+        bytecode_cache = None
+        if bytecode_cache_dir:
+            Path(bytecode_cache_dir).mkdir(parents=True, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+        
         # Инициализируем jinja2 environment
         self.env = Environment(
             loader=FileSystemLoader(self.prompts_dir),
             autoescape=False,  # Для промтов не нужен autoescape
             trim_blocks=True,
-            lstrip_blocks=True
+            lstrip_blocks=True,
+            bytecode_cache=bytecode_cache
         )
         
         # Кэш для загруженных шаблонов
         self._template_cache: Dict[str, Template] = {}
+        # Кэш результатов рендеринга (LRU)
+        self._render_memo: 'OrderedDict[Tuple, str]' = OrderedDict()
+        self._lock = threading.Lock()
         
         logger.info(f"PromptLoader инициализирован с директорией: {self.prompts_dir}")
     
+    @classmethod
+    def shared(cls) -> 'PromptLoader':
+        """
+        Общий загрузчик процесса
+        
+        Все сервисы используют один экземпляр, поэтому шаблоны компилируются
+        и кэшируются один раз.
+        
+        Returns:
+            Экземпляр PromptLoader
+        """
+        global _shared_loader
+        if _shared_loader is None:
+            with _shared_lock:
+                if _shared_loader is None:
+                    _shared_loader = cls(bytecode_cache_dir=settings.PROMPT_CACHE_DIR or None)
+        return _shared_loader
+    
+    def precompile(self) -> int:
+        """
+        Скомпилировать все шаблоны заранее (при запуске приложения)
+        
+        Returns:
+            Количество скомпилированных шаблонов
+        """
+        started_at = time.perf_counter()
+        compiled = 0
+        for template_name in self.env.list_templates(extensions=['md']):
+            try:
+                self._get_template(template_name)
+                compiled += 1
+            except Exception as e:
+                logger.error(f"Не удалось скомпилировать шаблон {template_name}: {e}")
+        logger.info(f"Скомпилировано шаблонов: {compiled} за {(time.perf_counter() - started_at) * 1000:.0f} мс")
+        return compiled
+    
+    def _get_template(self, template_name: str) -> Template:
+        """Получить скомпилированный шаблон из кэша"""
+        template = self._template_cache.get(template_name)
+        if template is None:
+            with self._lock:
+                template = self._template_cache.get(template_name)
+                if template is None:
+                    template = self.env.get_template(template_name)
+                    self._template_cache[template_name] = template
+                    logger.debug(f"Загружен шаблон: {template_name}")
+        return template
+    
+    def _memo_key(self, template_name: str, kwargs: Dict[str, Any]) -> Optional[Tuple]:
+        """Ключ кэша рендеринга или None, если шаблон не запоминается"""
+        if template_name not in self.MEMOIZED_TEMPLATES and not template_name.startswith(f"{self.SYSTEM_DIR}/"):
+            return None
+        try:
+            key = (template_name, tuple(sorted(kwargs.items())))
+            hash(key)
+            return key
+        except TypeError:
+            return None
+    
     def _ensure_prompts_dir(self):
         """Создать директорию с промтами, если её нет"""
         if not Path(self.prompts_dir).exists():
@@ -63,22 +148,61 @@ class PromptLoader:
             jinja2.TemplateError: При ошибке рендеринга
         """
         try:
-            # Проверяем кэш
-            if template_name not in self._template_cache:
-                template = self.env.get_template(template_name)
-                self._template_cache[template_name] = template
-                logger.debug(f"Загружен шаблон: {template_name}")
+            memo_key = self._memo_key(template_name, kwargs)
+            if memo_key is not None:
+                with self._lock:
+                    rendered = self._render_memo.get(memo_key)
+                    if rendered is not None:
+                        self._render_memo.move_to_end(memo_key)
+                        return rendered
+            
+            template = self._get_template(template_name)
+            rendered = template.render(**kwargs).strip()
             
-            template = self._template_cache[template_name]
-            rendered = template.render(**kwargs)
+            if memo_key is not None:
+                with self._lock:
+                    self._render_memo[memo_key] = rendered
+                    if len(self._render_memo) > self.RENDER_MEMO_SIZE:
+                        self._render_memo.popitem(last=False)
             
             logger.debug(f"Отрендерен промт: {template_name}")
-            return rendered.strip()
+            return rendered
             
         except Exception as e:
             logger.error(f"Ошибка при загрузке промта {template_name}: {e}")
             raise
     
+    def has_system_prompt(self, template_name: str) -> bool:
+        """Есть ли у шаблона статический системный промт (system/<template_name>)"""
+        return (Path(self.prompts_dir) / self.SYSTEM_DIR / template_name).is_file()
+    
+    def load_chat_prompt(self, template_name: str, **kwargs) -> List[Dict[str, str]]:
+        """
+        Загрузить промт в виде сообщений для chat API
+        
+        Статическая часть (system/<template_name>) не содержит переменных и
+        одинакова для всех запросов, поэтому сервер может переиспользовать
+        KV-кэш ее префикса. Динамические данные рендерятся в user-сообщение.
+        
+        Args:
+            template_name: Имя файла шаблона (например, 'create_task.md')
+            **kwargs: Переменные для подстановки в user-сообщение
+            
+        Returns:
+            Список сообщений [{"role": "system", ...}, {"role": "user", ...}]
+        """
+        messages = []
+        if self.has_system_prompt(template_name):
+            messages.append({
+                "role": "system",
+                "content": self.load_prompt(f"{self.SYSTEM_DIR}/{template_name}")
+            })
+        messages.append({
+            "role": "user",
+            "content": self.load_prompt(template_name, **kwargs)
+        })
+        return messages
+    
     def get_available_prompts(self) -> list[str]:
         """Получить список доступных промтов"""
         try:
@@ -89,7 +213,9 @@ class PromptLoader:
     
     def reload_templates(self):
         """Перезагрузить все шаблоны (очистить кэш)"""
-        self._template_cache.clear()
+        with self._lock:
+            self._template_cache.clear()
+            self._render_memo.clear()
         logger.info("Кэш шаблонов очищен")
     
     def validate_template(self, template_name: str, **kwargs) -> bool:
@@ -0,0 +1,107 @@
+"""
+Оценка размера промтов в токенах и ужатие данных под бюджет контекста
+"""
+
+import logging
+import math
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Токенизаторы Gemma/Qwen/Llama тратят на кириллицу примерно токен на 2.5-3.5 символа,
+# берем нижнюю границу, чтобы оценка была с запасом
+CHARS_PER_TOKEN = 2.5
+
+# Порядок отбрасывания групп: сначала то, что меньше всего нужно в резюме изменений
+STATUS_DROP_ORDER = ['To Do', 'Done', 'In Progress', 'Blocked']
+
+SUMMARY_MAX_CHARS = 120
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценить число токенов текста"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+@dataclass
+class BudgetReport:
+    """Результат подгонки данных под бюджет"""
+    status_groups: Dict[str, List[Dict[str, Any]]]
+    omitted: Dict[str, int] = field(default_factory=dict)
+    compacted: int = 0
+    estimated_tokens: int = 0
+    budget_tokens: int = 0
+
+    @property
+    def truncated(self) -> bool:
+        return bool(self.compacted or self.omitted)
+
+    @property
+    def omitted_total(self) -> int:
+        return sum(self.omitted.values())
+
+
+def _issue_line(issue: Dict[str, Any]) -> str:
+    """Строка задачи в том виде, в каком ее рендерит changes_summary.md"""
+    return f"- **{issue.get('key')}**: {issue.get('summary')} (👤 {issue.get('assignee') or 'Не назначен'})\n"
+
+
+def _section_header(status: str, count: int) -> str:
+    return f"### {status} ({count} задач)\n\n"
+
+
+def fit_status_groups(status_groups: Dict[str, List[Dict[str, Any]]], budget_tokens: int,
+                      base_tokens: int) -> BudgetReport:
+    """
+    Подогнать группы задач под бюджет промта
+
+    Сначала длинные названия обрезаются до SUMMARY_MAX_CHARS, затем
+    отбрасываются самые старые (по updated) задачи в порядке STATUS_DROP_ORDER:
+    давние To Do первыми, блокировки последними.
+
+    Args:
+        status_groups: Задачи по статусам
+        budget_tokens: Бюджет всего промта в токенах
+        base_tokens: Размер промта без задач
+
+    Returns:
+        BudgetReport с ужатыми группами и числом отброшенных задач по статусам
+    """
+    def section_tokens(groups: Dict[str, List[Dict[str, Any]]]) -> int:
+        return sum(
+            estimate_tokens(_section_header(status, len(issues))) + sum(estimate_tokens(_issue_line(issue)) for issue in issues)
+            for status, issues in groups.items() if issues
+        )
+
+    groups = {status: list(issues) for status, issues in status_groups.items()}
+    report = BudgetReport(status_groups=groups, budget_tokens=budget_tokens)
+    total = base_tokens + section_tokens(groups)
+    if total <= budget_tokens:
+        report.estimated_tokens = total
+        return report
+
+    # 1. Обрезаем длинные названия
+    for status, issues in groups.items():
+        for index, issue in enumerate(issues):
+            summary = issue.get('summary') or ''
+            if len(summary) > SUMMARY_MAX_CHARS:
+                issues[index] = {**issue, 'summary': summary[:SUMMARY_MAX_CHARS - 1].rstrip() + '…'}
+                report.compacted += 1
+    total = base_tokens + section_tokens(groups)
+
+    # 2. Отбрасываем наименее ценные задачи
+    drop_order = STATUS_DROP_ORDER + [status for status in groups if status not in STATUS_DROP_ORDER]
+    for status in drop_order:
+        issues = groups.get(status)
+        if not issues or total <= budget_tokens:
+            continue
+        # Самые давно обновленные - в начало списка на удаление
+        issues.sort(key=lambda issue: str(issue.get('updated') or ''), reverse=True)
+        while issues and total > budget_tokens:
+            dropped = issues.pop()
+            total -= estimate_tokens(_issue_line(dropped))
+            report.omitted[status] = report.omitted.get(status, 0) + 1
+
+    report.estimated_tokens = base_tokens + section_tokens(groups)
+    return report
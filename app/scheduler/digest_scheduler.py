@@ -1,35 +1,55 @@
+import asyncio
 import logging
-from datetime import datetime, time
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Deque, Dict, List
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from app.models.database import get_db
 from app.models.user import User
 from app.models.queue import Queue
-from app.services.tracker_service import TrackerService
-from app.services.llm_service import LLMService
-from app.core.digest_service import DigestService
+from app.core.deadline import Deadline
+from app.core.digest_log_retention import compact_digest_logs
+from app.core.digest_orchestrator import DigestJob, DigestResult
+from app.core.digest_renderer import iter_message_chunks
 from app.config import settings
 from app.telegram.bot import TelegramBot
 
 logger = logging.getLogger(__name__)
 
+USER_JOB_PREFIX = "user_digest_"
+# Запас к p90 длительности генерации при выборе окна подготовки
+PRECOMPUTE_SAFETY_FACTOR = 1.5
+PRECOMPUTE_PLAN_INTERVAL_SECONDS = 30
+
+
+@dataclass
+class PreparedDigest:
+    """Дайджесты пользователя, подготовленные к ближайшей отправке по расписанию"""
+    run_time: datetime
+    task: 'asyncio.Task[List[DigestResult]]'
+
 
 class DigestScheduler:
     def __init__(self, telegram_bot: TelegramBot):
         self.telegram_bot = telegram_bot
         self.scheduler = AsyncIOScheduler()
         
-        # Создаем TrackerService с правильными параметрами
-        self.tracker_service = TrackerService(
-            token=settings.YANDEX_TRACKER_TOKEN,
-            org_id=settings.YANDEX_ORG_ID,
-            cloud_org_id=settings.YANDEX_CLOUD_ORG_ID
-        )
+        self.tracker_service = telegram_bot.tracker_service
         
-        self.digest_service = DigestService(
-            self.tracker_service,
-            LLMService()
-        )
+        # Общий с ботом сервис дайджестов: выборки и резюме очередей переиспользуются
+        # между рассылкой по расписанию и /send_now
+        self.digest_service = telegram_bot.digest_service
+        self.digest_orchestrator = telegram_bot.digest_orchestrator
+        
+        # Заранее подготовленные дайджесты и наблюдаемая длительность их генерации
+        self._prepared: Dict[str, PreparedDigest] = {}
+        self._generation_times: Deque[float] = deque(maxlen=100)
+        # Число выполняющихся заданий рассылки (для перехода в быстрый режим под нагрузкой)
+        self._jobs_in_flight = 0
 
     def start(self):
         """Запустить планировщик"""
@@ -43,6 +63,40 @@ class DigestScheduler:
             name="Ежедневный дайджест в 9:00"
         )
         
+        # Подготовка дайджестов до времени отправки по пользовательским расписаниям
+        if settings.DIGEST_PRECOMPUTE_ENABLED:
+            self.scheduler.add_job(
+                self._plan_precompute,
+                IntervalTrigger(seconds=PRECOMPUTE_PLAN_INTERVAL_SECONDS),
+                id="Подготовка дайджестов",
+                name="Подготовка дайджестов до времени отправки"
+            )
+        
+        # Сводки за неделю (по понедельникам) и за месяц (1-го числа) из журнала дайджестов
+        if settings.DIGEST_ROLLUP_SCHEDULE_ENABLED:
+            self.scheduler.add_job(
+                self._send_rollups,
+                CronTrigger(day_of_week="mon", hour=9, minute=0),
+                args=["week"],
+                id="Недельная сводка",
+                name="Сводка за неделю по понедельникам в 9:00"
+            )
+            self.scheduler.add_job(
+                self._send_rollups,
+                CronTrigger(day=1, hour=9, minute=0),
+                args=["month"],
+                id="Месячная сводка",
+                name="Сводка за месяц 1-го числа в 9:00"
+            )
+        
+        # Ночное прореживание журнала дайджестов
+        self.scheduler.add_job(
+            self._compact_digest_logs,
+            CronTrigger(hour=3, minute=30),
+            id="Компактизация журнала",
+            name="Компактизация журнала дайджестов в 3:30"
+        )
+        
         # Запускаем планировщик
         self.scheduler.start()
         logger.info("Планировщик дайджестов запущен")
@@ -69,7 +123,7 @@ class DigestScheduler:
                     logger.info(f"Добавляю джоб для пользователя {user.chat_id} в {hour}:{minute:02d}")
                     
                     # Добавляем задачу для пользователя
-                    job_id = f"user_digest_{user.chat_id}"
+                    job_id = f"{USER_JOB_PREFIX}{user.chat_id}"
                     self.scheduler.add_job(
                         self._send_user_digest,
                         CronTrigger(hour=hour, minute=minute),
@@ -109,7 +163,9 @@ class DigestScheduler:
             hour = int(time_parts[0])
             minute = int(time_parts[1])
             
-            job_id = f"user_digest_{chat_id}"
+            job_id = f"{USER_JOB_PREFIX}{chat_id}"
+            # Подготовленный к старому времени дайджест больше не нужен
+            self._drop_prepared(chat_id)
             
             # Удаляем старую задачу если есть
             try:
@@ -135,6 +191,21 @@ class DigestScheduler:
             logger.error(f"Ошибка при обновлении расписания для {chat_id}: {e}")
             return False
     
+    def remove_user_schedule(self, chat_id: str):
+        """Снять рассылку пользователя по расписанию (отписка)"""
+        self._drop_prepared(chat_id)
+        try:
+            self.scheduler.remove_job(f"{USER_JOB_PREFIX}{chat_id}")
+            logger.info(f"Рассылка для chat_id {chat_id} снята")
+        except Exception:
+            pass
+    
+    def _drop_prepared(self, chat_id: str):
+        """Отбросить подготовленный дайджест: его отложенные записи в базу не выполняются"""
+        prepared = self._prepared.pop(chat_id, None)
+        if prepared is not None and not prepared.task.done():
+            prepared.task.cancel()
+    
     async def _send_daily_digest(self):
         """Отправить ежедневный дайджест всем пользователям"""
         logger.info("🕘 Запуск ежедневного дайджеста в 9:00")
@@ -145,11 +216,11 @@ class DigestScheduler:
             
             logger.info(f"Отправка дайджеста {len(users)} пользователям")
             
+            # Дайджесты всех пользователей генерируются параллельно
+            jobs = []
             for user in users:
-                try:
-                    await self._send_digest_to_user(user.chat_id)
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке дайджеста пользователю {user.chat_id}: {e}")
+                jobs.extend(self._build_jobs(db, user))
+            await self._run_jobs(jobs)
                     
         except Exception as e:
             logger.error(f"Ошибка при отправке ежедневного дайджеста: {e}")
@@ -159,7 +230,11 @@ class DigestScheduler:
         logger.info(f"🕘 Запуск дайджеста для пользователя {chat_id}")
         
         try:
-            await self._send_digest_to_user(chat_id)
+            prepared = self._prepared.pop(chat_id, None)
+            if prepared is None:
+                await self._send_digest_to_user(chat_id)
+            else:
+                await self._deliver_prepared(chat_id, prepared)
             logger.info(f"✅ Дайджест успешно отправлен пользователю {chat_id}")
         except Exception as e:
             logger.error(f"❌ Ошибка при отправке дайджеста пользователю {chat_id}: {e}")
@@ -168,50 +243,177 @@ class DigestScheduler:
         """Отправить дайджест пользователю"""
         try:
             logger.info(f"📡 Получение данных для дайджеста пользователя {chat_id}")
-            
-            # Получаем очереди пользователя
+            await self._run_jobs(self._jobs_for_chat(chat_id))
+        except Exception as e:
+            logger.error(f"Ошибка при отправке дайджеста пользователю {chat_id}: {e}")
+    
+    def _precompute_lead(self) -> float:
+        """За сколько секунд до расписания начинать подготовку (по p90 длительности генерации)"""
+        if not self._generation_times:
+            return settings.DIGEST_PRECOMPUTE_MIN_SECONDS
+        ordered = sorted(self._generation_times)
+        p90 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+        return min(max(p90 * PRECOMPUTE_SAFETY_FACTOR, settings.DIGEST_PRECOMPUTE_MIN_SECONDS),
+                   settings.DIGEST_PRECOMPUTE_MAX_SECONDS)
+    
+    async def _plan_precompute(self):
+        """Запустить подготовку дайджестов, время доставки которых ближе, чем окно подготовки"""
+        lead = self._precompute_lead()
+        for job in self.scheduler.get_jobs():
+            if not job.id.startswith(USER_JOB_PREFIX) or job.next_run_time is None:
+                continue
+            chat_id = job.args[0]
+            if chat_id in self._prepared:
+                continue
+            seconds_left = (job.next_run_time - datetime.now(job.next_run_time.tzinfo)).total_seconds()
+            if 0 < seconds_left <= lead:
+                logger.info(f"Готовим дайджест для {chat_id} за {seconds_left:.0f} с до отправки (окно {lead:.0f} с)")
+                self._prepared[chat_id] = PreparedDigest(
+                    run_time=job.next_run_time,
+                    task=asyncio.create_task(self._precompute(chat_id))
+                )
+    
+    async def _precompute(self, chat_id: str) -> List[DigestResult]:
+        """Сгенерировать дайджесты пользователя заранее и держать их до времени доставки"""
+        started_at = time.monotonic()
+        jobs = self._apply_load_mode(self._jobs_for_chat(chat_id))
+        for job in jobs:
+            # До отправки в базе ничего не меняется: сбой или перезапуск не теряют изменения
+            job.defer_writes = True
+        self._jobs_in_flight += len(jobs)
+        try:
+            results = [result async for result in self.digest_orchestrator.run(jobs)]
+        finally:
+            self._jobs_in_flight -= len(jobs)
+        elapsed = time.monotonic() - started_at
+        self._generation_times.append(elapsed)
+        logger.info(f"Дайджест для {chat_id} подготовлен за {elapsed:.1f} с")
+        return results
+    
+    async def _deliver_prepared(self, chat_id: str, prepared: 'PreparedDigest'):
+        """Отправить подготовленные дайджесты и дослать изменения, случившиеся после подготовки"""
+        if not prepared.task.done():
+            logger.warning(f"Подготовка дайджеста для {chat_id} не завершилась к сроку, ждем")
+        results = await prepared.task
+        delay = (datetime.now(prepared.run_time.tzinfo) - prepared.run_time).total_seconds()
+        logger.info(f"Доставка подготовленного дайджеста {chat_id}: задержка {delay:.1f} с от расписания")
+        for result in results:
+            if await self._deliver(result):
+                self.digest_service.commit_deferred(result.pending_writes)
+        
+        # Изменения за время между подготовкой и доставкой - только если они есть
+        await self._run_jobs(self._jobs_for_chat(chat_id, refresh=True))
+    
+    def _jobs_for_chat(self, chat_id: str, refresh: bool = False) -> List[DigestJob]:
+        """Задания на дайджесты всех очередей пользователя по chat_id"""
+        db = next(get_db())
+        user = db.query(User).filter(User.chat_id == chat_id).first()
+        
+        if not user:
+            logger.error(f"Пользователь {chat_id} не найден в базе")
+            return []
+        
+        return self._build_jobs(db, user, refresh=refresh)
+    
+    def _build_jobs(self, db, user: User, refresh: bool = False) -> List[DigestJob]:
+        """Задания на дайджесты всех очередей пользователя"""
+        user_queues = db.query(Queue).filter(Queue.user_id == user.id).all()
+        
+        if not user_queues:
+            logger.info(f"У пользователя {user.chat_id} нет добавленных очередей")
+            return []
+        
+        logger.info(f"Найдено {len(user_queues)} очередей для пользователя {user.chat_id}")
+        
+        # Общий бюджет на все очереди пользователя, чтобы не занимать окно рассылки
+        deadline = Deadline(settings.SCHEDULED_DIGEST_DEADLINE_SECONDS)
+        if settings.DIGEST_COMBINED and len(user_queues) > 1:
+            # Один дайджест и одно резюме на все очереди пользователя
+            queue_keys = [queue.queue_key for queue in user_queues]
+            return [DigestJob(user.id, user.chat_id, ", ".join(queue_keys), deadline=deadline, refresh=refresh,
+                              queue_keys=queue_keys)]
+        return [DigestJob(user.id, user.chat_id, queue.queue_key, deadline=deadline, refresh=refresh)
+                for queue in user_queues]
+    
+    def _apply_load_mode(self, jobs: List[DigestJob]) -> List[DigestJob]:
+        """Перевести задания в быстрый режим (без LLM), если рассылка перегружена"""
+        threshold = settings.DIGEST_FAST_MODE_LOAD_THRESHOLD
+        if jobs and threshold and self._jobs_in_flight + len(jobs) >= threshold:
+            logger.warning(f"Высокая нагрузка ({self._jobs_in_flight + len(jobs)} заданий), "
+                           f"дайджесты {len(jobs)} очередей формируются без LLM")
+            for job in jobs:
+                job.fast = True
+        return jobs
+    
+    async def _run_jobs(self, jobs: List[DigestJob]):
+        """Сгенерировать дайджесты параллельно и отправлять каждый сразу после готовности"""
+        jobs = self._apply_load_mode(jobs)
+        for job in jobs:
+            job.defer_writes = True
+        self._jobs_in_flight += len(jobs)
+        try:
+            async for result in self.digest_orchestrator.run(jobs):
+                if await self._deliver(result):
+                    self.digest_service.commit_deferred(result.pending_writes)
+        finally:
+            self._jobs_in_flight -= len(jobs)
+    
+    async def _deliver(self, result: DigestResult) -> bool:
+        """Отправить готовый дайджест через Telegram бота; True, если он отправлен"""
+        queue_key = result.job.queue_key
+        if result.error is not None:
+            return False
+        if not result.text:
+            if not result.job.refresh:
+                logger.warning(f"Пустой дайджест для очереди {queue_key}")
+            return False
+        try:
+            # Большие дайджесты уходят несколькими сообщениями по мере нарезки
+            for chunk in iter_message_chunks(result.text):
+                await self.telegram_bot.application.bot.send_message(
+                    chat_id=result.job.chat_id,
+                    text=chunk,
+                    parse_mode='HTML'
+                )
+            logger.info(f"✅ Дайджест отправлен для очереди {queue_key} ({result.elapsed:.1f} с)")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при отправке дайджеста очереди {queue_key} пользователю {result.job.chat_id}: {e}")
+            return False
+    
+    async def _send_rollups(self, period: str):
+        """Отправить сводки за период всем пользователям по всем их очередям"""
+        logger.info(f"📆 Запуск сводок за период {period}")
+        try:
             db = next(get_db())
-            user = db.query(User).filter(User.chat_id == chat_id).first()
-            
-            if not user:
-                logger.error(f"Пользователь {chat_id} не найден в базе")
-                return
+            queues = db.query(Queue.user_id, User.chat_id, Queue.queue_key).join(User, Queue.user_id == User.id).all()
+            # Одновременно - не больше сводок, чем заданий дайджестов за один запуск
+            limit = asyncio.Semaphore(settings.DIGEST_MAX_PARALLEL)
             
-            user_queues = db.query(Queue).filter(Queue.user_id == user.id).all()
-            
-            if not user_queues:
-                logger.info(f"У пользователя {chat_id} нет добавленных очередей")
-                return
-            
-            logger.info(f"Найдено {len(user_queues)} очередей для пользователя {chat_id}")
-            
-            # Отправляем дайджест для каждой очереди
-            for queue in user_queues:
+            async def rollup(user_id: int, chat_id: str, queue_key: str) -> DigestResult:
+                job = DigestJob(user_id, chat_id, queue_key)
                 try:
-                    logger.info(f"Генерация дайджеста для очереди {queue.queue_key}")
-                    
-                    digest = await self.digest_service.generate_digest(
-                        user_id=user.id,
-                        queue_key=queue.queue_key,
-                        since_hours=24
-                    )
-                    
-                    if digest:
-                        # Отправляем через Telegram бота
-                        await self.telegram_bot.application.bot.send_message(
-                            chat_id=chat_id,
-                            text=digest,
-                            parse_mode='HTML'
+                    async with limit:
+                        text = await self.telegram_bot.digest_rollup.generate_rollup(
+                            user_id, queue_key, period,
+                            deadline=Deadline(settings.SCHEDULED_DIGEST_DEADLINE_SECONDS)
                         )
-                        logger.info(f"✅ Дайджест отправлен для очереди {queue.queue_key}")
-                    else:
-                        logger.warning(f"Пустой дайджест для очереди {queue.queue_key}")
-                        
+                    return DigestResult(job, text=text)
                 except Exception as e:
-                    logger.error(f"Ошибка при генерации дайджеста для очереди {queue.queue_key}: {e}")
-                    
+                    logger.error(f"Ошибка при формировании сводки для очереди {queue_key}: {e}")
+                    return DigestResult(job, error=e)
+            
+            for next_done in asyncio.as_completed([rollup(*queue) for queue in queues]):
+                await self._deliver(await next_done)
         except Exception as e:
-            logger.error(f"Ошибка при отправке дайджеста пользователю {chat_id}: {e}")
+            logger.error(f"Ошибка при отправке сводок за период {period}: {e}")
+    
+    async def _compact_digest_logs(self):
+        """Удалить старые тексты и проредить журнал дайджестов"""
+        try:
+            await asyncio.to_thread(compact_digest_logs)
+        except Exception as e:
+            logger.error(f"Ошибка при компактизации журнала дайджестов: {e}")
     
     def get_jobs_info(self):
         """Получить информацию о всех задачах"""
@@ -3,19 +3,33 @@ import json
 import re
 import time
 from typing import Dict, Any, Optional, List
+from app.config import settings
 from app.services.llm_service import LLMService
+from app.services.intent_classifier import (
+    CREATE_TASK_LABEL, NO_TASK_LABEL, IntentClassifier, log_sample
+)
 from app.models.user import User
 from app.models.queue import Queue
 from app.models.database import get_db
 
 logger = logging.getLogger(__name__)
 
+# Действия свободного общения, которые бот выполняет без данных от LLM:
+# при уверенном ответе классификатора LLM для них не вызывается
+LOCAL_CONVERSATION_ACTIONS = {
+    "show_digest": {"intent": "get_digest", "response": "📊 Сейчас покажу дайджест по проекту..."},
+}
+
 
 class CommandAnalyzer:
     def __init__(self, llm_service: LLMService):
         self.llm_service = llm_service
         # Контекстная память для улучшения понимания
         self.conversation_context = {}
+        # Локальный классификатор отсекает сообщения без задачи до вызова LLM
+        self.intent_classifier = IntentClassifier.load(settings.INTENT_CLASSIFIER_PATH)
+        if self.intent_classifier:
+            logger.info(f"Загружен классификатор намерений: {settings.INTENT_CLASSIFIER_PATH}")
         
     async def analyze_text(self, text: str, user_id: int) -> Dict[str, Any]:
         """Анализировать текст и определять команду с многоуровневым анализом"""
@@ -37,13 +51,15 @@ class CommandAnalyzer:
                 logger.info(f"Найдено контекстное продолжение: {context_match['command']}")
                 return context_match
 
-            # 3. Анализируем намерение создания задачи с помощью LLM
-            task_intent = await self._analyze_task_creation_intent(text, chat_id)
-            if task_intent and task_intent.get("wants_to_create_task", False):
-                logger.info(f"LLM определил намерение создать задачу: {task_intent}")
-                return task_intent
+            # 3. Локальный классификатор: уверенно любое действие, кроме задачи, - LLM не нужен
+            if self._classify_locally(text, chat_id) in (None, CREATE_TASK_LABEL):
+                # 4. Анализируем намерение создания задачи с помощью LLM
+                task_intent = await self._analyze_task_creation_intent(text, chat_id)
+                if task_intent and task_intent.get("wants_to_create_task", False):
+                    logger.info(f"LLM определил намерение создать задачу: {task_intent}")
+                    return task_intent
 
-            # 4. Fallback анализ с эвристиками
+            # 5. Fallback анализ с эвристиками
             fallback_result = self._fallback_analysis(text_lower, chat_id)
             logger.info(f"Fallback анализ: {fallback_result['command']}")
             return fallback_result
@@ -52,6 +68,39 @@ class CommandAnalyzer:
             logger.error(f"Ошибка при анализе текста: {e}")
             return self._create_unknown_response()
 
+    async def analyze_conversation(self, text: str, chat_id: str, available_queues: List[str],
+                                   available_priorities: List[str], user_context: str = "") -> Dict[str, Any]:
+        """
+        Анализировать свободное сообщение для бота
+
+        LLM не вызывается, только если локальный классификатор уверенно
+        определил действие, которое не требует данных из сообщения
+        (LOCAL_CONVERSATION_ACTIONS). Самостоятельные сообщения, разобранные
+        LLM, пишутся в обучающие примеры с выбранным LLM действием как меткой.
+
+        Returns:
+            Анализ в формате LLMService.analyze_free_conversation
+        """
+        action = self._classify_locally(text, chat_id)
+        if action in LOCAL_CONVERSATION_ACTIONS:
+            return {
+                **LOCAL_CONVERSATION_ACTIONS[action],
+                "action": action,
+                "data": {"queue_key": None, "task_data": None, "schedule_time": None, "digest_request": action == "show_digest"}
+            }
+
+        is_followup = self.llm_service.has_session(chat_id)
+        analysis = await self.llm_service.analyze_free_conversation(
+            user_message=text,
+            available_queues=available_queues,
+            available_priorities=available_priorities,
+            user_context=user_context,
+            session_id=chat_id
+        )
+        if not is_followup and not analysis.get("fallback") and analysis.get("action"):
+            log_sample(text, analysis["action"])
+        return analysis
+
     def _check_exact_matches(self, text: str) -> Optional[Dict[str, Any]]:
         """Проверить точные совпадения команд с улучшенными паттернами"""
         
@@ -136,6 +185,24 @@ class CommandAnalyzer:
 
         return None
 
+    def _classify_locally(self, text: str, chat_id: str) -> Optional[str]:
+        """
+        Предсказать намерение локальной моделью
+
+        Уточнения в активной LLM-сессии не классифицируются - их смысл
+        зависит от истории диалога.
+
+        Returns:
+            Метка, если модель уверена, иначе None
+        """
+        if not self.intent_classifier or self.llm_service.has_session(chat_id):
+            return None
+        label, probability = self.intent_classifier.predict(text)
+        if probability < settings.INTENT_CLASSIFIER_THRESHOLD:
+            return None
+        logger.info(f"Классификатор намерений: {label} ({probability:.2f})")
+        return label
+
     def _check_context_continuation(self, chat_id: str, text: str) -> Optional[Dict[str, Any]]:
         """Проверить продолжение контекста предыдущих сообщений"""
         if chat_id not in self.conversation_context:
@@ -144,8 +211,9 @@ class CommandAnalyzer:
         context = self.conversation_context[chat_id]
         last_command = context.get("last_command")
         
-        # Если последняя команда была create_task, проверяем описание
-        if last_command == "create_task" and len(text.split()) > 3:
+        # Если последняя команда была create_task, проверяем описание.
+        # При активной LLM-сессии уточнение уходит в LLM вместе с историей диалога.
+        if last_command == "create_task" and len(text.split()) > 3 and not self.llm_service.has_session(chat_id):
             return {
                 "command": "create_task",
                 "confidence": 0.7,
@@ -279,8 +347,17 @@ class CommandAnalyzer:
             if not available_queues:
                 return None
             
-            # Анализируем намерение с помощью LLM
-            intent_result = await self.llm_service.analyze_task_creation_intent(text, available_queues)
+            # Анализируем намерение с помощью LLM (уточнения продолжают сессию чата)
+            is_followup = self.llm_service.has_session(chat_id)
+            intent_result = await self.llm_service.analyze_intent(text, available_queues, None, session_id=chat_id)
+            
+            # Самостоятельные сообщения с ответом модели - обучающие примеры для классификатора
+            if not is_followup and not intent_result.get("fallback"):
+                log_sample(text, CREATE_TASK_LABEL if intent_result.get("wants_to_create_task") else NO_TASK_LABEL)
+            
+            # Сессию держим только пока задача ждет уточнений
+            if not intent_result.get("wants_to_create_task", False) or intent_result.get("has_sufficient_data", False):
+                self.llm_service.end_session(chat_id)
             
             if intent_result.get("wants_to_create_task", False):
                 # Добавляем информацию о рефакторинге
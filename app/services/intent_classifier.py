@@ -0,0 +1,293 @@
+"""
+Локальный классификатор намерений, обученный на решениях LLM
+
+Признаки - хэшированные символьные n-граммы сообщения, модель - линейный
+softmax-классификатор на NumPy. Обучается офлайн на парах
+(сообщение, намерение LLM), которые пишет CommandAnalyzer: для свободных
+сообщений бота метка - действие, выбранное LLM (create_task, show_digest,
+set_schedule, help, ...):
+
+    python -m app.services.intent_classifier train
+    python -m app.services.intent_classifier evaluate
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import time
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Метки, которые пишет CommandAnalyzer (свободное общение добавляет метки действий LLM)
+CREATE_TASK_LABEL = "create_task"
+NO_TASK_LABEL = "none"
+
+DEFAULT_FEATURES = 2 ** 15
+DEFAULT_NGRAM_RANGE = (2, 4)
+
+
+def featurize(text: str, n_features: int = DEFAULT_FEATURES,
+              ngram_range: Tuple[int, int] = DEFAULT_NGRAM_RANGE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Разреженный вектор признаков сообщения
+
+    Args:
+        text: Текст сообщения
+        n_features: Размер пространства хэшей
+        ngram_range: Минимальная и максимальная длина n-грамм
+
+    Returns:
+        Индексы признаков и их L2-нормированные веса
+    """
+    normalized = " " + re.sub(r"\s+", " ", text.lower().replace("ё", "е")).strip() + " "
+    counts: Counter = Counter()
+    for size in range(ngram_range[0], ngram_range[1] + 1):
+        for start in range(len(normalized) - size + 1):
+            counts[zlib.crc32(normalized[start:start + size].encode("utf-8")) % n_features] += 1
+
+    if not counts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    return indices, values / np.linalg.norm(values)
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max())
+    return exp / exp.sum()
+
+
+class IntentClassifier:
+    """Линейный классификатор намерений на хэшированных n-граммах"""
+
+    def __init__(self, labels: List[str], weights: np.ndarray, bias: np.ndarray,
+                 ngram_range: Tuple[int, int] = DEFAULT_NGRAM_RANGE):
+        """
+        Args:
+            labels: Метки классов
+            weights: Матрица весов (n_features, n_classes)
+            bias: Смещения классов
+            ngram_range: Длины n-грамм, с которыми обучалась модель
+        """
+        self.labels = labels
+        self.weights = weights
+        self.bias = bias
+        self.ngram_range = ngram_range
+
+    @property
+    def n_features(self) -> int:
+        return self.weights.shape[0]
+
+    def predict_proba(self, text: str) -> np.ndarray:
+        """Вероятности классов для сообщения"""
+        indices, values = featurize(text, self.n_features, self.ngram_range)
+        return _softmax(values @ self.weights[indices] + self.bias)
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """
+        Классифицировать сообщение
+
+        Returns:
+            Метка и ее вероятность
+        """
+        probabilities = self.predict_proba(text)
+        best = int(np.argmax(probabilities))
+        return self.labels[best], float(probabilities[best])
+
+    @classmethod
+    def train(cls, samples: Sequence[Tuple[str, str]], epochs: int = 15, learning_rate: float = 0.5,
+              l2: float = 1e-5, n_features: int = DEFAULT_FEATURES,
+              ngram_range: Tuple[int, int] = DEFAULT_NGRAM_RANGE, seed: int = 0) -> 'IntentClassifier':
+        """
+        Обучить модель стохастическим градиентным спуском по кросс-энтропии
+
+        Args:
+            samples: Пары (сообщение, метка)
+            epochs: Число проходов по выборке
+            learning_rate: Начальный шаг (уменьшается по эпохам)
+            l2: Коэффициент L2-регуляризации
+            n_features: Размер пространства хэшей
+            ngram_range: Длины n-грамм
+            seed: Зерно перемешивания
+
+        Returns:
+            Обученный классификатор
+        """
+        labels = sorted({label for _, label in samples})
+        if len(labels) < 2:
+            raise ValueError("Для обучения нужны примеры хотя бы двух классов")
+        label_index = {label: index for index, label in enumerate(labels)}
+        features = [featurize(text, n_features, ngram_range) for text, _ in samples]
+        targets = [label_index[label] for _, label in samples]
+
+        weights = np.zeros((n_features, len(labels)), dtype=np.float32)
+        bias = np.zeros(len(labels), dtype=np.float32)
+        order = list(range(len(samples)))
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(order)
+            step = learning_rate / (1 + epoch)
+            for position in order:
+                indices, values = features[position]
+                gradient = _softmax(values @ weights[indices] + bias)
+                gradient[targets[position]] -= 1.0
+                # Регуляризуем только затронутые строки - обновление остается разреженным
+                weights[indices] -= step * (np.outer(values, gradient) + l2 * weights[indices])
+                bias -= step * gradient
+        return cls(labels, weights, bias, ngram_range)
+
+    def evaluate(self, samples: Sequence[Tuple[str, str]], threshold: float) -> Dict[str, Any]:
+        """
+        Качество на выборке: общая точность и точность уверенных ответов
+
+        Args:
+            samples: Пары (сообщение, метка)
+            threshold: Порог уверенности, с которым модель отвечает без LLM
+
+        Returns:
+            Словарь с метриками
+        """
+        per_label: Dict[str, Dict[str, int]] = {label: {"tp": 0, "fp": 0, "fn": 0} for label in self.labels}
+        correct = confident = confident_correct = 0
+        started_at = time.perf_counter()
+        for text, label in samples:
+            predicted, probability = self.predict(text)
+            hit = predicted == label
+            correct += hit
+            if probability >= threshold:
+                confident += 1
+                confident_correct += hit
+            if hit:
+                per_label[label]["tp"] += 1
+            else:
+                per_label.setdefault(predicted, {"tp": 0, "fp": 0, "fn": 0})["fp"] += 1
+                per_label.setdefault(label, {"tp": 0, "fp": 0, "fn": 0})["fn"] += 1
+        elapsed = time.perf_counter() - started_at
+
+        total = len(samples) or 1
+        return {
+            "samples": len(samples),
+            "accuracy": round(correct / total, 4),
+            "threshold": threshold,
+            "coverage": round(confident / total, 4),
+            "confident_accuracy": round(confident_correct / confident, 4) if confident else None,
+            "microseconds_per_message": round(elapsed / total * 1e6, 1),
+            "labels": {
+                label: {
+                    "precision": round(counts["tp"] / (counts["tp"] + counts["fp"]), 4) if counts["tp"] + counts["fp"] else None,
+                    "recall": round(counts["tp"] / (counts["tp"] + counts["fn"]), 4) if counts["tp"] + counts["fn"] else None
+                }
+                for label, counts in per_label.items()
+            }
+        }
+
+    def save(self, path: str):
+        """Сохранить модель в .npz"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(
+            path,
+            labels=np.array(self.labels),
+            weights=self.weights,
+            bias=self.bias,
+            ngram_range=np.array(self.ngram_range)
+        )
+
+    @classmethod
+    def load(cls, path: str) -> Optional['IntentClassifier']:
+        """
+        Загрузить модель из .npz
+
+        Returns:
+            Классификатор или None, если модель еще не обучена
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return cls(
+                    labels=[str(label) for label in data["labels"]],
+                    weights=data["weights"],
+                    bias=data["bias"],
+                    ngram_range=tuple(int(size) for size in data["ngram_range"])
+                )
+        except Exception as e:
+            logger.error(f"Не удалось загрузить классификатор намерений {path}: {e}")
+            return None
+
+
+def log_sample(text: str, label: str, path: Optional[str] = None):
+    """Дописать пару (сообщение, решение LLM) в JSONL для обучения"""
+    path = path or settings.INTENT_SAMPLES_PATH
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a", encoding="utf-8") as samples_file:
+            samples_file.write(json.dumps({"text": text, "label": label, "ts": int(time.time())}, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logger.warning(f"Не удалось записать пример для классификатора: {e}")
+
+
+def load_samples(path: str) -> List[Tuple[str, str]]:
+    """Прочитать пары (сообщение, метка) из JSONL, последняя метка сообщения побеждает"""
+    latest: Dict[str, str] = {}
+    with open(path, encoding="utf-8") as samples_file:
+        for line in samples_file:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            latest[record["text"].strip()] = record["label"]
+    return list(latest.items())
+
+
+def _split(samples: List[Tuple[str, str]], holdout: float, seed: int) -> Tuple[List, List]:
+    shuffled = list(samples)
+    random.Random(seed).shuffle(shuffled)
+    cut = int(len(shuffled) * (1 - holdout))
+    return shuffled[:cut], shuffled[cut:]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Обучение и оценка локального классификатора намерений")
+    parser.add_argument("command", choices=["train", "evaluate"])
+    parser.add_argument("--data", default=settings.INTENT_SAMPLES_PATH, help="JSONL с парами (text, label)")
+    parser.add_argument("--model", default=settings.INTENT_CLASSIFIER_PATH, help="Путь к модели .npz")
+    parser.add_argument("--threshold", type=float, default=settings.INTENT_CLASSIFIER_THRESHOLD)
+    parser.add_argument("--holdout", type=float, default=0.2, help="Доля отложенной выборки при обучении")
+    parser.add_argument("--epochs", type=int, default=15)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    samples = load_samples(args.data)
+    print(f"Примеров: {len(samples)}, классы: {dict(Counter(label for _, label in samples))}")
+
+    if args.command == "train":
+        train_samples, test_samples = _split(samples, args.holdout, args.seed) if args.holdout else (samples, [])
+        started_at = time.perf_counter()
+        classifier = IntentClassifier.train(train_samples, epochs=args.epochs, seed=args.seed)
+        print(f"Обучено за {time.perf_counter() - started_at:.1f} c на {len(train_samples)} примерах")
+        if test_samples:
+            print(json.dumps(classifier.evaluate(test_samples, args.threshold), ensure_ascii=False, indent=2))
+        # Итоговую модель обучаем на всех данных
+        if test_samples:
+            classifier = IntentClassifier.train(samples, epochs=args.epochs, seed=args.seed)
+        classifier.save(args.model)
+        print(f"Модель сохранена: {args.model}")
+    else:
+        classifier = IntentClassifier.load(args.model)
+        if classifier is None:
+            parser.error(f"Модель {args.model} не найдена")
+        print(json.dumps(classifier.evaluate(samples, args.threshold), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
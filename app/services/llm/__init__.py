@@ -4,6 +4,9 @@ LLM сервисы для AI-Tracker
 
 from .base import BaseLLMProvider
 from .ollama_provider import OllamaProvider
+from .openai_provider import OpenAICompatibleProvider
+from .gigachat_provider import GigaChatProvider
 from .llm_service import LLMService
+from .metrics import LLMMetrics, llm_metrics
 
-__all__ = ['BaseLLMProvider', 'OllamaProvider', 'LLMService'] 
\ No newline at end of file
+__all__ = ['BaseLLMProvider', 'OllamaProvider', 'OpenAICompatibleProvider', 'GigaChatProvider', 'LLMService', 'LLMMetrics', 'llm_metrics'] 
\ No newline at end of file
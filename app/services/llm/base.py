@@ -2,9 +2,10 @@
 Базовый класс для LLM-провайдеров
 """
 
+import asyncio
 import logging
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional
+from typing import AsyncIterator, Dict, Any, List, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +25,10 @@ class BaseLLMProvider(ABC):
         self.config = config
         self.timeout = config.get('timeout', 60)
         
+        # Модели по уровням маршрутизации (strong - основная, fast - для дешевых вызовов)
+        self.model = config.get('model')
+        self.fast_model = config.get('fast_model') or self.model
+        
         logger.info(f"Инициализирован LLM-провайдер: {name}")
     
     @abstractmethod
@@ -43,6 +48,70 @@ class BaseLLMProvider(ABC):
         """
         pass
     
+    async def chat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        """
+        Генерировать ответ по списку сообщений (chat API)
+        
+        Реализация по умолчанию склеивает сообщения в один промт для
+        провайдеров без chat API.
+        
+        Args:
+            messages: Сообщения в формате [{"role": ..., "content": ...}]
+            **kwargs: Дополнительные параметры
+            
+        Returns:
+            Сгенерированный ответ
+        """
+        prompt = "\n\n".join(message["content"] for message in messages)
+        return await self.generate(prompt, **kwargs)
+    
+    async def chat_stream(self, messages: List[Dict[str, str]], **kwargs) -> AsyncIterator[str]:
+        """
+        Потоковая генерация по сообщениям
+        
+        Реализация по умолчанию отдает ответ chat() одним фрагментом.
+        
+        Args:
+            messages: Сообщения в формате [{"role": ..., "content": ...}]
+            **kwargs: Дополнительные параметры
+            
+        Yields:
+            Фрагменты ответа
+        """
+        yield await self.chat(messages, **kwargs)
+    
+    async def generate_batch(self, prompts: List[str], **kwargs) -> List[str]:
+        """
+        Сгенерировать ответы на несколько промтов конкурентно
+        
+        Провайдеры ограничивают параллелизм сами (семафор, пул соединений),
+        сервер с continuous batching обрабатывает запросы одним батчем.
+        
+        Args:
+            prompts: Список промтов
+            **kwargs: Параметры, общие для всех промтов
+            
+        Returns:
+            Ответы в порядке промтов
+        """
+        return list(await asyncio.gather(*(self.generate(prompt, **kwargs) for prompt in prompts)))
+    
+    async def embed(self, texts: List[str], **kwargs) -> List[List[float]]:
+        """
+        Получить векторные представления текстов
+        
+        Args:
+            texts: Тексты для векторизации
+            **kwargs: Дополнительные параметры (model)
+            
+        Returns:
+            Векторы в порядке текстов
+            
+        Raises:
+            NotImplementedError: Если провайдер не поддерживает эмбеддинги
+        """
+        raise NotImplementedError(f"Провайдер {self.name} не поддерживает эмбеддинги")
+    
     @abstractmethod
     def is_available(self) -> bool:
         """
@@ -63,6 +132,22 @@ class BaseLLMProvider(ABC):
         """
         pass
     
+    def resolve_model(self, **kwargs) -> Optional[str]:
+        """
+        Выбрать модель для вызова
+        
+        Args:
+            **kwargs: Параметры вызова: явная model или tier (fast/strong)
+            
+        Returns:
+            Название модели
+        """
+        if kwargs.get('model'):
+            return kwargs['model']
+        if kwargs.get('tier') == 'fast':
+            return self.fast_model
+        return self.model
+    
     def get_info(self) -> Dict[str, Any]:
         """
         Получить информацию о провайдере
@@ -0,0 +1,147 @@
+"""
+GigaChat LLM-провайдер (Сбер)
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from .openai_provider import OpenAICompatibleProvider
+
+logger = logging.getLogger(__name__)
+
+# За сколько секунд до истечения токен считается непригодным и обновляется синхронно
+TOKEN_HARD_MARGIN_SECONDS = 10
+
+
+class GigaChatProvider(OpenAICompatibleProvider):
+    """
+    Провайдер для GigaChat API
+
+    API совместимо с /chat/completions, но вместо статического ключа
+    использует OAuth-токен доступа (живет 30 минут). Токен кэшируется и
+    обновляется заранее в фоне, поэтому запросы не ждут авторизации.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        """
+        Инициализация GigaChat провайдера
+
+        Args:
+            config: Конфигурация с ключами:
+                - auth_url: URL OAuth-сервера
+                - api_key: Ключ авторизации (Base64 от client_id:client_secret)
+                - scope: Версия API (GIGACHAT_API_PERS, GIGACHAT_API_CORP, ...)
+                - base_url: URL API GigaChat
+                - model / fast_model: Модели для обычных и дешевых вызовов
+                - timeout: Таймаут запросов
+                - max_concurrency: Максимум одновременных запросов
+                - refresh_ahead: За сколько секунд до истечения обновлять токен в фоне
+                - verify_ssl: Проверять ли сертификат (bool или путь к CA)
+        """
+        super().__init__(config, name="gigachat")
+
+        self.auth_url = config['auth_url']
+        self.scope = config.get('scope', 'GIGACHAT_API_PERS')
+        self.refresh_ahead = config.get('refresh_ahead', 120)
+
+        self._access_token: Optional[str] = None
+        self._expires_at = 0.0  # time.time(), секунды
+        # Запрос токена - общая задача: дедлайн одного запроса не отменяет ее для остальных
+        self._fetch_task: Optional[asyncio.Task] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def _auth_headers(self) -> Dict[str, str]:
+        """Заголовки с кэшированным токеном доступа"""
+        return {"Authorization": f"Bearer {await self._get_token()}"}
+
+    async def _on_unauthorized(self) -> bool:
+        """Токен отозван или истек раньше срока - получаем новый"""
+        logger.warning("GigaChat вернул 401, обновляем токен доступа")
+        self._access_token = None
+        self._expires_at = 0.0
+        return True
+
+    async def _get_token(self) -> str:
+        """
+        Получить токен доступа
+
+        Свежий токен возвращается сразу. В окне refresh_ahead до истечения
+        текущий токен еще используется, а новый запрашивается в фоне. Если
+        токена нет или он почти истек, запрос ждет обновления. Одновременные
+        запросы ждут один общий запрос токена; ожидание ограничено дедлайном
+        вызывающего (см. _post_completion), сам запрос токена при этом не
+        отменяется.
+
+        Returns:
+            Токен доступа
+        """
+        remaining = self._expires_at - time.time()
+        if self._access_token and remaining > TOKEN_HARD_MARGIN_SECONDS:
+            if remaining <= self.refresh_ahead and (self._refresh_task is None or self._refresh_task.done()):
+                self._refresh_task = asyncio.create_task(self._refresh_in_background())
+            return self._access_token
+
+        return await asyncio.shield(self._start_fetch())
+
+    def _start_fetch(self) -> asyncio.Task:
+        """Запустить запрос токена или вернуть уже идущий"""
+        if self._fetch_task is None or self._fetch_task.done():
+            self._fetch_task = asyncio.create_task(self._fetch_token())
+            # Ошибку забирают ожидающие; если все они ушли по дедлайну, не шумим в логе asyncio
+            self._fetch_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._fetch_task
+
+    async def _refresh_in_background(self):
+        """Обновить токен заранее, не блокируя запросы"""
+        try:
+            await self._start_fetch()
+        except Exception as e:
+            # Текущий токен еще действует, следующий запрос попробует снова
+            logger.warning(f"Не удалось заранее обновить токен GigaChat: {e}")
+
+    async def _fetch_token(self) -> str:
+        """Запросить новый токен доступа у OAuth-сервера"""
+        response = await self.client.post(
+            self.auth_url,
+            headers={
+                "Authorization": f"Basic {self.api_key}",
+                "RqUID": str(uuid.uuid4()),
+                "Accept": "application/json"
+            },
+            data={"scope": self.scope},
+            timeout=30
+        )
+        if response.status_code != 200:
+            raise Exception(f"Ошибка авторизации GigaChat: {response.status_code} - {response.text}")
+
+        result = response.json()
+        self._access_token = result["access_token"]
+        # expires_at приходит в миллисекундах
+        self._expires_at = result["expires_at"] / 1000
+        logger.info(f"Получен токен GigaChat, действует {self._expires_at - time.time():.0f} секунд")
+        return self._access_token
+
+    def _build_payload(self, model: str, messages: List[Dict[str, str]], stream: bool, **kwargs) -> Dict[str, Any]:
+        """Собрать тело запроса без параметров, которые GigaChat не поддерживает"""
+        payload = super()._build_payload(model, messages, stream, **kwargs)
+        payload.pop("response_format", None)
+        payload.pop("stream_options", None)
+        return payload
+
+    def is_available(self) -> bool:
+        """
+        Проверить доступность провайдера
+
+        Returns:
+            True если задан ключ авторизации
+        """
+        return bool(self.api_key and self.auth_url)
+
+    async def close(self):
+        """Остановить обновление токена и закрыть пул соединений"""
+        for task in (self._refresh_task, self._fetch_task):
+            if task is not None and not task.done():
+                task.cancel()
+        await super().close()
@@ -0,0 +1,251 @@
+"""
+Векторный индекс задач очереди для поиска дубликатов
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBED_BATCH_SIZE = 64
+MIN_CAPACITY = 256
+
+
+@dataclass
+class _QueueShard:
+    """Матрица эмбеддингов очереди и ее метаданные"""
+    vectors: Optional[np.memmap]
+    dim: int = 0
+    keys: List[str] = field(default_factory=list)
+    summaries: List[str] = field(default_factory=list)
+    updated: List[str] = field(default_factory=list)
+    watermark: Optional[str] = None
+    refreshed_at: float = 0.0
+    positions: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def capacity(self) -> int:
+        return 0 if self.vectors is None else self.vectors.shape[0]
+
+
+class IssueIndex:
+    """
+    Инкрементальный индекс эмбеддингов названий задач по очередям
+
+    Для каждой очереди хранятся два файла: матрица нормированных векторов
+    float16 (memory-mapped, {queue}.f16) и JSON с ключами задач, названиями
+    и временем обновления ({queue}.json). При обновлении из Tracker
+    запрашиваются только задачи, измененные с последнего обновления, и
+    пересчитываются эмбеддинги только тех, у которых изменилось поле updated.
+    """
+
+    def __init__(self, directory: str, embed: Callable[[List[str]], Awaitable[List[List[float]]]],
+                 load_issues: Callable[..., List[Dict[str, Any]]], refresh_interval: float = 300):
+        """
+        Args:
+            directory: Каталог для файлов индекса
+            embed: Асинхронная функция векторизации списка текстов
+            load_issues: Синхронная загрузка задач очереди (TrackerService.get_queue_issues)
+            refresh_interval: Минимальный интервал между обновлениями очереди в секундах
+        """
+        self.directory = directory
+        self._embed = embed
+        self._load_issues = load_issues
+        self.refresh_interval = refresh_interval
+        self._shards: Dict[str, _QueueShard] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._warming: Dict[str, asyncio.Task] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    async def find_similar(self, queue_key: str, text: str, top_k: int = 3,
+                           min_score: float = 0.0) -> List[Dict[str, Any]]:
+        """
+        Найти задачи очереди с ближайшими к тексту названиями
+
+        Args:
+            queue_key: Ключ очереди
+            text: Текст новой задачи
+            top_k: Сколько соседей вернуть
+            min_score: Минимальная косинусная близость
+
+        Returns:
+            Список {key, summary, score} по убыванию близости
+            (пустой, пока индекс очереди строится)
+        """
+        # Поиск не ждет Tracker: устаревший индекс обновляется в фоне, а
+        # пока очередь индексируется впервые, дубликаты не ищутся
+        self.warm(queue_key)
+        shard = self._shards.get(queue_key)
+        if shard is None:
+            shard = self._shards[queue_key] = self._load_shard(queue_key)
+        count = len(shard.keys)
+        if not count:
+            return []
+
+        query = self._normalize((await self._embed([text]))[0])
+        if query.shape[0] != shard.dim:
+            logger.warning(f"Размерность эмбеддингов изменилась ({shard.dim} -> {query.shape[0]}), индекс {queue_key} будет пересобран")
+            self._reset(queue_key)
+            return []
+
+        started_at = time.perf_counter()
+        scores = shard.vectors[:count].astype(np.float32) @ query
+        k = min(top_k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        logger.info(f"Поиск дубликатов в {queue_key}: {count} задач за {(time.perf_counter() - started_at) * 1000:.1f} мс")
+        return [
+            {"key": shard.keys[index], "summary": shard.summaries[index], "score": round(float(scores[index]), 3)}
+            for index in top if scores[index] >= min_score
+        ]
+
+    def warm(self, queue_key: str):
+        """
+        Обновить индекс очереди в фоне, если он устарел
+
+        Повторные вызовы, пока обновление идет, ничего не запускают.
+        """
+        shard = self._shards.get(queue_key)
+        if shard is not None and time.monotonic() - shard.refreshed_at < self.refresh_interval:
+            return
+        task = self._warming.get(queue_key)
+        if task is None or task.done():
+            self._warming[queue_key] = asyncio.create_task(self._warm(queue_key))
+
+    async def _warm(self, queue_key: str):
+        """Фоновое обновление индекса очереди"""
+        try:
+            await self.refresh(queue_key)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить индекс задач {queue_key}: {e}")
+
+    async def refresh(self, queue_key: str, force: bool = False):
+        """
+        Догрузить в индекс задачи, измененные с последнего обновления
+
+        Args:
+            queue_key: Ключ очереди
+            force: Обновить, даже если интервал еще не прошел
+        """
+        lock = self._locks.setdefault(queue_key, asyncio.Lock())
+        async with lock:
+            shard = self._shards.get(queue_key) or self._load_shard(queue_key)
+            self._shards[queue_key] = shard
+            if not force and time.monotonic() - shard.refreshed_at < self.refresh_interval:
+                return
+
+            # Tracker фильтрует по дате - задачи за день водяного знака придут повторно и отсеются по updated
+            filter_query = f'Updated: >= "{shard.watermark[:10]}"' if shard.watermark else None
+            issues = await asyncio.to_thread(self._load_issues, queue_key, filter_query)
+            changed = [
+                issue for issue in issues
+                if issue.get('key') and (issue['key'] not in shard.positions
+                                         or shard.updated[shard.positions[issue['key']]] != str(issue.get('updated')))
+            ]
+            if changed:
+                await self._upsert(queue_key, shard, changed)
+            shard.refreshed_at = time.monotonic()
+            logger.info(f"Индекс задач {queue_key}: получено {len(issues)}, пересчитано {len(changed)}, всего {len(shard.keys)}")
+
+    async def _upsert(self, queue_key: str, shard: _QueueShard, issues: List[Dict[str, Any]]):
+        """Записать эмбеддинги новых и измененных задач"""
+        for start in range(0, len(issues), EMBED_BATCH_SIZE):
+            batch = issues[start:start + EMBED_BATCH_SIZE]
+            vectors = await self._embed([issue.get('summary') or '' for issue in batch])
+            for issue, vector in zip(batch, vectors):
+                vector = self._normalize(vector)
+                if shard.vectors is None:
+                    shard.dim = vector.shape[0]
+                    self._grow(queue_key, shard, MIN_CAPACITY)
+                key = issue['key']
+                position = shard.positions.get(key)
+                if position is None:
+                    position = len(shard.keys)
+                    if position >= shard.capacity:
+                        self._grow(queue_key, shard, shard.capacity * 2)
+                    shard.keys.append(key)
+                    shard.summaries.append('')
+                    shard.updated.append('')
+                    shard.positions[key] = position
+                shard.vectors[position] = vector
+                shard.summaries[position] = issue.get('summary') or ''
+                shard.updated[position] = str(issue.get('updated'))
+                if issue.get('updated') and (shard.watermark is None or str(issue['updated']) > shard.watermark):
+                    shard.watermark = str(issue['updated'])
+        self._save_shard(queue_key, shard)
+
+    def _grow(self, queue_key: str, shard: _QueueShard, capacity: int):
+        """Пересоздать файл матрицы с большей емкостью"""
+        path = self._matrix_path(queue_key)
+        tmp_path = path + ".tmp"
+        vectors = np.memmap(tmp_path, dtype=np.float16, mode='w+', shape=(capacity, shard.dim))
+        if shard.vectors is not None:
+            vectors[:len(shard.keys)] = shard.vectors[:len(shard.keys)]
+            del shard.vectors
+        vectors.flush()
+        os.replace(tmp_path, path)
+        shard.vectors = np.memmap(path, dtype=np.float16, mode='r+', shape=(capacity, shard.dim))
+
+    def _load_shard(self, queue_key: str) -> _QueueShard:
+        """Открыть файлы индекса очереди"""
+        meta_path = self._meta_path(queue_key)
+        if not os.path.exists(meta_path) or not os.path.exists(self._matrix_path(queue_key)):
+            return _QueueShard(vectors=None)
+        try:
+            with open(meta_path, encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+            vectors = np.memmap(self._matrix_path(queue_key), dtype=np.float16, mode='r+',
+                                shape=(meta['capacity'], meta['dim']))
+            return _QueueShard(
+                vectors=vectors,
+                dim=meta['dim'],
+                keys=meta['keys'],
+                summaries=meta['summaries'],
+                updated=meta['updated'],
+                watermark=meta.get('watermark'),
+                positions={key: position for position, key in enumerate(meta['keys'])}
+            )
+        except Exception as e:
+            logger.error(f"Индекс задач {queue_key} поврежден, строим заново: {e}")
+            return _QueueShard(vectors=None)
+
+    def _save_shard(self, queue_key: str, shard: _QueueShard):
+        """Сбросить матрицу на диск и атомарно записать метаданные"""
+        shard.vectors.flush()
+        meta_path = self._meta_path(queue_key)
+        with open(meta_path + ".tmp", "w", encoding='utf-8') as meta_file:
+            json.dump({
+                "dim": shard.dim,
+                "capacity": shard.capacity,
+                "keys": shard.keys,
+                "summaries": shard.summaries,
+                "updated": shard.updated,
+                "watermark": shard.watermark
+            }, meta_file, ensure_ascii=False)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def _reset(self, queue_key: str):
+        """Удалить индекс очереди (например, после смены модели эмбеддингов)"""
+        self._shards.pop(queue_key, None)
+        for path in (self._meta_path(queue_key), self._matrix_path(queue_key)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _matrix_path(self, queue_key: str) -> str:
+        return os.path.join(self.directory, f"{queue_key}.f16")
+
+    def _meta_path(self, queue_key: str) -> str:
+        return os.path.join(self.directory, f"{queue_key}.json")
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
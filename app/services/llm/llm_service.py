@@ -17,7 +17,7 @@ class LLMService:
     
     def __init__(self):
         """Инициализация LLM-сервиса"""
-        self.prompt_loader = PromptLoader()
+        self.prompt_loader = PromptLoader.shared()
         
         # Инициализируем провайдеры
         self.providers: Dict[str, Any] = {}
@@ -62,6 +62,23 @@ class LLMService:
         
         return await provider.generate(prompt, **kwargs)
     
+    async def chat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        """
+        Генерировать ответ по сообщениям через chat API активного провайдера
+        
+        Args:
+            messages: Сообщения (статический system-промт + user-сообщения)
+            **kwargs: Дополнительные параметры
+            
+        Returns:
+            Сгенерированный ответ
+        """
+        provider = self.providers.get(self.active_provider)
+        if not provider:
+            raise ValueError(f"Провайдер {self.active_provider} не найден")
+        
+        return await provider.chat(messages, **kwargs)
+    
     async def create_task(self, user_text: str, available_queues: List[str], 
                          available_priorities: List[str] = None) -> Dict[str, Any]:
         """
@@ -77,7 +94,7 @@ class LLMService:
         """
         try:
             # Загружаем промт для создания задачи
-            prompt = self.prompt_loader.load_prompt(
+            messages = self.prompt_loader.load_chat_prompt(
                 'create_task.md',
                 user_text=user_text,
                 available_queues=available_queues,
@@ -85,7 +102,7 @@ class LLMService:
             )
             
             # Генерируем ответ
-            response = await self.generate(prompt)
+            response = await self.chat(messages)
             
             # Парсим JSON из ответа
             return self._parse_json_response(response)
@@ -109,7 +126,7 @@ class LLMService:
         """
         try:
             # Загружаем промт для анализа намерений
-            prompt = self.prompt_loader.load_prompt(
+            messages = self.prompt_loader.load_chat_prompt(
                 'analyze_intent.md',
                 user_text=user_text,
                 available_queues=available_queues,
@@ -117,7 +134,7 @@ class LLMService:
             )
             
             # Генерируем ответ
-            response = await self.generate(prompt)
+            response = await self.chat(messages)
             
             # Парсим JSON из ответа
             return self._parse_json_response(response)
@@ -200,7 +217,7 @@ class LLMService:
         """
         try:
             # Загружаем промт для свободного общения
-            prompt = self.prompt_loader.load_prompt(
+            messages = self.prompt_loader.load_chat_prompt(
                 'free_conversation.md',
                 user_message=user_message,
                 available_queues=available_queues,
@@ -209,7 +226,7 @@ class LLMService:
             )
             
             # Генерируем ответ
-            response = await self.generate(prompt)
+            response = await self.chat(messages)
             
             # Парсим JSON из ответа
             return self._parse_json_response(response)
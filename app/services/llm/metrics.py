@@ -0,0 +1,239 @@
+"""
+Телеметрия LLM-вызовов по счетчикам Ollama (prompt_eval_count, eval_count, ...)
+"""
+
+import bisect
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм
+RATE_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+SECONDS_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+
+@dataclass
+class LLMCallStats:
+    """Статистика одного вызова LLM"""
+    template: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    prompt_eval_seconds: float = 0.0
+    eval_seconds: float = 0.0
+    load_seconds: float = 0.0
+    total_seconds: float = 0.0
+    wall_seconds: float = 0.0
+
+    @classmethod
+    def from_ollama(cls, result: Dict[str, Any], template: str, model: str, wall_seconds: float) -> 'LLMCallStats':
+        """Создать статистику из ответа Ollama (длительности в наносекундах)"""
+        return cls(
+            template=template,
+            model=model,
+            prompt_tokens=result.get('prompt_eval_count', 0) or 0,
+            completion_tokens=result.get('eval_count', 0) or 0,
+            prompt_eval_seconds=(result.get('prompt_eval_duration', 0) or 0) / 1e9,
+            eval_seconds=(result.get('eval_duration', 0) or 0) / 1e9,
+            load_seconds=(result.get('load_duration', 0) or 0) / 1e9,
+            total_seconds=(result.get('total_duration', 0) or 0) / 1e9,
+            wall_seconds=wall_seconds
+        )
+
+    @property
+    def prefill_tps(self) -> Optional[float]:
+        """Скорость обработки промта, токенов/с"""
+        if self.prompt_tokens and self.prompt_eval_seconds:
+            return self.prompt_tokens / self.prompt_eval_seconds
+        return None
+
+    @property
+    def decode_tps(self) -> Optional[float]:
+        """Скорость генерации, токенов/с"""
+        if self.completion_tokens and self.eval_seconds:
+            return self.completion_tokens / self.eval_seconds
+        return None
+
+    @property
+    def queue_wait_seconds(self) -> float:
+        """Время вне обработки на сервере: очередь запросов и сеть"""
+        return max(0.0, self.wall_seconds - self.total_seconds)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами"""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """Добавить наблюдение"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля по верхней границе корзины"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Состояние гистограммы для отдачи наружу"""
+        buckets = {str(bound): count for bound, count in zip(self.buckets, self.counts)}
+        buckets['+Inf'] = self.counts[-1]
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 4),
+            "avg": round(self.sum / self.count, 4) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "buckets": buckets
+        }
+
+
+@dataclass
+class UsageCollector:
+    """Сбор LLM-вызовов в рамках одной операции (например, дайджеста)"""
+    calls: List[LLMCallStats] = field(default_factory=list)
+
+    def breakdown(self) -> Dict[str, Any]:
+        """Стоимость операции в разрезе шаблонов"""
+        by_template: Dict[str, Dict[str, Any]] = {}
+        for call in self.calls:
+            entry = by_template.setdefault(call.template, {
+                "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0
+            })
+            entry["calls"] += 1
+            entry["prompt_tokens"] += call.prompt_tokens
+            entry["completion_tokens"] += call.completion_tokens
+            entry["seconds"] = round(entry["seconds"] + call.wall_seconds, 3)
+        return {
+            "calls": len(self.calls),
+            "prompt_tokens": sum(call.prompt_tokens for call in self.calls),
+            "completion_tokens": sum(call.completion_tokens for call in self.calls),
+            "seconds": round(sum(call.wall_seconds for call in self.calls), 3),
+            "by_template": by_template
+        }
+
+
+_current_usage: ContextVar[Optional[UsageCollector]] = ContextVar("llm_usage", default=None)
+
+
+class LLMMetrics:
+    """Реестр телеметрии LLM с гистограммами по (шаблон, модель)"""
+
+    HISTOGRAMS = {
+        "prefill_tokens_per_second": RATE_BUCKETS,
+        "decode_tokens_per_second": RATE_BUCKETS,
+        "queue_wait_seconds": SECONDS_BUCKETS,
+        "load_seconds": SECONDS_BUCKETS,
+        "total_seconds": SECONDS_BUCKETS,
+    }
+
+    def __init__(self, recent_digests: int = 50):
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, str, str], Histogram] = {}
+        self._tokens: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._recent_digests: Deque[Dict[str, Any]] = deque(maxlen=recent_digests)
+
+    def record(self, stats: LLMCallStats):
+        """Учесть вызов LLM в гистограммах и в текущем сборщике операции"""
+        values = {
+            "prefill_tokens_per_second": stats.prefill_tps,
+            "decode_tokens_per_second": stats.decode_tps,
+            "queue_wait_seconds": stats.queue_wait_seconds,
+            "load_seconds": stats.load_seconds,
+            "total_seconds": stats.wall_seconds,
+        }
+        with self._lock:
+            for name, value in values.items():
+                if value is None:
+                    continue
+                key = (name, stats.template, stats.model)
+                if key not in self._histograms:
+                    self._histograms[key] = Histogram(self.HISTOGRAMS[name])
+                self._histograms[key].observe(value)
+            tokens = self._tokens.setdefault((stats.template, stats.model), {
+                "calls": 0, "prompt_tokens": 0, "completion_tokens": 0
+            })
+            tokens["calls"] += 1
+            tokens["prompt_tokens"] += stats.prompt_tokens
+            tokens["completion_tokens"] += stats.completion_tokens
+
+        usage = _current_usage.get()
+        if usage is not None:
+            usage.calls.append(stats)
+
+        logger.info(
+            f"LLM [{stats.template}/{stats.model}]: prompt={stats.prompt_tokens} tok, "
+            f"completion={stats.completion_tokens} tok, prefill={_fmt_rate(stats.prefill_tps)}, "
+            f"decode={_fmt_rate(stats.decode_tps)}, load={stats.load_seconds:.2f}s, "
+            f"wait={stats.queue_wait_seconds:.2f}s"
+        )
+
+    @contextmanager
+    def track_usage(self) -> Iterator[UsageCollector]:
+        """Собирать вызовы LLM внутри блока (включая дочерние задачи asyncio)"""
+        collector = UsageCollector()
+        token = _current_usage.set(collector)
+        try:
+            yield collector
+        finally:
+            _current_usage.reset(token)
+
+    def record_digest(self, user_id: int, queue_key: str, usage: UsageCollector):
+        """Сохранить разбивку стоимости дайджеста"""
+        breakdown = usage.breakdown()
+        with self._lock:
+            self._recent_digests.append({
+                "user_id": user_id,
+                "queue_key": queue_key,
+                "created_at": datetime.now().isoformat(timespec='seconds'),
+                **breakdown
+            })
+        logger.info(f"Стоимость дайджеста {queue_key}: {breakdown}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Текущее состояние метрик"""
+        with self._lock:
+            histograms: Dict[str, List[Dict[str, Any]]] = {}
+            for (name, template, model), histogram in sorted(self._histograms.items()):
+                histograms.setdefault(name, []).append({
+                    "template": template,
+                    "model": model,
+                    **histogram.snapshot()
+                })
+            tokens = [
+                {"template": template, "model": model, **counters}
+                for (template, model), counters in sorted(self._tokens.items())
+            ]
+            return {
+                "histograms": histograms,
+                "tokens": tokens,
+                "recent_digests": list(self._recent_digests)
+            }
+
+
+def _fmt_rate(value: Optional[float]) -> str:
+    return f"{value:.1f} tok/s" if value is not None else "n/a"
+
+
+# Общий реестр процесса
+llm_metrics = LLMMetrics()
@@ -2,10 +2,14 @@
 Ollama LLM-провайдер
 """
 
+import json
 import logging
+import time
 import httpx
-from typing import Dict, Any, Optional
+from typing import AsyncIterator, Dict, Any, List, Optional
+from app.core.deadline import Deadline, DeadlineExceeded
 from .base import BaseLLMProvider
+from .metrics import LLMCallStats, llm_metrics
 
 logger = logging.getLogger(__name__)
 
@@ -20,13 +24,17 @@ class OllamaProvider(BaseLLMProvider):
         Args:
             config: Конфигурация с ключами:
                 - base_url: URL Ollama сервера
-                - model: Название модели
+                - model: Название основной модели
+                - fast_model: Модель для дешевых вызовов (классификации)
+                - embed_model: Модель эмбеддингов (необязательно)
                 - timeout: Таймаут запросов
         """
         super().__init__("ollama", config)
         
         self.base_url = config.get('base_url', 'http://ollama:11434')
         self.model = config.get('model', 'hf.co/Vikhrmodels/Vikhr-Gemma-2B-instruct-GGUF:Q3_K_L')
+        self.fast_model = config.get('fast_model') or self.model
+        self.embed_model = config.get('embed_model')
         
         # Убираем trailing slash
         self.base_url = self.base_url.rstrip('/')
@@ -34,7 +42,7 @@ class OllamaProvider(BaseLLMProvider):
         # Проверяем доступность модели при инициализации
         self._check_model_availability()
         
-        logger.info(f"Ollama провайдер настроен: {self.base_url}, модель: {self.model}")
+        logger.info(f"Ollama провайдер настроен: {self.base_url}, модель: {self.model}, быстрая модель: {self.fast_model}")
     
     def _check_model_availability(self):
         """Проверить доступность модели в Ollama"""
@@ -60,6 +68,11 @@ class OllamaProvider(BaseLLMProvider):
                 
                 logger.info(f"Модель {self.model} найдена и доступна")
                 
+                # Быстрая модель необязательна - без нее дешевые вызовы идут в основную
+                if self.fast_model != self.model and self.fast_model not in available_models:
+                    logger.warning(f"Быстрая модель {self.fast_model} не найдена, используем {self.model}")
+                    self.fast_model = self.model
+                
         except Exception as e:
             logger.error(f"Ошибка при проверке модели Ollama: {e}")
             raise
@@ -70,54 +83,187 @@ class OllamaProvider(BaseLLMProvider):
         
         Args:
             prompt: Промт для генерации
-            **kwargs: Дополнительные параметры (temperature, top_p, etc.)
+            **kwargs: Дополнительные параметры (model, tier, temperature, top_p,
+                num_ctx, num_predict, json_mode, deadline, etc.)
             
         Returns:
             Сгенерированный ответ
             
         Raises:
+            DeadlineExceeded: Если истек дедлайн запроса
             Exception: При ошибке API
         """
+        logger.debug(f"Промт (первые 100 символов): {prompt[:100]}...")
+        logger.debug(f"Полный промт: {prompt}")
+        
+        result = await self._request("/api/generate", {"prompt": prompt}, **kwargs)
+        return result.get("response", "").strip()
+    
+    async def chat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        """
+        Генерировать ответ через Ollama chat API
+        
+        Статический system-промт идет первым сообщением, поэтому Ollama
+        переиспользует KV-кэш его префикса и заново обрабатывает только
+        новые сообщения.
+        
+        Args:
+            messages: Сообщения в формате [{"role": ..., "content": ...}]
+            **kwargs: Дополнительные параметры, как в generate
+            
+        Returns:
+            Текст ответа ассистента
+        """
+        logger.debug(f"Сообщения чата: {messages}")
+        
+        result = await self._request("/api/chat", {"messages": messages}, **kwargs)
+        return result.get("message", {}).get("content", "").strip()
+    
+    async def chat_stream(self, messages: List[Dict[str, str]], **kwargs) -> AsyncIterator[str]:
+        """
+        Потоковая генерация через Ollama chat API
+        
+        Args:
+            messages: Сообщения в формате [{"role": ..., "content": ...}]
+            **kwargs: Дополнительные параметры, как в generate
+            
+        Yields:
+            Фрагменты ответа по мере генерации
+        """
+        deadline: Optional[Deadline] = kwargs.get('deadline')
+        timeout = deadline.clamp(self.timeout) if deadline else self.timeout
+        model = self.resolve_model(**kwargs)
+        params = self._build_payload(model, {"messages": messages}, stream=True, **kwargs)
+        
+        started_at = time.monotonic()
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            async with client.stream("POST", f"{self.base_url}/api/chat", json=params) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise Exception(f"Ошибка Ollama API: {response.status_code} - {response.text}")
+                async for line in response.aiter_lines():
+                    if deadline:
+                        deadline.check("ollama stream")
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    content = chunk.get("message", {}).get("content", "")
+                    if content:
+                        yield content
+                    if chunk.get("done"):
+                        # Финальный фрагмент содержит счетчики eval
+                        llm_metrics.record(LLMCallStats.from_ollama(
+                            chunk,
+                            template=kwargs.get('template', 'raw'),
+                            model=model,
+                            wall_seconds=time.monotonic() - started_at
+                        ))
+    
+    async def embed(self, texts: List[str], **kwargs) -> List[List[float]]:
+        """
+        Получить эмбеддинги через Ollama /api/embed
+        
+        Args:
+            texts: Тексты для векторизации (одним запросом)
+            **kwargs: Дополнительные параметры (model, deadline)
+            
+        Returns:
+            Векторы в порядке текстов (Ollama возвращает их нормированными)
+        """
+        model = kwargs.get('model') or self.embed_model
+        if not model:
+            raise ValueError("Модель эмбеддингов не настроена (OLLAMA_EMBED_MODEL)")
+        
+        deadline: Optional[Deadline] = kwargs.get('deadline')
+        timeout = deadline.clamp(self.timeout) if deadline else self.timeout
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            request = client.post(f"{self.base_url}/api/embed", json={"model": model, "input": texts})
+            response = await (deadline.run(request, "ollama embed") if deadline else request)
+        
+        if response.status_code != 200:
+            raise Exception(f"Ошибка Ollama API: {response.status_code} - {response.text}")
+        return response.json().get("embeddings", [])
+    
+    def _build_payload(self, model: str, payload: Dict[str, Any], stream: bool = False, **kwargs) -> Dict[str, Any]:
+        """Собрать тело запроса генерации"""
+        generation_params = {
+            "model": model,
+            **payload,
+            "stream": stream,
+            "options": self._build_options(**kwargs)
+        }
+        # JSON-режим: сервер ограничивает вывод валидным JSON
+        if kwargs.get('json_mode'):
+            generation_params["format"] = "json"
+        return generation_params
+    
+    def _build_options(self, **kwargs) -> Dict[str, Any]:
+        """Собрать options для Ollama из параметров маршрута и вызова"""
+        options = {
+            "temperature": kwargs.get('temperature', 0.7),
+            "top_p": kwargs.get('top_p', 0.9)
+        }
+        for option in ('num_ctx', 'num_predict'):
+            if kwargs.get(option):
+                options[option] = kwargs[option]
+        return options
+    
+    async def _request(self, endpoint: str, payload: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        """
+        Отправить запрос генерации в Ollama
+        
+        Args:
+            endpoint: /api/generate или /api/chat
+            payload: Тело запроса без model/options/stream
+            **kwargs: Параметры вызова (model, tier, deadline, options)
+            
+        Returns:
+            JSON-ответ Ollama
+        """
+        deadline: Optional[Deadline] = kwargs.get('deadline')
         try:
-            logger.info(f"Отправляем запрос в Ollama: {self.model}")
-            logger.info(f"Таймаут запроса: {self.timeout} секунд")
-            logger.debug(f"Промт (первые 100 символов): {prompt[:100]}...")
-            logger.debug(f"Полный промт: {prompt}")
+            timeout = deadline.clamp(self.timeout) if deadline else self.timeout
+            model = self.resolve_model(**kwargs)
+            logger.info(f"Отправляем запрос в Ollama: {model} (шаблон: {kwargs.get('template', '-')})")
+            logger.info(f"Таймаут запроса: {timeout:.1f} секунд")
             
             # Параметры генерации
-            generation_params = {
-                "model": self.model,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": kwargs.get('temperature', 0.7),
-                    "top_p": kwargs.get('top_p', 0.9)
-                }
-            }
+            generation_params = self._build_payload(model, payload, **kwargs)
             
-            logger.info(f"Параметры генерации: {generation_params}")
+            logger.info(f"Параметры генерации: {generation_params['options']}")
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                logger.info(f"Отправляем POST запрос на {self.base_url}/api/generate")
-                response = await client.post(
-                    f"{self.base_url}/api/generate",
+            started_at = time.monotonic()
+            async with httpx.AsyncClient(timeout=timeout) as client:
+                logger.info(f"Отправляем POST запрос на {self.base_url}{endpoint}")
+                request = client.post(
+                    f"{self.base_url}{endpoint}",
                     json=generation_params
                 )
+                # При истечении дедлайна запрос отменяется вместе с соединением
+                response = await (deadline.run(request, "ollama") if deadline else request)
                 
                 logger.info(f"Получен ответ от Ollama: {response.status_code}")
                 
                 if response.status_code == 200:
                     result = response.json()
-                    response_text = result.get("response", "").strip()
                     
-                    logger.info(f"Ollama ответ получен, длина: {len(response_text)} символов")
-                    logger.debug(f"Полный ответ: {response_text}")
-                    return response_text
+                    # Счетчики Ollama: токены и длительности prefill/decode/загрузки модели
+                    llm_metrics.record(LLMCallStats.from_ollama(
+                        result,
+                        template=kwargs.get('template', 'raw'),
+                        model=model,
+                        wall_seconds=time.monotonic() - started_at
+                    ))
+                    logger.debug(f"Полный ответ: {result}")
+                    return result
                 else:
                     error_msg = f"Ошибка Ollama API: {response.status_code} - {response.text}"
                     logger.error(error_msg)
                     raise Exception(error_msg)
                     
+        except DeadlineExceeded:
+            logger.warning(f"Запрос в Ollama отменен: истек дедлайн ({deadline})")
+            raise
         except Exception as e:
             logger.error(f"Ошибка при вызове Ollama API: {e}")
             logger.error(f"Детали ошибки: {type(e).__name__}: {str(e)}")
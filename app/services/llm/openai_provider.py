@@ -0,0 +1,267 @@
+"""
+OpenAI-совместимый LLM-провайдер (vLLM, llama.cpp server, LocalAI)
+"""
+
+import asyncio
+import json
+import logging
+import time
+import httpx
+from typing import AsyncIterator, Dict, Any, List, Optional
+from app.core.deadline import Deadline, DeadlineExceeded
+from .base import BaseLLMProvider
+from .metrics import LLMCallStats, llm_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class OpenAICompatibleProvider(BaseLLMProvider):
+    """Провайдер для серверов с OpenAI-совместимым API (/v1/chat/completions)"""
+
+    def __init__(self, config: Dict[str, Any], name: str = "openai"):
+        """
+        Инициализация OpenAI-совместимого провайдера
+
+        Args:
+            config: Конфигурация с ключами:
+                - base_url: URL API, включая /v1 (например, http://vllm:8000/v1)
+                - api_key: Ключ API (для локальных серверов обычно не нужен)
+                - model: Название основной модели
+                - fast_model: Модель для дешевых вызовов (классификации)
+                - timeout: Таймаут запросов
+                - max_concurrency: Максимум одновременных запросов
+            name: Название провайдера
+        """
+        super().__init__(name, config)
+
+        self.base_url = config.get('base_url', 'http://localhost:8000/v1').rstrip('/')
+        self.api_key = config.get('api_key')
+        self.max_concurrency = config.get('max_concurrency', 8)
+        self.verify_ssl = config.get('verify_ssl', True)
+
+        # Пул соединений переиспользуется между запросами (keep-alive)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        logger.info(f"OpenAI-совместимый провайдер настроен: {self.base_url}, модель: {self.model}, "
+                    f"параллельных запросов: {self.max_concurrency}")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Общий HTTP-клиент с пулом соединений"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                verify=self.verify_ssl,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                )
+            )
+        return self._client
+
+    async def _auth_headers(self) -> Dict[str, str]:
+        """Заголовки авторизации"""
+        if self.api_key:
+            return {"Authorization": f"Bearer {self.api_key}"}
+        return {}
+
+    async def _on_unauthorized(self) -> bool:
+        """
+        Реакция на 401 от сервера
+
+        Returns:
+            True, если авторизацию обновили и запрос стоит повторить
+        """
+        return False
+
+    async def generate(self, prompt: str, **kwargs) -> str:
+        """
+        Генерировать ответ на промт
+
+        Args:
+            prompt: Промт для генерации
+            **kwargs: Дополнительные параметры (model, tier, temperature, top_p,
+                num_predict, json_mode, deadline, etc.)
+
+        Returns:
+            Сгенерированный ответ
+        """
+        return await self.chat([{"role": "user", "content": prompt}], **kwargs)
+
+    async def chat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        """
+        Генерировать ответ через /chat/completions
+
+        Args:
+            messages: Сообщения в формате [{"role": ..., "content": ...}]
+            **kwargs: Дополнительные параметры, как в generate
+
+        Returns:
+            Текст ответа ассистента
+        """
+        deadline: Optional[Deadline] = kwargs.get('deadline')
+        model = self.resolve_model(**kwargs)
+        payload = self._build_payload(model, messages, stream=False, **kwargs)
+
+        try:
+            async with self._semaphore:
+                timeout = deadline.clamp(self.timeout) if deadline else self.timeout
+                logger.info(f"Отправляем запрос в {self.name}: {model} (шаблон: {kwargs.get('template', '-')})")
+
+                started_at = time.monotonic()
+                response = await self._post_completion(payload, timeout, deadline)
+                if response.status_code == 401 and await self._on_unauthorized():
+                    response = await self._post_completion(payload, timeout, deadline)
+
+                if response.status_code != 200:
+                    error_msg = f"Ошибка {self.name} API: {response.status_code} - {response.text}"
+                    logger.error(error_msg)
+                    raise Exception(error_msg)
+
+                result = response.json()
+                self._record_usage(result.get("usage") or {}, kwargs.get('template', 'raw'), model,
+                                   time.monotonic() - started_at)
+                return (result["choices"][0]["message"].get("content") or "").strip()
+
+        except DeadlineExceeded:
+            logger.warning(f"Запрос в {self.name} отменен: истек дедлайн ({deadline})")
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при вызове {self.name} API: {type(e).__name__}: {e}")
+            raise
+
+    async def _post_completion(self, payload: Dict[str, Any], timeout: float,
+                               deadline: Optional[Deadline]) -> httpx.Response:
+        """Отправить запрос /chat/completions с учетом дедлайна (включая получение авторизации)"""
+        async def post() -> httpx.Response:
+            return await self.client.post(
+                f"{self.base_url}/chat/completions",
+                json=payload,
+                headers=await self._auth_headers(),
+                timeout=timeout
+            )
+
+        return await (deadline.run(post(), self.name) if deadline else post())
+
+    async def _deadline_auth_headers(self, deadline: Optional[Deadline]) -> Dict[str, str]:
+        """Заголовки авторизации, получение которых ограничено дедлайном"""
+        headers = self._auth_headers()
+        return await (deadline.run(headers, f"{self.name} auth") if deadline else headers)
+
+    async def chat_stream(self, messages: List[Dict[str, str]], **kwargs) -> AsyncIterator[str]:
+        """
+        Потоковая генерация через /chat/completions (server-sent events)
+
+        Args:
+            messages: Сообщения в формате [{"role": ..., "content": ...}]
+            **kwargs: Дополнительные параметры, как в generate
+
+        Yields:
+            Фрагменты ответа по мере генерации
+        """
+        deadline: Optional[Deadline] = kwargs.get('deadline')
+        model = self.resolve_model(**kwargs)
+        payload = self._build_payload(model, messages, stream=True, **kwargs)
+
+        async with self._semaphore:
+            timeout = deadline.clamp(self.timeout) if deadline else self.timeout
+            started_at = time.monotonic()
+            usage: Dict[str, Any] = {}
+            async with self.client.stream(
+                "POST",
+                f"{self.base_url}/chat/completions",
+                json=payload,
+                headers=await self._deadline_auth_headers(deadline),
+                timeout=timeout
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise Exception(f"Ошибка {self.name} API: {response.status_code} - {response.text}")
+                async for line in response.aiter_lines():
+                    if deadline:
+                        deadline.check(f"{self.name} stream")
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    usage = chunk.get("usage") or usage
+                    for choice in chunk.get("choices", []):
+                        content = choice.get("delta", {}).get("content")
+                        if content:
+                            yield content
+            self._record_usage(usage, kwargs.get('template', 'raw'), model, time.monotonic() - started_at)
+
+    def _build_payload(self, model: str, messages: List[Dict[str, str]], stream: bool, **kwargs) -> Dict[str, Any]:
+        """Собрать тело запроса /chat/completions"""
+        payload: Dict[str, Any] = {
+            "model": model,
+            "messages": messages,
+            "stream": stream,
+            "temperature": kwargs.get('temperature', 0.7),
+            "top_p": kwargs.get('top_p', 0.9)
+        }
+        if kwargs.get('num_predict'):
+            payload["max_tokens"] = kwargs['num_predict']
+        if kwargs.get('json_mode'):
+            payload["response_format"] = {"type": "json_object"}
+        if stream:
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def _record_usage(self, usage: Dict[str, Any], template: str, model: str, wall_seconds: float):
+        """Учесть вызов в телеметрии (сервер отдает только количество токенов)"""
+        llm_metrics.record(LLMCallStats(
+            template=template,
+            model=model,
+            prompt_tokens=usage.get("prompt_tokens", 0) or 0,
+            completion_tokens=usage.get("completion_tokens", 0) or 0,
+            total_seconds=wall_seconds,
+            wall_seconds=wall_seconds
+        ))
+
+    def is_available(self) -> bool:
+        """
+        Проверить доступность провайдера
+
+        Returns:
+            True если задан URL сервера
+        """
+        return bool(self.base_url)
+
+    async def health_check(self) -> Dict[str, Any]:
+        """Проверка здоровья сервера по списку моделей"""
+        try:
+            response = await self.client.get(
+                f"{self.base_url}/models",
+                headers=await self._deadline_auth_headers(Deadline(10)),
+                timeout=10
+            )
+            if response.status_code == 200:
+                available_models = [model['id'] for model in response.json().get('data', [])]
+                return {
+                    "status": "healthy",
+                    "model": self.model,
+                    "model_available": self.model in available_models,
+                    "available_models": available_models,
+                    "base_url": self.base_url
+                }
+            return {
+                "status": "unhealthy",
+                "error": f"HTTP {response.status_code}",
+                "base_url": self.base_url
+            }
+        except Exception as e:
+            return {
+                "status": "unhealthy",
+                "error": str(e),
+                "base_url": self.base_url
+            }
+
+    async def close(self):
+        """Закрыть пул соединений"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
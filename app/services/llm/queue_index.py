@@ -0,0 +1,103 @@
+"""
+Векторный индекс очередей Tracker для семантического выбора очереди
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class QueueIndex:
+    """
+    Эмбеддинги названий и описаний очередей
+
+    Очереди загружаются из Tracker и векторизуются один раз; при обновлении
+    индекса пересчитываются только очереди с изменившимся текстом.
+    """
+
+    def __init__(self, embed: Callable[[List[str]], Awaitable[List[List[float]]]],
+                 load_queues: Callable[[], List[Dict[str, Any]]], refresh_interval: float = 3600):
+        """
+        Args:
+            embed: Асинхронная функция векторизации списка текстов
+            load_queues: Синхронная загрузка очередей (TrackerService.get_queues)
+            refresh_interval: Период обновления индекса в секундах
+        """
+        self._embed = embed
+        self._load_queues = load_queues
+        self.refresh_interval = refresh_interval
+        self._texts: Dict[str, str] = {}
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._built_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self) -> bool:
+        return self._built_at is not None and time.monotonic() - self._built_at < self.refresh_interval
+
+    async def ensure_built(self):
+        """Построить или обновить индекс, если он устарел"""
+        if self._is_fresh():
+            return
+        async with self._lock:
+            if self._is_fresh():
+                return
+            queues = await asyncio.to_thread(self._load_queues)
+            if not queues:
+                logger.warning("Список очередей пуст, индекс очередей не обновлен")
+                return
+
+            texts = {queue['key']: self._queue_text(queue) for queue in queues if queue.get('key')}
+            changed = [key for key, text in texts.items() if self._texts.get(key) != text]
+            if changed:
+                vectors = await self._embed([texts[key] for key in changed])
+                for key, vector in zip(changed, vectors):
+                    self._vectors[key] = self._normalize(vector)
+                    self._texts[key] = texts[key]
+            for key in set(self._vectors) - set(texts):
+                del self._vectors[key]
+                del self._texts[key]
+
+            self._built_at = time.monotonic()
+            logger.info(f"Индекс очередей обновлен: {len(self._vectors)} очередей, пересчитано {len(changed)}")
+
+    async def rank(self, text: str, candidates: List[str]) -> List[Tuple[str, float]]:
+        """
+        Упорядочить очереди по близости к тексту
+
+        Args:
+            text: Текст задачи
+            candidates: Ключи очередей, из которых выбираем
+
+        Returns:
+            Пары (ключ, косинусная близость) по убыванию близости; пустой
+            список, если часть очередей отсутствует в индексе
+        """
+        await self.ensure_built()
+        missing = [key for key in candidates if key not in self._vectors]
+        if not candidates or missing:
+            if missing:
+                logger.info(f"Очереди {missing} отсутствуют в индексе, выбор очереди остается за LLM")
+            return []
+
+        query = self._normalize((await self._embed([text]))[0])
+        scores = np.stack([self._vectors[key] for key in candidates]) @ query
+        return [(candidates[index], float(scores[index])) for index in np.argsort(-scores)]
+
+    @staticmethod
+    def _queue_text(queue: Dict[str, Any]) -> str:
+        """Текст очереди для векторизации"""
+        parts = [f"{queue['key']}: {queue.get('name') or ''}".strip()]
+        if queue.get('description'):
+            parts.append(str(queue['description']))
+        return ". ".join(parts)
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
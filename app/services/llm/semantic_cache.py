@@ -0,0 +1,140 @@
+"""
+Семантический кэш результатов LLM по эмбеддингам сообщений
+"""
+
+import copy
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Начальное число строк матрицы ключа: у большинства пользователей сообщений немного
+BUCKET_INITIAL_ROWS = 8
+
+
+class _VectorBucket:
+    """Кольцевой буфер векторов и результатов для одного ключа"""
+
+    def __init__(self, capacity: int, dim: int):
+        self.capacity = capacity
+        rows = min(BUCKET_INITIAL_ROWS, capacity)
+        self.vectors = np.zeros((rows, dim), dtype=np.float32)
+        self.created_at = np.full(rows, -np.inf)
+        self.values: List[Optional[Dict[str, Any]]] = []
+        self.next_index = 0
+        self.size = 0
+
+    def add(self, vector: np.ndarray, value: Dict[str, Any]):
+        """Добавить запись, вытесняя самую старую при переполнении"""
+        index = self.next_index
+        if self.size < self.capacity:
+            if self.size == len(self.vectors):
+                self._grow()
+            self.values.append(value)
+        else:
+            self.values[index] = value
+        self.vectors[index] = vector
+        self.created_at[index] = time.monotonic()
+        self.next_index = (index + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def _grow(self):
+        """Удвоить матрицу (не больше capacity строк)"""
+        rows = min(len(self.vectors) * 2, self.capacity)
+        vectors = np.zeros((rows, self.vectors.shape[1]), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        created_at = np.full(rows, -np.inf)
+        created_at[:self.size] = self.created_at[:self.size]
+        self.vectors, self.created_at = vectors, created_at
+
+
+class SemanticCache:
+    """
+    Кэш ответов LLM, найденных по косинусной близости сообщений
+
+    Для каждого ключа (пользователь и набор очередей) хранится матрица
+    последних векторов сообщений. Поиск - одно матричное умножение на
+    нормированный вектор запроса. Матрица растет по мере заполнения, а
+    число ключей ограничено: давно не использованные вытесняются.
+    """
+
+    def __init__(self, threshold: float = 0.92, ttl: float = 3600, capacity: int = 128, max_keys: int = 1024):
+        """
+        Args:
+            threshold: Минимальная косинусная близость для попадания в кэш
+            ttl: Время жизни записи в секундах
+            capacity: Максимум записей на ключ
+            max_keys: Максимум ключей (пользователь и набор очередей)
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets: 'OrderedDict[Hashable, _VectorBucket]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key: Hashable, vector: Sequence[float]) -> Optional[Dict[str, Any]]:
+        """
+        Найти результат для близкого сообщения
+
+        Args:
+            key: Ключ кэша
+            vector: Эмбеддинг нового сообщения
+
+        Returns:
+            Копия сохраненного результата или None
+        """
+        bucket = self._buckets.get(key)
+        query = self._normalize(vector)
+        if bucket is None or bucket.size == 0 or bucket.vectors.shape[1] != query.shape[0]:
+            self.misses += 1
+            return None
+
+        self._buckets.move_to_end(key)
+        similarities = bucket.vectors[:bucket.size] @ query
+        expired = bucket.created_at[:bucket.size] < time.monotonic() - self.ttl
+        similarities[expired] = -np.inf
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        logger.info(f"Семантический кэш: попадание (близость {similarities[best]:.3f})")
+        return copy.deepcopy(bucket.values[best])
+
+    def store(self, key: Hashable, vector: Sequence[float], value: Dict[str, Any]):
+        """Сохранить результат для сообщения"""
+        query = self._normalize(vector)
+        bucket = self._buckets.get(key)
+        if bucket is None or bucket.vectors.shape[1] != query.shape[0]:
+            bucket = self._buckets[key] = _VectorBucket(self.capacity, query.shape[0])
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        bucket.add(query, copy.deepcopy(value))
+
+    def clear(self):
+        """Очистить кэш"""
+        self._buckets.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий и размер кэша"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "keys": len(self._buckets),
+            "entries": sum(bucket.size for bucket in self._buckets.values())
+        }
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> np.ndarray:
+        """Привести вектор к единичной длине"""
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
@@ -0,0 +1,84 @@
+"""
+Хранилище состояния многошаговых диалогов с LLM
+"""
+
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ChatSession:
+    """История сообщений незавершенного диалога"""
+    session_id: str
+    template: str
+    messages: List[Dict[str, str]]
+    updated_at: float = field(default_factory=time.monotonic)
+
+
+class ChatSessionStore:
+    """
+    Сессии chat API по (session_id, шаблон) с вытеснением по TTL
+
+    История отправляется в Ollama целиком, но ее префикс совпадает с
+    предыдущим запросом, поэтому сервер заново обрабатывает только новое
+    сообщение пользователя.
+    """
+
+    def __init__(self, ttl: float = 600, max_turns: int = 6):
+        """
+        Args:
+            ttl: Время жизни неактивной сессии в секундах
+            max_turns: Максимум пар user/assistant после первого сообщения
+        """
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self._sessions: Dict[Tuple[str, str], ChatSession] = {}
+
+    def get(self, session_id: str, template: str) -> Optional[ChatSession]:
+        """Получить активную сессию или None"""
+        self._evict_expired()
+        return self._sessions.get((session_id, template))
+
+    def save(self, session_id: str, template: str, messages: List[Dict[str, str]]):
+        """Сохранить историю сессии, ограничив ее длину"""
+        self._evict_expired()
+        self._sessions[(session_id, template)] = ChatSession(
+            session_id=session_id,
+            template=template,
+            messages=self._trim(messages)
+        )
+
+    def drop(self, session_id: str):
+        """Завершить все сессии пользователя"""
+        for key in [key for key in self._sessions if key[0] == session_id]:
+            del self._sessions[key]
+
+    def has_session(self, session_id: str, template: Optional[str] = None) -> bool:
+        """Есть ли у пользователя активная сессия (для шаблона или любая)"""
+        self._evict_expired()
+        if template:
+            return (session_id, template) in self._sessions
+        return any(key[0] == session_id for key in self._sessions)
+
+    def _trim(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Оставить system и первое user-сообщение плюс последние max_turns обменов"""
+        head_size = 2 if messages and messages[0]["role"] == "system" else 1
+        head, tail = messages[:head_size], messages[head_size:]
+        # Хвост начинается с ответа ассистента, чтобы роли чередовались
+        limit = self.max_turns * 2 + 1
+        if len(tail) > limit:
+            tail = tail[-limit:]
+        return head + tail
+
+    def _evict_expired(self):
+        """Удалить сессии, неактивные дольше ttl"""
+        now = time.monotonic()
+        expired = [key for key, session in self._sessions.items() if now - session.updated_at > self.ttl]
+        for key in expired:
+            del self._sessions[key]
+        if expired:
+            logger.info(f"Вытеснено {len(expired)} LLM-сессий по TTL")
@@ -4,20 +4,60 @@
 
 import logging
 import json
-from typing import Dict, Any, List, Optional
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, Any, List, Optional, Tuple
 from app.config import settings
-from app.prompts import PromptLoader
+from app.core.deadline import Deadline, DeadlineExceeded
+from app.prompts import PromptLoader, estimate_tokens, fit_status_groups
 from app.services.llm.ollama_provider import OllamaProvider
+from app.services.llm.openai_provider import OpenAICompatibleProvider
+from app.services.llm.gigachat_provider import GigaChatProvider
+from app.services.llm.queue_index import QueueIndex
+from app.services.llm.semantic_cache import SemanticCache
+from app.services.llm.session_store import ChatSessionStore
 
 logger = logging.getLogger(__name__)
 
 
+# Маршрутизация шаблонов по моделям: дешевые классификации идут в быструю
+# модель (tier=fast), генерация текста - в основную (tier=strong).
+# num_ctx/num_predict/temperature передаются в options провайдера,
+# json_mode включает ограничение вывода валидным JSON.
+DEFAULT_MODEL_ROUTES: Dict[str, Dict[str, Any]] = {
+    'status_classification': {'tier': 'fast', 'num_ctx': 1024, 'num_predict': 8, 'temperature': 0.0},
+    'analyze_intent': {'tier': 'fast', 'num_ctx': 2048, 'num_predict': 384, 'temperature': 0.2, 'json_mode': True},
+    'free_conversation': {'tier': 'fast', 'num_ctx': 4096, 'num_predict': 384, 'temperature': 0.3, 'json_mode': True},
+    'changes_summary': {'tier': 'strong', 'num_ctx': 8192, 'num_predict': 512, 'temperature': 0.5},
+    'changes_delta': {'tier': 'strong', 'num_ctx': 4096, 'num_predict': 384, 'temperature': 0.5},
+    'digest_rollup': {'tier': 'strong', 'num_ctx': 4096, 'num_predict': 512, 'temperature': 0.5},
+    'combined_summary': {'tier': 'strong', 'num_ctx': 8192, 'num_predict': 512, 'temperature': 0.5},
+    'create_task': {'tier': 'strong', 'num_ctx': 4096, 'num_predict': 512, 'temperature': 0.3, 'json_mode': True},
+    'queue_summary': {'tier': 'strong', 'num_ctx': 4096, 'num_predict': 768, 'temperature': 0.5},
+}
+
+# Действия, результат которых зависит от данных конкретного сообщения -
+# их нельзя отдавать из семантического кэша для похожих сообщений
+NON_CACHEABLE_ACTIONS = {'create_task', 'set_schedule'}
+
+
 class LLMService:
     """Основной сервис для работы с LLM"""
     
     def __init__(self):
         """Инициализация LLM-сервиса"""
-        self.prompt_loader = PromptLoader()
+        self.prompt_loader = PromptLoader.shared()
+        self.model_routes = self._load_model_routes()
+        self.sessions = ChatSessionStore(
+            ttl=settings.LLM_SESSION_TTL_SECONDS,
+            max_turns=settings.LLM_SESSION_MAX_TURNS
+        )
+        self.semantic_cache = SemanticCache(
+            threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+            ttl=settings.SEMANTIC_CACHE_TTL_SECONDS,
+            capacity=settings.SEMANTIC_CACHE_SIZE,
+            max_keys=settings.SEMANTIC_CACHE_MAX_KEYS
+        ) if settings.OLLAMA_EMBED_MODEL else None
+        self.queue_index: Optional[QueueIndex] = None
         
         # Инициализируем провайдеры
         self.providers: Dict[str, Any] = {}
@@ -37,32 +77,270 @@ class LLMService:
         ollama_config = {
             'base_url': settings.OLLAMA_BASE_URL,
             'model': settings.OLLAMA_MODEL,
+            'fast_model': settings.OLLAMA_FAST_MODEL or settings.OLLAMA_MODEL,
+            'embed_model': settings.OLLAMA_EMBED_MODEL,
             'timeout': 300  # Увеличенный таймаут для стабильной работы
         }
-        self.providers['ollama'] = OllamaProvider(ollama_config)
+        try:
+            self.providers['ollama'] = OllamaProvider(ollama_config)
+        except Exception as e:
+            # Без Ollama можно работать, если активен другой провайдер
+            if settings.LLM_PROVIDER == 'ollama':
+                raise
+            logger.warning(f"Ollama недоступен, провайдер не зарегистрирован: {e}")
+        
+        # OpenAI-совместимый сервер (vLLM, llama.cpp server, LocalAI)
+        if settings.OPENAI_BASE_URL:
+            openai_config = {
+                'base_url': settings.OPENAI_BASE_URL,
+                'api_key': settings.OPENAI_API_KEY,
+                'model': settings.OPENAI_MODEL,
+                'fast_model': settings.OPENAI_FAST_MODEL or settings.OPENAI_MODEL,
+                'timeout': 300,
+                'max_concurrency': settings.OPENAI_MAX_CONCURRENCY
+            }
+            self.providers['openai'] = OpenAICompatibleProvider(openai_config)
+        
+        # Сбер GigaChat
+        if settings.GIGACHAT_API_KEY:
+            gigachat_config = {
+                'auth_url': settings.GIGACHAT_AUTH_URL,
+                'api_key': settings.GIGACHAT_API_KEY,
+                'scope': settings.GIGACHAT_SCOPE,
+                'base_url': settings.GIGACHAT_BASE_URL,
+                'model': settings.GIGACHAT_MODEL,
+                'fast_model': settings.GIGACHAT_FAST_MODEL or settings.GIGACHAT_MODEL,
+                'timeout': 300,
+                'max_concurrency': settings.GIGACHAT_MAX_CONCURRENCY,
+                'refresh_ahead': settings.GIGACHAT_TOKEN_REFRESH_AHEAD_SECONDS,
+                'verify_ssl': settings.GIGACHAT_VERIFY_SSL
+            }
+            self.providers['gigachat'] = GigaChatProvider(gigachat_config)
+    
+    def _load_model_routes(self) -> Dict[str, Dict[str, Any]]:
+        """Собрать таблицу маршрутизации: значения по умолчанию + LLM_MODEL_ROUTES из настроек"""
+        routes = {name: dict(route) for name, route in DEFAULT_MODEL_ROUTES.items()}
+        if settings.LLM_MODEL_ROUTES:
+            try:
+                overrides = json.loads(settings.LLM_MODEL_ROUTES)
+                for name, route in overrides.items():
+                    routes.setdefault(name, {}).update(route)
+            except (json.JSONDecodeError, AttributeError) as e:
+                logger.error(f"Некорректный LLM_MODEL_ROUTES, используем маршруты по умолчанию: {e}")
+        return routes
+    
+    def get_route(self, template: Optional[str]) -> Dict[str, Any]:
+        """
+        Получить модель и профиль генерации для шаблона
+        
+        Args:
+            template: Имя шаблона без расширения (например, 'status_classification')
+            
+        Returns:
+            Словарь с tier/model и параметрами генерации
+        """
+        if not template:
+            return {}
+        return dict(self.model_routes.get(template, {}))
+    
+    def get_prompt_budget(self, template: str) -> Optional[int]:
+        """
+        Бюджет промта шаблона в токенах: num_ctx - num_predict - резерв
         
-        # В будущем здесь можно добавить другие провайдеры
-        # self.providers['openai'] = OpenAIProvider(openai_config)
-        # self.providers['gigachat'] = GigaChatProvider(gigachat_config)
+        Returns:
+            Бюджет или None, если размер контекста для шаблона не задан
+        """
+        route = self.get_route(template)
+        if not route.get('num_ctx'):
+            return None
+        return route['num_ctx'] - route.get('num_predict', 0) - settings.PROMPT_TOKEN_RESERVE
     
-    async def generate(self, prompt: str, **kwargs) -> str:
+    async def generate(self, prompt: str, template: Optional[str] = None, **kwargs) -> str:
         """
         Генерировать ответ через активный провайдер
         
         Args:
             prompt: Промт для генерации
-            **kwargs: Дополнительные параметры
+            template: Имя шаблона для выбора модели и профиля генерации
+            **kwargs: Дополнительные параметры (перекрывают параметры маршрута)
+            
+        Returns:
+            Сгенерированный ответ
+        """
+        provider = self._get_active_provider()
+        return await provider.generate(prompt, **self._call_params(template, kwargs))
+    
+    async def chat(self, messages: List[Dict[str, str]], template: Optional[str] = None, **kwargs) -> str:
+        """
+        Генерировать ответ по сообщениям через chat API активного провайдера
+        
+        Args:
+            messages: Сообщения (статический system-промт + user-сообщения)
+            template: Имя шаблона для выбора модели и профиля генерации
+            **kwargs: Дополнительные параметры (перекрывают параметры маршрута)
             
         Returns:
             Сгенерированный ответ
         """
+        provider = self._get_active_provider()
+        return await provider.chat(messages, **self._call_params(template, kwargs))
+    
+    async def generate_batch(self, prompts: List[str], template: Optional[str] = None, **kwargs) -> List[str]:
+        """
+        Сгенерировать ответы на несколько промтов одним батчем запросов
+        
+        Args:
+            prompts: Список промтов
+            template: Имя шаблона для выбора модели и профиля генерации
+            **kwargs: Дополнительные параметры
+            
+        Returns:
+            Ответы в порядке промтов
+        """
+        provider = self._get_active_provider()
+        return await provider.generate_batch(prompts, **self._call_params(template, kwargs))
+    
+    async def chat_stream(self, messages: List[Dict[str, str]], template: Optional[str] = None, **kwargs) -> AsyncIterator[str]:
+        """Потоковая генерация по сообщениям через активный провайдер"""
+        provider = self._get_active_provider()
+        async for chunk in provider.chat_stream(messages, **self._call_params(template, kwargs)):
+            yield chunk
+    
+    async def embed(self, texts: List[str], **kwargs) -> List[List[float]]:
+        """
+        Получить эмбеддинги текстов
+        
+        Эмбеддинги всегда считает Ollama (OLLAMA_EMBED_MODEL), независимо от
+        активного провайдера генерации.
+        
+        Args:
+            texts: Тексты для векторизации
+            **kwargs: Дополнительные параметры (model, deadline)
+            
+        Returns:
+            Векторы в порядке текстов
+        """
+        provider = self.providers.get('ollama')
+        if not provider:
+            raise ValueError("Провайдер ollama для эмбеддингов не найден")
+        return await provider.embed(texts, **kwargs)
+    
+    def set_queue_source(self, load_queues: Callable[[], List[Dict[str, Any]]]):
+        """
+        Включить семантический выбор очереди
+        
+        Args:
+            load_queues: Загрузка очередей с названиями и описаниями (TrackerService.get_queues)
+        """
+        if not settings.OLLAMA_EMBED_MODEL:
+            logger.info("OLLAMA_EMBED_MODEL не задан, очереди выбирает LLM по полному списку")
+            return
+        self.queue_index = QueueIndex(self.embed, load_queues, refresh_interval=settings.QUEUE_INDEX_REFRESH_SECONDS)
+    
+    async def _select_queues(self, text: str, available_queues: List[str], session_id: Optional[str],
+                             template: str) -> Tuple[List[str], Optional[str]]:
+        """
+        Сузить список очередей для промта по близости к тексту задачи
+        
+        Args:
+            text: Текст пользователя
+            available_queues: Очереди пользователя
+            session_id: Идентификатор диалога
+            template: Шаблон диалога (в продолжении сессии список уже в истории)
+            
+        Returns:
+            Очереди для промта и очередь, выбранная без LLM (или None)
+        """
+        if not self.queue_index or not available_queues or (session_id and self.has_session(session_id, template)):
+            return available_queues, None
+        try:
+            ranking = await self.queue_index.rank(text, available_queues)
+        except Exception as e:
+            logger.warning(f"Не удалось ранжировать очереди, передаем в LLM полный список: {e}")
+            return available_queues, None
+        if not ranking:
+            return available_queues, None
+        
+        top_queue, top_score = ranking[0]
+        runner_up_score = ranking[1][1] if len(ranking) > 1 else -1.0
+        if top_score >= settings.QUEUE_MATCH_MIN_SCORE and top_score - runner_up_score >= settings.QUEUE_MATCH_MARGIN:
+            logger.info(f"Очередь {top_queue} выбрана по смыслу (близость {top_score:.2f}, отрыв {top_score - runner_up_score:.2f})")
+            return [], top_queue
+        
+        candidates = [queue for queue, _ in ranking[:settings.QUEUE_CANDIDATES_TOP_K]]
+        logger.info(f"Кандидаты очередей для LLM: {candidates} из {len(available_queues)}")
+        return candidates, None
+    
+    async def _resolve_queue(self, text: str, llm_queue: Optional[str], chosen_queue: Optional[str],
+                             available_queues: List[str]) -> Optional[str]:
+        """Итоговая очередь задачи: выбранная по смыслу, иначе ответ LLM, иначе ближайшая к тексту"""
+        if chosen_queue:
+            return chosen_queue
+        if llm_queue in available_queues or not self.queue_index or not available_queues:
+            return llm_queue
+        # Уточнение в сессии без списка очередей - берем ближайшую к тексту
+        try:
+            ranking = await self.queue_index.rank(text, available_queues)
+        except Exception as e:
+            logger.warning(f"Не удалось ранжировать очереди: {e}")
+            return llm_queue
+        return ranking[0][0] if ranking else llm_queue
+    
+    async def _chat_in_session(self, template_name: str, session_id: Optional[str], followup_text: str, **kwargs) -> str:
+        """
+        Сгенерировать ответ с учетом сессии диалога
+        
+        Если для session_id есть незавершенная сессия по этому шаблону, к ее
+        истории добавляется только новый текст пользователя - остальная часть
+        запроса совпадает с прошлым и берется из KV-кэша сервера.
+        
+        Args:
+            template_name: Имя шаблона (например, 'create_task.md')
+            session_id: Идентификатор диалога или None (без сессии)
+            followup_text: Новый текст пользователя (для продолжения сессии)
+            **kwargs: Переменные шаблона для первого сообщения
+            
+        Returns:
+            Ответ модели
+        """
+        template = Path(template_name).stem
+        session = self.sessions.get(session_id, template) if session_id else None
+        if session:
+            logger.info(f"Продолжаем LLM-сессию {session_id} ({template}), сообщений: {len(session.messages)}")
+            messages = session.messages + [{"role": "user", "content": followup_text}]
+        else:
+            messages = self.prompt_loader.load_chat_prompt(template_name, **kwargs)
+        
+        response = await self.chat(messages, template=template)
+        
+        if session_id:
+            self.sessions.save(session_id, template, messages + [{"role": "assistant", "content": response}])
+        return response
+    
+    def end_session(self, session_id: str):
+        """Завершить диалоговые сессии пользователя"""
+        self.sessions.drop(session_id)
+    
+    def has_session(self, session_id: str, template: Optional[str] = None) -> bool:
+        """Есть ли у пользователя незавершенный диалог с LLM"""
+        return self.sessions.has_session(session_id, template)
+    
+    def _get_active_provider(self):
+        """Получить активный провайдер"""
         provider = self.providers.get(self.active_provider)
         if not provider:
             raise ValueError(f"Провайдер {self.active_provider} не найден")
-        
-        return await provider.generate(prompt, **kwargs)
+        return provider
     
-    async def create_task(self, user_text: str, available_queues: List[str], available_priorities: List[str]) -> Dict[str, Any]:
+    def _call_params(self, template: Optional[str], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Параметры вызова провайдера: маршрут шаблона + явные параметры"""
+        params = {**self.get_route(template), **kwargs}
+        if template:
+            params['template'] = template
+        return params
+    
+    async def create_task(self, user_text: str, available_queues: List[str], available_priorities: List[str],
+                          session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Создать задачу на основе текста пользователя
         
@@ -70,6 +348,7 @@ class LLMService:
             user_text: Текст пользователя
             available_queues: Список доступных очередей
             available_priorities: Список доступных приоритетов
+            session_id: Идентификатор диалога (chat_id) для продолжения сессии
             
         Returns:
             Словарь с данными задачи
@@ -77,25 +356,29 @@ class LLMService:
         available_queues = available_queues or []
         available_priorities = available_priorities or ["Низкий", "Средний", "Высокий"]
         try:
-            # Загружаем промт для создания задачи
-            prompt = self.prompt_loader.load_prompt(
+            prompt_queues, chosen_queue = await self._select_queues(user_text, available_queues, session_id, 'create_task')
+            
+            # Продолжаем диалог или загружаем промт для создания задачи
+            response = await self._chat_in_session(
                 'create_task.md',
+                session_id,
+                user_text,
                 user_text=user_text,
-                available_queues=available_queues,
+                available_queues=prompt_queues,
                 available_priorities=available_priorities
             )
             
-            # Генерируем ответ
-            response = await self.generate(prompt)
-            
             # Парсим JSON из ответа
-            return self._parse_json_response(response)
+            task = self._parse_json_response(response)
+            task['queue'] = await self._resolve_queue(user_text, task.get('queue'), chosen_queue, available_queues)
+            return task
                 
         except Exception as e:
             logger.error(f"Ошибка при создании задачи: {e}")
             return self._create_fallback_task(user_text, available_queues, available_priorities)
     
-    async def analyze_intent(self, user_text: str, available_queues: List[str], available_priorities: List[str]) -> Dict[str, Any]:
+    async def analyze_intent(self, user_text: str, available_queues: List[str], available_priorities: List[str],
+                             session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Анализировать намерение пользователя
         
@@ -103,6 +386,7 @@ class LLMService:
             user_text: Текст пользователя
             available_queues: Список доступных очередей
             available_priorities: Список доступных приоритетов
+            session_id: Идентификатор диалога (chat_id) для продолжения сессии
             
         Returns:
             Словарь с результатом анализа
@@ -110,19 +394,26 @@ class LLMService:
         available_queues = available_queues or []
         available_priorities = available_priorities or ["Низкий", "Средний", "Высокий"]
         try:
-            # Загружаем промт для анализа намерений
-            prompt = self.prompt_loader.load_prompt(
+            prompt_queues, chosen_queue = await self._select_queues(user_text, available_queues, session_id, 'analyze_intent')
+            
+            # Продолжаем диалог или загружаем промт для анализа намерений
+            response = await self._chat_in_session(
                 'analyze_intent.md',
+                session_id,
+                user_text,
                 user_text=user_text,
-                available_queues=available_queues,
+                available_queues=prompt_queues,
                 available_priorities=available_priorities
             )
             
-            # Генерируем ответ
-            response = await self.generate(prompt)
-            
             # Парсим JSON из ответа
-            return self._parse_json_response(response)
+            analysis = self._parse_json_response(response)
+            if analysis.get('wants_to_create_task'):
+                extracted_data = analysis.setdefault('extracted_data', {})
+                extracted_data['queue'] = await self._resolve_queue(
+                    user_text, extracted_data.get('queue'), chosen_queue, available_queues
+                )
+            return analysis
             
         except Exception as e:
             logger.error(f"Ошибка при анализе намерений: {e}")
@@ -152,41 +443,137 @@ class LLMService:
             )
             
             # Генерируем дайджест
-            return await self.generate(prompt)
+            return await self.generate(prompt, template='queue_summary')
                     
         except Exception as e:
             logger.error(f"Ошибка при создании дайджеста: {e}")
             return self._create_fallback_summary(queue_data)
     
-    async def create_changes_summary(self, queue_data: Dict[str, Any]) -> str:
+    async def create_changes_summary(self, queue_data: Dict[str, Any], deadline: Optional[Deadline] = None) -> str:
         """
         Создать резюме изменений относительно последнего дайджеста
         
         Args:
             queue_data: Данные очереди с изменениями
+            deadline: Дедлайн генерации (при истечении бросается DeadlineExceeded)
             
         Returns:
             Текст резюме изменений
         """
         try:
+            template_vars = {
+                'queue_key': queue_data.get('queue_key', 'Неизвестная очередь'),
+                'total_issues': queue_data.get('total_issues', 0),
+                'omitted_count': queue_data.get('omitted_count', 0),
+                'last_digest_time': queue_data.get('last_digest_time'),
+                'current_time': queue_data.get('current_time')
+            }
+            status_groups = queue_data.get('status_groups', {})
+            omitted: Dict[str, int] = {}
+            
+            # Ужимаем список задач, чтобы промт поместился в контекст модели
+            budget = self.get_prompt_budget('changes_summary')
+            if budget:
+                base_tokens = estimate_tokens(self.prompt_loader.load_prompt('changes_summary.md', status_groups={}, **template_vars))
+                report = fit_status_groups(status_groups, budget, base_tokens)
+                if report.truncated:
+                    logger.warning(
+                        f"Промт changes_summary для {template_vars['queue_key']} ужат до ~{report.estimated_tokens} "
+                        f"из {report.budget_tokens} токенов: сокращено названий {report.compacted}, "
+                        f"не показано задач {report.omitted_total} {report.omitted}"
+                    )
+                status_groups, omitted = report.status_groups, report.omitted
+            
             # Загружаем промт для анализа изменений
             prompt = self.prompt_loader.load_prompt(
                 'changes_summary.md',
-                queue_key=queue_data.get('queue_key', 'Неизвестная очередь'),
-                total_issues=queue_data.get('total_issues', 0),
-                status_groups=queue_data.get('status_groups', {}),
-                last_digest_time=queue_data.get('last_digest_time'),
-                current_time=queue_data.get('current_time')
+                status_groups=status_groups,
+                omitted=omitted,
+                **template_vars
             )
             
             # Генерируем резюме
-            return await self.generate(prompt)
+            return await self.generate(prompt, template='changes_summary', deadline=deadline)
                     
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Ошибка при создании резюме изменений: {e}")
             return "Обнаружены изменения в задачах."
 
-    async def analyze_free_conversation(self, user_message: str, available_queues: List[str], available_priorities: List[str], user_context: str = "") -> Dict[str, Any]:
+    async def create_delta_summary(self, delta_data: Dict[str, Any], deadline: Optional[Deadline] = None) -> str:
+        """
+        Создать резюме по списку изменений (новые, смены статуса, переназначения, закрытия)
+        
+        Args:
+            delta_data: Изменения очереди (поля DigestDiff) и время дайджестов
+            deadline: Дедлайн генерации (при истечении бросается DeadlineExceeded)
+            
+        Returns:
+            Текст резюме изменений
+        """
+        try:
+            prompt = self.prompt_loader.load_prompt('changes_delta.md', **delta_data)
+            
+            # Изменений слишком много для контекста - резюмируем затронутые задачи по статусам
+            budget = self.get_prompt_budget('changes_delta')
+            if budget and estimate_tokens(prompt) > budget and delta_data.get('status_groups'):
+                logger.warning(f"Промт changes_delta для {delta_data.get('queue_key')} не помещается в {budget} токенов, "
+                               f"используем changes_summary с ужатием")
+                return await self.create_changes_summary(delta_data, deadline=deadline)
+            
+            return await self.generate(prompt, template='changes_delta', deadline=deadline)
+        
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при создании резюме по изменениям: {e}")
+            return "Обнаружены изменения в задачах."
+    
+    async def create_combined_summary(self, combined_data: Dict[str, Any], deadline: Optional[Deadline] = None) -> str:
+        """
+        Создать одно резюме изменений по нескольким очередям
+        
+        Args:
+            combined_data: Очереди (queues) с итогами и самыми значимыми изменениями, текущее время
+            deadline: Дедлайн генерации (при истечении бросается DeadlineExceeded)
+            
+        Returns:
+            Текст резюме (пустая строка при ошибке)
+        """
+        try:
+            prompt = self.prompt_loader.load_prompt('combined_summary.md', **combined_data)
+            return await self.generate(prompt, template='combined_summary', deadline=deadline)
+        
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при создании общего резюме по очередям: {e}")
+            return ""
+    
+    async def create_rollup_summary(self, rollup_data: Dict[str, Any], deadline: Optional[Deadline] = None) -> str:
+        """
+        Создать сводку за неделю или месяц из готовых резюме более коротких периодов
+        
+        Args:
+            rollup_data: Очередь, период, итоговые цифры и резюме периодов (entries)
+            deadline: Дедлайн генерации (при истечении бросается DeadlineExceeded)
+            
+        Returns:
+            Текст сводки
+        """
+        try:
+            prompt = self.prompt_loader.load_prompt('digest_rollup.md', **rollup_data)
+            return await self.generate(prompt, template='digest_rollup', deadline=deadline)
+        
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при создании сводки за период: {e}")
+            return ""
+    
+    async def analyze_free_conversation(self, user_message: str, available_queues: List[str], available_priorities: List[str], user_context: str = "",
+                                        session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Анализировать свободное сообщение пользователя и определять намерения
         
@@ -195,6 +582,7 @@ class LLMService:
             available_queues: Список доступных очередей
             available_priorities: Список доступных приоритетов
             user_context: Контекст пользователя (предыдущие сообщения, настройки)
+            session_id: Идентификатор диалога (chat_id) для продолжения сессии
             
         Returns:
             Словарь с анализом намерений и данными для действий
@@ -202,25 +590,51 @@ class LLMService:
         available_queues = available_queues or []
         available_priorities = available_priorities or ["Низкий", "Средний", "Высокий", "Критический"]
         try:
-            # Загружаем промт для свободного общения
-            prompt = self.prompt_loader.load_prompt(
+            # Похожее сообщение вне диалога уже разбиралось - отвечаем из кэша
+            cache_key = (session_id, tuple(sorted(available_queues)))
+            vector = None
+            if self.semantic_cache is not None and not (session_id and self.has_session(session_id, 'free_conversation')):
+                vector = await self._embed_for_cache(user_message)
+                cached = self.semantic_cache.lookup(cache_key, vector) if vector is not None else None
+                if cached is not None:
+                    return cached
+            
+            # Продолжаем диалог или загружаем промт для свободного общения
+            response = await self._chat_in_session(
                 'free_conversation.md',
+                session_id,
+                user_message,
                 user_message=user_message,
                 available_queues=available_queues,
                 available_priorities=available_priorities,
                 user_context=user_context
             )
             
-            # Генерируем ответ
-            response = await self.generate(prompt)
-            
             # Парсим JSON из ответа
-            return self._parse_json_response(response)
+            analysis = self._parse_json_response(response)
+            if vector is not None and self._is_cacheable_analysis(analysis):
+                self.semantic_cache.store(cache_key, vector, analysis)
+            return analysis
             
         except Exception as e:
             logger.error(f"Ошибка при анализе свободного общения: {e}")
-            return self._create_fallback_conversation_analysis(user_message, available_queues, available_priorities)
+            return {**self._create_fallback_conversation_analysis(user_message, available_queues, available_priorities),
+                    "fallback": True}
 
+    async def _embed_for_cache(self, text: str) -> Optional[List[float]]:
+        """Эмбеддинг сообщения для семантического кэша (None при ошибке)"""
+        try:
+            vectors = await self.embed([text])
+            return vectors[0] if vectors else None
+        except Exception as e:
+            logger.warning(f"Не удалось получить эмбеддинг, семантический кэш пропущен: {e}")
+            return None
+    
+    def _is_cacheable_analysis(self, analysis: Dict[str, Any]) -> bool:
+        """Можно ли отдавать результат анализа для похожих сообщений"""
+        data = analysis.get('data') or {}
+        return analysis.get('action') not in NON_CACHEABLE_ACTIONS and not data.get('queue_key')
+    
     def _parse_json_response(self, response: str) -> Dict[str, Any]:
         """
         Парсить JSON из ответа LLM
@@ -269,7 +683,8 @@ class LLMService:
             "extracted_data": {},
             "missing_data": [],
             "confidence": 0.5,
-            "reasoning": "Fallback анализ"
+            "reasoning": "Fallback анализ",
+            "fallback": True
         }
     
     def _create_fallback_summary(self, queue_data: Dict[str, Any]) -> str:
@@ -331,7 +746,9 @@ class LLMService:
         """Получить информацию о провайдерах"""
         return {
             "active_provider": self.active_provider,
-            "providers": {name: provider.get_info() for name, provider in self.providers.items()}
+            "providers": {name: provider.get_info() for name, provider in self.providers.items()},
+            "model_routes": self.model_routes,
+            "semantic_cache": self.semantic_cache.stats() if self.semantic_cache else None
         }
     
     async def health_check(self) -> Dict[str, Any]:
@@ -355,12 +772,16 @@ class LLMService:
         
         return health_status
     
-    async def classify_status(self, original_status: str) -> str:
+    async def classify_status(self, original_status: str, deadline: Optional[Deadline] = None,
+                              fallback: bool = True) -> Optional[str]:
         """
         Классифицировать статус задачи через LLM
         
         Args:
             original_status: Исходный статус из Yandex Tracker
+            deadline: Дедлайн классификации (при истечении бросается DeadlineExceeded)
+            fallback: При ошибке LLM или непонятном ответе классифицировать по словарю;
+                      если False - вернуть None (такой результат нельзя кэшировать)
             
         Returns:
             Стандартизированный статус: To Do, In Progress, Blocked, Done
@@ -373,7 +794,7 @@ class LLMService:
             )
             
             # Генерируем классификацию
-            response = await self.generate(prompt)
+            response = await self.generate(prompt, template='status_classification', deadline=deadline)
             
             # Очищаем ответ от лишних символов
             clean_response = response.strip().lower()
@@ -388,11 +809,18 @@ class LLMService:
             elif 'done' in clean_response or 'complete' in clean_response or 'finished' in clean_response:
                 return 'Done'
             else:
+                if not fallback:
+                    logger.warning(f"LLM вернул неожиданный статус: '{response}'")
+                    return None
                 logger.warning(f"LLM вернул неожиданный статус: '{response}', используем 'To Do'")
                 return 'To Do'
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Ошибка при классификации статуса '{original_status}': {e}")
+            if not fallback:
+                return None
             # Fallback на старую логику
             return self._fallback_classify_status(original_status)
     
@@ -2,6 +2,7 @@ import logging
 from typing import List, Dict, Optional, Any
 from yandex_tracker_client import TrackerClient
 from app.config import settings
+from app.core.deadline import Deadline
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -53,8 +54,9 @@ class TrackerService:
             logger.error(f"Ошибка при получении очередей: {e}")
             return []
 
-    def get_queue_issues(self, queue_key: str, filter_query: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Получить задачи из очереди"""
+    def get_queue_issues(self, queue_key: str, filter_query: Optional[str] = None,
+                         deadline: Optional[Deadline] = None) -> List[Dict[str, Any]]:
+        """Получить задачи из очереди (при истечении дедлайна возвращаются уже полученные)"""
         try:
             # Формируем фильтр для получения задач из конкретной очереди
             # Используем правильный синтаксис запроса Yandex Tracker
@@ -67,6 +69,10 @@ class TrackerService:
             
             result = []
             for issue in issues:
+                # Страницы подгружаются лениво - прекращаем обход, если бюджет исчерпан
+                if deadline and deadline.expired:
+                    logger.warning(f"Истек дедлайн при получении задач из {queue_key}, получено {len(result)}")
+                    break
                 try:
                     # Безопасное получение атрибутов с fallback значениями
                     issue_data = {
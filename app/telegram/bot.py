@@ -6,7 +6,12 @@ from app.config import settings
 from app.services.tracker_service import TrackerService
 from app.services.llm_service import LLMService
 from app.services.command_analyzer import CommandAnalyzer
+from app.services.llm.issue_index import IssueIndex
+from app.core.deadline import Deadline
 from app.core.digest_service import DigestService
+from app.core.digest_orchestrator import DigestJob, DigestOrchestrator
+from app.core.digest_renderer import iter_message_chunks
+from app.core.digest_rollup import DigestRollupService
 from app.models.database import get_db
 from app.models.user import User
 from app.models.queue import Queue
@@ -16,6 +21,9 @@ logger = logging.getLogger(__name__)
 
 logger.info("=== TELEGRAM BOT MODULE LOADED ===")
 
+# Аргументы /rollup -> период сводки
+ROLLUP_PERIOD_ARGS = {'week': 'week', 'неделя': 'week', 'month': 'month', 'месяц': 'month'}
+
 
 class TelegramBot:
     def __init__(self):
@@ -30,7 +38,7 @@ class TelegramBot:
             logger.error("❌ TELEGRAM_BOT_TOKEN не настроен! Установите DEMO_MODE=true или настройте реальный токен")
             raise ValueError("TELEGRAM_BOT_TOKEN не настроен")
             
-        self.application = Application.builder().token(settings.TELEGRAM_BOT_TOKEN).build()
+        self.application = Application.builder().token(settings.TELEGRAM_BOT_TOKEN).post_init(self._warm_issue_index).build()
         logger.info("=== APPLICATION BUILT ===")
         
         # Инициализируем сервисы
@@ -40,8 +48,19 @@ class TelegramBot:
             cloud_org_id=settings.YANDEX_CLOUD_ORG_ID
         )
         self.llm_service = LLMService()
+        # Эмбеддинги очередей для выбора очереди по смыслу текста задачи
+        self.llm_service.set_queue_source(self.tracker_service.get_queues)
         self.command_analyzer = CommandAnalyzer(self.llm_service)
+        # Индекс названий задач для предупреждения о дубликатах
+        self.issue_index = IssueIndex(
+            settings.ISSUE_INDEX_DIR,
+            self.llm_service.embed,
+            self.tracker_service.get_queue_issues,
+            refresh_interval=settings.ISSUE_INDEX_REFRESH_SECONDS
+        ) if settings.OLLAMA_EMBED_MODEL else None
         self.digest_service = DigestService(self.tracker_service, self.llm_service)
+        self.digest_orchestrator = DigestOrchestrator(self.digest_service, settings.DIGEST_MAX_PARALLEL)
+        self.digest_rollup = DigestRollupService(self.llm_service)
         self.demo_mode = False
         
         # Регистрируем обработчики
@@ -73,6 +92,9 @@ class TelegramBot:
         self.application.add_handler(CommandHandler("send_now", self.send_now_command))
         logger.info("Registered: send_now_command")
         
+        self.application.add_handler(CommandHandler("rollup", self.rollup_command))
+        logger.info("Registered: rollup_command")
+        
 
         
 
@@ -120,6 +142,9 @@ class TelegramBot:
                     "/add_queue <ключ> - добавить очередь для отслеживания\n"
                     "/list_queues - показать ваши очереди\n"
                     "/send_now - получить дайджест сейчас\n"
+                    "/send_now fast - быстрый дайджест без AI-резюме\n"
+                    "/send_now combined - один дайджест по всем очередям\n"
+                    "/rollup [week|month] - сводка за неделю или месяц\n"
                     "/help - показать справку\n\n"
                     "Используйте /help для получения подробной информации."
                 )
@@ -180,6 +205,10 @@ class TelegramBot:
             db.add(queue)
             db.commit()
             
+            # Индекс для поиска дубликатов строится заранее, не при первой задаче
+            if self.issue_index:
+                self.issue_index.warm(queue_key)
+            
             await update.message.reply_text(f"✅ Очередь {queue_key} успешно добавлена!")
             
         except Exception as e:
@@ -242,33 +271,51 @@ class TelegramBot:
             # Отправляем сообщение о начале обработки
             processing_msg = await update.message.reply_text("📊 Подготавливаю дайджест...")
             
-            # Функция для обновления статуса
-            async def update_status(status: str):
-                await processing_msg.edit_text(status)
-            
-            # Генерируем дайджесты для всех очередей
-            all_digests = []
-            for queue in user_queues:
-                try:
-                    digest = await self.digest_service.generate_digest(
-                        user.id, 
-                        queue.queue_key, 
-                        since_hours=24,
-                        status_callback=update_status
-                    )
-                    if digest:
-                        all_digests.append(digest)
-                except Exception as e:
-                    logger.error(f"Ошибка при генерации дайджеста для очереди {queue.queue_key}: {e}")
-                    all_digests.append(f"❌ Ошибка при генерации дайджеста для очереди {queue.queue_key}")
-            
-            # Отправляем все дайджесты
-            if all_digests:
-                for digest in all_digests:
-                    await update.message.reply_text(digest, parse_mode='HTML')
+            # /send_now fast - дайджест без LLM (список изменений и статистика),
+            # /send_now combined - один дайджест и одно резюме по всем очередям
+            args = {arg.lower() for arg in context.args or []}
+            fast = bool(args & {"fast", "быстро"})
+            combined = settings.DIGEST_COMBINED or bool(args & {"combined", "вместе"})
+            
+            # Общий бюджет времени на все очереди пользователя
+            deadline = Deadline(settings.DIGEST_DEADLINE_SECONDS)
+            if combined and len(user_queues) > 1:
+                queue_keys = [queue.queue_key for queue in user_queues]
+                jobs = [DigestJob(user.id, chat_id, ", ".join(queue_keys), deadline=deadline, fast=fast,
+                                  queue_keys=queue_keys)]
+            else:
+                jobs = [
+                    DigestJob(user.id, chat_id, queue.queue_key, deadline=deadline, two_phase=settings.DIGEST_TWO_PHASE,
+                              fast=fast)
+                    for queue in user_queues
+                ]
+            
+            # Очереди обрабатываются параллельно, каждый дайджест отправляется сразу после готовности
+            sent = 0
+            enrichments = []
+            async for result in self.digest_orchestrator.run(jobs):
+                digest = result.text
+                if result.error is not None:
+                    digest = f"❌ Ошибка при генерации дайджеста для очереди {result.job.queue_key}"
+                if not digest:
+                    continue
+                messages = await self._send_digest_chunks(update.message, digest)
+                if result.finalize:
+                    # Резюме LLM допишем в уже отправленные сообщения, когда оно будет готово
+                    enrichments.append(asyncio.create_task(
+                        self._enrich_digest_message(update.message, messages, digest, result.finalize)
+                    ))
+                sent += 1
+                if sent < len(jobs):
+                    await processing_msg.edit_text(f"📊 Готово {sent} из {len(jobs)} очередей...")
+            
+            if sent:
                 await processing_msg.delete()  # Удаляем сообщение о статусе
             else:
                 await processing_msg.edit_text("❌ Не удалось сгенерировать дайджесты.")
+            
+            if enrichments:
+                await asyncio.gather(*enrichments)
                 
         except Exception as e:
             logger.error(f"Ошибка в send_now_command: {e}")
@@ -276,6 +323,50 @@ class TelegramBot:
 
 
 
+    async def rollup_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /rollup [week|month] [очередь]"""
+        chat_id = str(update.effective_chat.id)
+        
+        try:
+            db = next(get_db())
+            user = db.query(User).filter(User.chat_id == chat_id).first()
+            
+            if not user:
+                await update.message.reply_text("❌ Сначала зарегистрируйтесь с помощью /start")
+                return
+            
+            period = 'week'
+            queue_keys = []
+            for arg in context.args or []:
+                if arg.lower() in ROLLUP_PERIOD_ARGS:
+                    period = ROLLUP_PERIOD_ARGS[arg.lower()]
+                else:
+                    queue_keys.append(arg.upper())
+            if not queue_keys:
+                queue_keys = [queue.queue_key for queue in db.query(Queue).filter(Queue.user_id == user.id).all()]
+            if not queue_keys:
+                await update.message.reply_text(
+                    "❌ У вас нет добавленных очередей.\n"
+                    "Сначала добавьте очереди с помощью /add_queue <ключ>"
+                )
+                return
+            
+            processing_msg = await update.message.reply_text("📆 Собираю сводку...")
+            
+            # Сводки собираются из журнала дайджестов, без обращений к Tracker
+            deadline = Deadline(settings.DIGEST_DEADLINE_SECONDS)
+            rollups = await asyncio.gather(*(
+                self.digest_rollup.generate_rollup(user.id, queue_key, period, deadline=deadline)
+                for queue_key in queue_keys
+            ))
+            for text in rollups:
+                await self._send_digest_chunks(update.message, text)
+            await processing_msg.delete()
+                
+        except Exception as e:
+            logger.error(f"Ошибка в rollup_command: {e}")
+            await update.message.reply_text("❌ Произошла ошибка при формировании сводки.")
+
     async def handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик текстовых сообщений"""
         chat_id = str(update.effective_chat.id)
@@ -304,10 +395,11 @@ class TelegramBot:
             available_priorities = [p['display'] for p in priorities] if priorities else ["Низкий", "Средний", "Высокий", "Критический"]
             
             # Анализируем свободное сообщение пользователя
-            analysis = await self.llm_service.analyze_free_conversation(
-                user_message=text,
-                available_queues=available_queues,
-                available_priorities=available_priorities,
+            analysis = await self.command_analyzer.analyze_conversation(
+                text,
+                chat_id,
+                available_queues,
+                available_priorities,
                 user_context=f"Пользователь: {user.chat_id}, Очереди: {available_queues}"
             )
             
@@ -322,15 +414,21 @@ class TelegramBot:
             # Отправляем начальный ответ
             await update.message.reply_text(response)
             
+            # Диалог с LLM продолжаем только пока задаче не хватает описания
+            task_data = data.get('task_data') or {}
+            needs_details = action == 'create_task' and not (task_data.get('summary') and task_data.get('description'))
+            if not needs_details:
+                self.llm_service.end_session(chat_id)
+            
             # Выполняем действие на основе анализа
             if action == 'create_task':
                 task_data = data.get('task_data', {})
                 if task_data.get('summary') and task_data.get('description'):
                     # Создаем задачу
-                    await self._create_task_from_analysis(update, task_data, data.get('queue_key'))
+                    await self._create_task_from_analysis(update, task_data, data.get('queue_key'), context)
                 else:
                     # Запрашиваем дополнительную информацию
-            await update.message.reply_text(
+                    await update.message.reply_text(
                         "📝 Пожалуйста, опишите задачу подробнее:\n"
                         "• Что нужно сделать?\n"
                         "• Какие требования?\n"
@@ -368,9 +466,26 @@ class TelegramBot:
             logger.error(f"Ошибка в handle_text: {e}")
             await update.message.reply_text("❌ Произошла ошибка при обработке сообщения. Попробуйте позже.")
 
-    async def _create_task_from_analysis(self, update: Update, task_data: Dict[str, Any], queue_key: str):
+    async def _create_task_from_analysis(self, update: Update, task_data: Dict[str, Any], queue_key: str,
+                                         context: ContextTypes.DEFAULT_TYPE = None, check_duplicates: bool = True):
         """Создать задачу на основе анализа"""
         try:
+            # Похожие задачи уже есть - просим подтверждения
+            if check_duplicates and context is not None:
+                duplicates = await self._find_duplicates(queue_key, task_data)
+                if duplicates:
+                    context.user_data['pending_task'] = {'task_data': task_data, 'queue_key': queue_key}
+                    lines = [f"• {item['key']}: {item['summary']} ({item['score']:.0%})" for item in duplicates]
+                    keyboard = InlineKeyboardMarkup([[
+                        InlineKeyboardButton("✅ Создать все равно", callback_data="confirm_create_task"),
+                        InlineKeyboardButton("❌ Отмена", callback_data="cancel_create_task")
+                    ]])
+                    await update.effective_message.reply_text(
+                        "⚠️ В очереди уже есть похожие задачи:\n" + "\n".join(lines) + "\n\nСоздать новую задачу?",
+                        reply_markup=keyboard
+                    )
+                    return
+            
             # Создаем задачу в Yandex Tracker
             created_issue = self.tracker_service.create_issue(
                 queue_key=queue_key,
@@ -391,13 +506,28 @@ class TelegramBot:
 
 Задача готова к работе! 🚀
                 """
-                await update.message.reply_text(success_text)
+                await update.effective_message.reply_text(success_text)
             else:
-                await update.message.reply_text("❌ Ошибка при создании задачи в Yandex Tracker.")
+                await update.effective_message.reply_text("❌ Ошибка при создании задачи в Yandex Tracker.")
                 
         except Exception as e:
             logger.error(f"Ошибка при создании задачи: {e}")
-            await update.message.reply_text(f"❌ Произошла ошибка при создании задачи: {str(e)}")
+            await update.effective_message.reply_text(f"❌ Произошла ошибка при создании задачи: {str(e)}")
+
+    async def _find_duplicates(self, queue_key: str, task_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Найти в очереди задачи, похожие на создаваемую"""
+        if not self.issue_index or not queue_key:
+            return []
+        try:
+            return await self.issue_index.find_similar(
+                queue_key,
+                task_data.get('summary') or '',
+                top_k=settings.DUPLICATE_TOP_K,
+                min_score=settings.DUPLICATE_SIMILARITY_THRESHOLD
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось проверить дубликаты в {queue_key}: {e}")
+            return []
 
     async def _show_digest_for_user(self, update: Update, user: User, available_queues: List[str]):
         """Показать дайджест для пользователя"""
@@ -412,16 +542,33 @@ class TelegramBot:
                 async def update_status(status: str):
                     await processing_msg.edit_text(f"📊 {status}")
                 
-                # Генерируем дайджест
-                digest = await self.digest_service.generate_digest(
-                    user_id=user.id,
-                queue_key=queue_key,
-                    since_hours=24,
-                    status_callback=update_status
-                )
+                deadline = Deadline(settings.DIGEST_DEADLINE_SECONDS)
+                if settings.DIGEST_TWO_PHASE:
+                    # Сначала список изменений, резюме LLM - следующим редактированием
+                    draft = await self.digest_service.generate_digest_draft(
+                        user_id=user.id,
+                        queue_key=queue_key,
+                        since_hours=24,
+                        deadline=deadline
+                    )
+                    digest = draft.text
+                    if draft.text:
+                        messages = await self._send_digest_chunks(update.message, draft.text, edit_first=processing_msg)
+                        if draft.finalize:
+                            await self._enrich_digest_message(update.message, messages, draft.text, draft.finalize)
+                        return
+                else:
+                    # Генерируем дайджест
+                    digest = await self.digest_service.generate_digest(
+                        user_id=user.id,
+                        queue_key=queue_key,
+                        since_hours=24,
+                        status_callback=update_status,
+                        deadline=deadline
+                    )
                 
                 if digest:
-                    await processing_msg.edit_text(digest, parse_mode='HTML')
+                    await self._send_digest_chunks(update.message, digest, edit_first=processing_msg)
                 else:
                     await processing_msg.edit_text("❌ Не удалось сформировать дайджест.")
             else:
@@ -431,6 +578,45 @@ class TelegramBot:
             logger.error(f"Ошибка при показе дайджеста: {e}")
             await update.message.reply_text("❌ Произошла ошибка при формировании дайджеста.")
 
+    async def _send_digest_chunks(self, reply_to, text: str, edit_first=None) -> List[Any]:
+        """
+        Отправить дайджест частями не длиннее лимита Telegram
+        
+        Args:
+            reply_to: Сообщение, на которое отвечаем
+            text: HTML-текст дайджеста
+            edit_first: Сообщение, которое заменить первой частью (например, "Формирую дайджест...")
+            
+        Returns:
+            Отправленные сообщения по порядку частей
+        """
+        messages = []
+        for chunk in iter_message_chunks(text):
+            if edit_first is not None and not messages:
+                await edit_first.edit_text(chunk, parse_mode='HTML')
+                messages.append(edit_first)
+            else:
+                messages.append(await reply_to.reply_text(chunk, parse_mode='HTML'))
+        return messages
+
+    async def _enrich_digest_message(self, reply_to, messages: List[Any], draft_text: str, finalize):
+        """Вторая фаза дайджеста: заменить отправленный текст версией с резюме LLM"""
+        try:
+            final_text = await finalize()
+            if not final_text or final_text == draft_text:
+                return
+            draft_chunks = list(iter_message_chunks(draft_text))
+            final_chunks = list(iter_message_chunks(final_text))
+            for index, chunk in enumerate(final_chunks):
+                if index >= len(messages):
+                    messages.append(await reply_to.reply_text(chunk, parse_mode='HTML'))
+                elif index >= len(draft_chunks) or chunk != draft_chunks[index]:
+                    await messages[index].edit_text(chunk, parse_mode='HTML')
+            for message in messages[len(final_chunks):]:
+                await message.delete()
+        except Exception as e:
+            logger.error(f"Не удалось добавить резюме в дайджест: {e}")
+
     async def _set_schedule_from_analysis(self, update: Update, user: User, schedule_time: str):
         """Установить расписание на основе анализа"""
         try:
@@ -476,6 +662,17 @@ class TelegramBot:
                     "Например: 'Нужно исправить баг в авторизации'"
                 )
                 logger.info(f"handle_callback: sent message asking for task description")
+            elif query.data in ("confirm_create_task", "cancel_create_task"):
+                pending_task = context.user_data.pop('pending_task', None)
+                if not pending_task:
+                    await query.edit_message_text("⌛ Запрос на создание задачи устарел.")
+                elif query.data == "cancel_create_task":
+                    await query.edit_message_text("❌ Создание задачи отменено.")
+                else:
+                    await query.edit_message_reply_markup(reply_markup=None)
+                    await self._create_task_from_analysis(
+                        update, pending_task['task_data'], pending_task['queue_key'], check_duplicates=False
+                    )
             else:
                 logger.info(f"handle_callback: unknown callback data: {query.data}")
                 
@@ -491,6 +688,9 @@ class TelegramBot:
 
 📊 <b>Core-функции (стабильные):</b>
 • <code>/send_now</code> - Получить дайджест сейчас
+• <code>/send_now fast</code> - Быстрый дайджест без AI-резюме (статистика изменений)
+• <code>/send_now combined</code> - Один дайджест и одно резюме по всем очередям
+• <code>/rollup [week|month] [очередь]</code> - Сводка за неделю или месяц по сохраненным дайджестам
 • <code>/show_available_queues</code> - Показать доступные очереди
 • <code>/add_queue &lt;ключ&gt;</code> - Добавить очередь для отслеживания
 • <code>/list_queues</code> - Показать ваши очереди
@@ -599,6 +799,19 @@ class TelegramBot:
 
 
 
+    async def _warm_issue_index(self, application: Application):
+        """Начать построение индексов задач всех добавленных очередей при старте бота"""
+        if not self.issue_index:
+            return
+        db = next(get_db())
+        try:
+            queue_keys = {queue_key for (queue_key,) in db.query(Queue.queue_key).distinct()}
+        finally:
+            db.close()
+        for queue_key in queue_keys:
+            self.issue_index.warm(queue_key)
+        logger.info(f"Запущено построение индекса задач для {len(queue_keys)} очередей")
+
     def run_polling(self):
         logger.info("Запуск Telegram бота...")
         self.application.run_polling(allowed_updates=["message", "callback_query"])
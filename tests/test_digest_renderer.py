@@ -0,0 +1,104 @@
+"""
+Тесты нарезки HTML-дайджеста на сообщения Telegram
+"""
+
+import re
+import time
+from html import escape
+from html.parser import HTMLParser
+
+import pytest
+
+from app.core.digest_renderer import TELEGRAM_MESSAGE_LIMIT, DigestBuilder, iter_message_chunks
+
+STATUSES = ["To Do", "In Progress", "Blocked", "Done"]
+# Сборка и нарезка 10 000 задач занимают десятки миллисекунд; запас - на медленные CI
+RENDER_BUDGET_SECONDS = 2.0
+
+
+class TagBalanceParser(HTMLParser):
+    """Проверяет, что каждый открытый тег закрыт в том же сообщении и в правильном порядке"""
+
+    def __init__(self):
+        super().__init__()
+        self.stack = []
+        self.balanced = True
+
+    def handle_starttag(self, tag, attrs):
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack.pop() != tag:
+            self.balanced = False
+
+
+def assert_valid_chunks(chunks, limit=TELEGRAM_MESSAGE_LIMIT):
+    assert chunks
+    for chunk in chunks:
+        assert len(chunk) <= limit
+        parser = TagBalanceParser()
+        parser.feed(chunk)
+        parser.close()
+        assert parser.balanced and not parser.stack, chunk[:200]
+        # HTML-сущности не разрезаются
+        assert not re.search(r'&[a-z#0-9]*$', chunk)
+
+
+def build_digest(issues_count: int) -> str:
+    """Дайджест очереди в формате DigestService: заголовок, резюме и задачи по статусам"""
+    digest = DigestBuilder()
+    digest.line('📊 <b>Дайджест очереди <a href="https://tracker.yandex.ru/queues/QUEUE">QUEUE</a></b>')
+    digest.line(f"📝 <b>Резюме:</b> {escape('Итоги & планы <команды> ' * 40, quote=False)}").line()
+    for index, status in enumerate(STATUSES):
+        keys = range(index, issues_count, len(STATUSES))
+        digest.line(f"📋 <b>{status} ({len(keys)}):</b>")
+        digest.extend_lines([
+            f'• <a href="https://tracker.yandex.ru/QUEUE-{key}">QUEUE-{key}</a> – '
+            f"{escape(f'Задача {key} <про> & обработку данных', quote=False)} (👤 user{key % 37})"
+            for key in keys
+        ])
+        digest.line()
+    return digest.build()
+
+
+def test_large_digest_chunks_fit_limit_with_balanced_tags():
+    text = build_digest(10_000)
+    chunks = list(iter_message_chunks(text))
+
+    assert len(chunks) > 1
+    assert_valid_chunks(chunks)
+    # Строки задач не разрываются и не теряются
+    joined = "\n".join(chunks)
+    assert joined.count("• <a href=") == 10_000
+    assert "QUEUE-9999</a>" in chunks[-1]
+
+
+def test_large_digest_render_and_split_time():
+    started_at = time.perf_counter()
+    text = build_digest(10_000)
+    rendered_at = time.perf_counter()
+    chunks = list(iter_message_chunks(text))
+    finished_at = time.perf_counter()
+
+    print(f"render {(rendered_at - started_at) * 1000:.1f} ms, "
+          f"split {(finished_at - rendered_at) * 1000:.1f} ms, {len(chunks)} messages")
+    assert finished_at - started_at < RENDER_BUDGET_SECONDS
+
+
+def test_long_line_is_split_by_words_and_tags_are_reopened():
+    text = "<b>" + "слово &amp; <i>курсив</i> " * 600 + "</b>"
+    chunks = list(iter_message_chunks(text, limit=500))
+
+    assert len(chunks) > 1
+    assert_valid_chunks(chunks, limit=500)
+    assert all(chunk.startswith("<b>") for chunk in chunks)
+
+
+@pytest.mark.parametrize("text", ["", "   \n"])
+def test_empty_text_yields_nothing(text):
+    assert list(iter_message_chunks(text)) == []
+
+
+def test_short_text_is_single_message():
+    text = build_digest(3)
+    assert list(iter_message_chunks(text)) == [text]
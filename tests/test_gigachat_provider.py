@@ -0,0 +1,122 @@
+"""
+Тесты кэширования токена GigaChat на подмененном транспорте httpx
+"""
+
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from app.core.deadline import Deadline, DeadlineExceeded
+from app.services.llm.gigachat_provider import GigaChatProvider
+
+AUTH_URL = "http://auth.test/api/v2/oauth"
+
+
+class FakeGigaChat:
+    """OAuth-сервер и /chat/completions в одном обработчике"""
+
+    def __init__(self, auth_delay: float = 0.0, token_ttl: float = 1800):
+        self.auth_delay = auth_delay
+        self.token_ttl = token_ttl
+        self.tokens_issued = 0
+        self.revoked = set()
+        self.used_tokens = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        if str(request.url) == AUTH_URL:
+            await asyncio.sleep(self.auth_delay)
+            self.tokens_issued += 1
+            return httpx.Response(200, json={
+                "access_token": f"token-{self.tokens_issued}",
+                "expires_at": int((time.time() + self.token_ttl) * 1000)
+            })
+        token = request.headers["Authorization"].removeprefix("Bearer ")
+        self.used_tokens.append(token)
+        if token in self.revoked:
+            return httpx.Response(401, text="token revoked")
+        content = json.loads(request.content)["messages"][0]["content"]
+        return httpx.Response(200, json={"choices": [{"message": {"content": content}}]})
+
+
+def make_provider(server: FakeGigaChat, **config) -> GigaChatProvider:
+    provider = GigaChatProvider({
+        "auth_url": AUTH_URL,
+        "api_key": "basic-key",
+        "base_url": "http://gigachat.test/api/v1",
+        "model": "GigaChat",
+        **config
+    })
+    provider._client = httpx.AsyncClient(transport=httpx.MockTransport(server))
+    return provider
+
+
+def test_concurrent_requests_share_one_token_fetch():
+    server = FakeGigaChat(auth_delay=0.02)
+
+    async def scenario():
+        provider = make_provider(server)
+        try:
+            return await provider.generate_batch([f"prompt {i}" for i in range(10)])
+        finally:
+            await provider.close()
+
+    assert asyncio.run(scenario()) == [f"prompt {i}" for i in range(10)]
+    assert server.tokens_issued == 1
+    assert set(server.used_tokens) == {"token-1"}
+
+
+def test_token_is_refreshed_ahead_of_expiry():
+    # Токен живет 60 секунд - меньше окна refresh_ahead, но больше жесткого запаса
+    server = FakeGigaChat(token_ttl=60)
+
+    async def scenario():
+        provider = make_provider(server, refresh_ahead=120)
+        try:
+            await provider.generate("first")
+            # Второй запрос идет со старым токеном, новый запрашивается в фоне
+            await provider.generate("second")
+            await provider._refresh_task
+            await provider.generate("third")
+        finally:
+            await provider.close()
+
+    asyncio.run(scenario())
+
+    assert server.used_tokens == ["token-1", "token-1", "token-2"]
+    assert server.tokens_issued >= 2
+
+
+def test_token_is_replaced_after_401():
+    server = FakeGigaChat()
+
+    async def scenario():
+        provider = make_provider(server)
+        try:
+            await provider.generate("first")
+            server.revoked.add("token-1")
+            return await provider.generate("second")
+        finally:
+            await provider.close()
+
+    assert asyncio.run(scenario()) == "second"
+    assert server.used_tokens == ["token-1", "token-1", "token-2"]
+
+
+def test_deadline_bounds_token_fetch():
+    server = FakeGigaChat(auth_delay=5)
+
+    async def scenario():
+        provider = make_provider(server)
+        started_at = time.monotonic()
+        try:
+            with pytest.raises(DeadlineExceeded):
+                await provider.generate("prompt", deadline=Deadline(0.05))
+            return time.monotonic() - started_at
+        finally:
+            await provider.close()
+
+    assert asyncio.run(scenario()) < 1
+    assert server.used_tokens == []
@@ -0,0 +1,122 @@
+"""
+Тесты OpenAI-совместимого провайдера на подмененном транспорте httpx
+"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.core.deadline import Deadline, DeadlineExceeded
+from app.services.llm.openai_provider import OpenAICompatibleProvider
+
+
+def make_provider(handler, **config) -> OpenAICompatibleProvider:
+    provider = OpenAICompatibleProvider({"base_url": "http://llm.test/v1", "model": "test-model", **config})
+    provider._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return provider
+
+
+def completion(content: str) -> httpx.Response:
+    return httpx.Response(200, json={
+        "choices": [{"message": {"content": content}}],
+        "usage": {"prompt_tokens": 3, "completion_tokens": 2}
+    })
+
+
+def test_generate_batch_runs_concurrently_within_limit():
+    state = {"active": 0, "peak": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        await asyncio.sleep(0.01)
+        state["active"] -= 1
+        return completion(json.loads(request.content)["messages"][0]["content"].upper())
+
+    async def scenario():
+        provider = make_provider(handler, max_concurrency=3)
+        try:
+            return await provider.generate_batch([f"prompt {i}" for i in range(10)])
+        finally:
+            await provider.close()
+
+    results = asyncio.run(scenario())
+
+    assert results == [f"PROMPT {i}" for i in range(10)]
+    assert 1 < state["peak"] <= 3
+
+
+def test_chat_stream_yields_sse_chunks():
+    payloads = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        payloads.append(json.loads(request.content))
+        events = [{"choices": [{"delta": {"content": part}}]} for part in ("При", "вет", "!")]
+        body = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+        return httpx.Response(200, text=body, headers={"Content-Type": "text/event-stream"})
+
+    async def scenario():
+        provider = make_provider(handler)
+        try:
+            return [chunk async for chunk in provider.chat_stream([{"role": "user", "content": "hi"}])]
+        finally:
+            await provider.close()
+
+    assert asyncio.run(scenario()) == ["При", "вет", "!"]
+    assert payloads[0]["stream"] is True
+    assert payloads[0]["stream_options"] == {"include_usage": True}
+
+
+def test_json_mode_requests_json_object():
+    payloads = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        payloads.append(json.loads(request.content))
+        return completion('{"ok": true}')
+
+    async def scenario():
+        provider = make_provider(handler, api_key="secret")
+        try:
+            return await provider.generate("prompt", json_mode=True, num_predict=64)
+        finally:
+            await provider.close()
+
+    assert asyncio.run(scenario()) == '{"ok": true}'
+    assert payloads[0]["response_format"] == {"type": "json_object"}
+    assert payloads[0]["max_tokens"] == 64
+
+
+def test_deadline_cancels_slow_request():
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(5)
+        return completion("late")
+
+    async def scenario():
+        provider = make_provider(handler)
+        try:
+            await provider.generate("prompt", deadline=Deadline(0.05))
+        finally:
+            await provider.close()
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(scenario())
+
+
+def test_deadline_covers_auth_headers():
+    class SlowAuthProvider(OpenAICompatibleProvider):
+        async def _auth_headers(self):
+            await asyncio.sleep(5)
+            return {}
+
+    async def scenario():
+        provider = SlowAuthProvider({"base_url": "http://llm.test/v1", "model": "test-model"})
+        provider._client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: completion("ok")))
+        try:
+            await provider.generate("prompt", deadline=Deadline(0.05))
+        finally:
+            await provider.close()
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(scenario())
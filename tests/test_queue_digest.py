@@ -0,0 +1,75 @@
+"""
+Тесты общего кэша результатов обработки очередей
+"""
+
+import asyncio
+
+import pytest
+
+from app.core.queue_digest import SharedResultCache
+
+
+def test_timed_out_waiter_does_not_abort_shared_compute():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "result"
+
+    async def scenario():
+        cache = SharedResultCache(ttl=60)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(cache.get_or_compute("key", compute), timeout=0.01)
+        # Вычисление продолжается - второй подписчик ждет ту же задачу
+        assert "key" in cache._inflight
+        second = await cache.get_or_compute("key", compute)
+        # Результат сохранен, хотя первый подписчик ушел по таймауту
+        third = await cache.get_or_compute("key", compute)
+        return second, third, cache
+
+    second, third, cache = asyncio.run(scenario())
+
+    assert second == third == "result"
+    assert len(calls) == 1
+    assert cache.stats() == {"size": 1, "hits": 2, "misses": 1}
+    assert not cache._inflight
+
+
+def test_result_is_cached_after_all_waiters_time_out():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def scenario():
+        cache = SharedResultCache(ttl=60)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(cache.get_or_compute("key", compute), timeout=0.01)
+        await asyncio.sleep(0.1)
+        return await cache.get_or_compute("key", compute)
+
+    assert asyncio.run(scenario()) == "result"
+    assert len(calls) == 1
+
+
+def test_not_cacheable_and_failed_results_are_recomputed():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return len(calls)
+
+    async def scenario():
+        cache = SharedResultCache(ttl=60)
+        with pytest.raises(RuntimeError):
+            await cache.get_or_compute("key", compute)
+        partial = await cache.get_or_compute("key", compute, cacheable=lambda result: False)
+        full = await cache.get_or_compute("key", compute)
+        return partial, full, await cache.get_or_compute("key", compute)
+
+    assert asyncio.run(scenario()) == (2, 3, 3)
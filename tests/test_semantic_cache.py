@@ -0,0 +1,36 @@
+"""
+Тесты семантического кэша ответов LLM
+"""
+
+from app.services.llm.semantic_cache import BUCKET_INITIAL_ROWS, SemanticCache
+
+
+def test_least_recently_used_key_is_evicted():
+    cache = SemanticCache(max_keys=2)
+    cache.store("a", [1.0, 0.0], {"action": "a"})
+    cache.store("b", [1.0, 0.0], {"action": "b"})
+    # Обращение к "a" делает вытесняемым "b"
+    assert cache.lookup("a", [1.0, 0.0]) == {"action": "a"}
+    cache.store("c", [1.0, 0.0], {"action": "c"})
+
+    assert cache.stats()["keys"] == 2
+    assert cache.lookup("b", [1.0, 0.0]) is None
+    assert cache.lookup("a", [1.0, 0.0]) == {"action": "a"}
+    assert cache.lookup("c", [1.0, 0.0]) == {"action": "c"}
+
+
+def test_bucket_grows_lazily_and_keeps_entries():
+    capacity = BUCKET_INITIAL_ROWS * 4
+    cache = SemanticCache(capacity=capacity)
+    cache.store("key", [1.0, 0.0, 0.0], {"n": 0})
+    bucket = cache._buckets["key"]
+    assert len(bucket.vectors) == BUCKET_INITIAL_ROWS
+
+    for n in range(1, capacity + 3):
+        vector = [1.0, float(n), 0.0]
+        cache.store("key", vector, {"n": n})
+    assert len(bucket.vectors) == capacity
+    assert bucket.size == capacity
+    # Самые старые записи вытеснены, последние находятся
+    assert cache.lookup("key", [1.0, 0.0, 0.0]) is None
+    assert cache.lookup("key", [1.0, float(capacity + 2), 0.0]) == {"n": capacity + 2}